@@ -1,9 +1,22 @@
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import sqlite3
+import glob
+import threading
+import datetime
 import numpy as np
 import math
+import json
 import os
+from detection_store import (ReadConnectionPool, open_db, open_read_db, attach_ml, detections_source, filter_clause,
+                             union_count, union_page, insert_sql)
+import detection_export
+import detection_aggregates
+import detection_rollups
+import detection_shipper
+from db_migrations import migrate_database
+from signal_features import stored_spectrum_peaks
+from channel_plan import plan_capture_groups, spectrum_span
 
 app = Flask(__name__)
 # Always use data folder for database
@@ -11,8 +24,33 @@ DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 DB_PATH = os.getenv('DB_PATH', os.path.join(DATA_DIR, 'detections.db'))
+# ML listener database, attached read-only so ?detector=ml|all can query both stores
+ML_DB_PATH = os.getenv('ML_DB_PATH', os.path.join(os.path.dirname(DB_PATH), 'detections_ml.db'))
+# Listener capture rate: the span of the stored power spectra
+SAMPLE_RATE = float(os.getenv('SAMPLE_RATE', '2048000'))
 
-# Initialize database with WAL mode for concurrent access
+# Apply pending schema migrations before serving (AUTO_MIGRATE=0 to skip, e.g. read-only mounts)
+if os.getenv('AUTO_MIGRATE', '1') == '1':
+    for kind, path in (('classic', DB_PATH), ('ml', ML_DB_PATH)):
+        if kind == 'ml' and not os.path.exists(path):
+            continue
+        try:
+            migrate_database(path, kind)
+        except sqlite3.Error as e:
+            print(f"⚠️  Could not migrate {path}: {e}")
+
+# Read-only connections, one per server thread, reused across requests
+read_pool = ReadConnectionPool(
+    DB_PATH,
+    ml_db_path=ML_DB_PATH,
+    mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    cache_size_kb=int(os.getenv('SQLITE_CACHE_KB', '16384'))
+)
+
+def get_read_connection():
+    return read_pool.get()
+
+# Initialize database with WAL mode for concurrent access (writes only)
 def get_db_connection():
     conn = sqlite3.connect(DB_PATH, timeout=30.0)
     conn.execute('PRAGMA journal_mode=WAL')
@@ -102,15 +140,22 @@ def process_chart_data(detections, chart_type):
         } for d in detections]
     
     elif chart_type in ['spectrum', 'peaks']:
-        return [{
-            'id': d.get('id'),
-            'label': d.get('label', 'Unknown'),
-            'timestamp': d.get('timestamp'),
-            'freq': d.get('freq', 0) / 1e6,
-            'power_spectrum': decode_power_spectrum(d.get('power_spectrum')),
-            'peak_power': d.get('peak_power', 0),
-            'noise_floor': d.get('noise_floor', 0)
-        } for d in detections]
+        data = []
+        for d in detections:
+            spectrum = decode_power_spectrum(d.get('power_spectrum'))
+            item = {
+                'id': d.get('id'),
+                'label': d.get('label', 'Unknown'),
+                'timestamp': d.get('timestamp'),
+                'freq': d.get('freq', 0) / 1e6,
+                'power_spectrum': spectrum,
+                'peak_power': d.get('peak_power', 0),
+                'noise_floor': d.get('noise_floor', 0)
+            }
+            if chart_type == 'peaks':
+                item['peaks'], item['peak_freqs_mhz'] = stored_spectrum_peaks(spectrum, d.get('freq'), row_spectrum_span(d))
+            data.append(item)
+        return data
     
     elif chart_type == 'waterfall':
         return [{
@@ -152,6 +197,26 @@ def decode_raw_samples_q(raw_samples_blob):
     except:
         return []
 
+_listener_plan = None
+
+def listener_plan():
+    """The listener's capture groups, rebuilt from baseline.json for rows without spectrum_span."""
+    global _listener_plan
+    if _listener_plan is None:
+        try:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')) as f:
+                channels = [(sig['freq'], sig['label']) for sig in json.load(f)]
+        except (OSError, ValueError, KeyError):
+            channels = []
+        _listener_plan = plan_capture_groups(channels, SAMPLE_RATE)
+    return _listener_plan
+
+def row_spectrum_span(d):
+    """Span (Hz) of a row's stored power spectrum: the capture rate, or a grouped channel's sub-band."""
+    if d.get('spectrum_span'):
+        return d['spectrum_span']
+    return spectrum_span(d.get('freq'), d.get('label'), listener_plan(), SAMPLE_RATE)
+
 def decode_power_spectrum(power_spectrum_blob):
     """Decode power spectrum from binary data."""
     if not power_spectrum_blob:
@@ -162,45 +227,54 @@ def decode_power_spectrum(power_spectrum_blob):
         return []
 
 # Helper: fetch unique devices
-def fetch_devices():
-    conn = get_db_connection()
+def fetch_devices(params=None):
+    table = detections_source(params or {})
+    conn = get_read_connection()
     c = conn.cursor()
-    c.execute("SELECT DISTINCT device_label, device_lat, device_long FROM detections")
+    c.execute(f"SELECT DISTINCT device_label, device_lat, device_long FROM {table}")
     devices = [
         {"device_label": row[0], "device_lat": row[1], "device_long": row[2]}
         for row in c.fetchall()
     ]
-    conn.close()
     return devices
 
 @app.route('/devices', methods=['GET'])
 def get_devices():
-    return jsonify(fetch_devices())
+    try:
+        return jsonify(fetch_devices(request.args.to_dict()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 # Helper: fetch unique signal labels
-def fetch_signal_labels():
-    conn = get_db_connection()
+def fetch_signal_labels(params=None):
+    table = detections_source(params or {})
+    conn = get_read_connection()
     c = conn.cursor()
-    c.execute("SELECT DISTINCT label, COUNT(*) as count FROM detections GROUP BY label ORDER BY count DESC")
+    c.execute(f"SELECT label, COUNT(*) as count FROM {table} GROUP BY label ORDER BY count DESC")
     labels = [
         {"label": row[0], "count": row[1]}
         for row in c.fetchall()
     ]
-    conn.close()
     return labels
 
 @app.route('/signal_labels', methods=['GET'])
 def get_signal_labels():
     """Get list of all unique signal labels in the database with their counts."""
-    return jsonify(fetch_signal_labels())
+    try:
+        return jsonify(fetch_signal_labels(request.args.to_dict()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 # Helper: fetch detections with search, sort, filter, pagination
 def fetch_detections(params):
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    # detector=ml|all pages over the ML database too (raises ValueError if unknown)
+    detector = params.get('detector', 'classic')
+    detections_source(params)
+    conn = get_read_connection()
     c = conn.cursor()
     # Build query
-    query = "SELECT * FROM detections WHERE 1=1"
+    base_query = "SELECT * FROM detections WHERE 1=1"
+    query = base_query
     args = []
     # Filtering
     if 'device_label' in params:
@@ -227,9 +301,13 @@ def fetch_detections(params):
         args.append(f"%{params['search']}%")
     
     # Get total count before pagination
-    count_query = query.replace("SELECT *", "SELECT COUNT(*)")
-    c.execute(count_query, args)
-    total_count = c.fetchone()[0]
+    if detector == 'classic':
+        count_query = query.replace("SELECT *", "SELECT COUNT(*)")
+        c.execute(count_query, args)
+        total_count = c.fetchone()[0]
+    else:
+        where = query[len(base_query):]
+        total_count = union_count(conn, detector, where, args)
     
     # Sorting
     sort = params.get('sort', 'timestamp')
@@ -267,11 +345,14 @@ def fetch_detections(params):
         page_size = min(page_size, 100)
     
     offset = (page - 1) * page_size
-    query += " LIMIT ? OFFSET ?"
-    args.extend([page_size, offset])
-    # Execute
-    c.execute(query, args)
-    rows = c.fetchall()
+    if detector == 'classic':
+        query += " LIMIT ? OFFSET ?"
+        args.extend([page_size, offset])
+        # Execute
+        c.execute(query, args)
+        rows = c.fetchall()
+    else:
+        rows = union_page(conn, detector, where, args, sort, order, page_size, offset)
     # Format for charting
     detections = []
     for row in rows:
@@ -292,13 +373,15 @@ def fetch_detections(params):
         else:
             det['waterfall_data'] = []
         detections.append(det)
-    conn.close()
     return detections, total_count, page, page_size
 
 @app.route('/detections', methods=['GET'])
 def get_detections():
     params = request.args.to_dict()
-    detections, total, page, limit = fetch_detections(params)
+    try:
+        detections, total, page, limit = fetch_detections(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     # Format for charting: group by chart type
     chart_type = params.get('chart', 'spectrum')
     if chart_type == 'spectrum':
@@ -324,7 +407,9 @@ def get_detections():
                 'power_spectrum': spectrum,
                 'peak_power': d['peak_power'],
                 'snr': d['snr'],
-                'bandwidth': d['bandwidth']
+                'bandwidth': d['bandwidth'],
+                'detector': d.get('detector', 'classic'),
+                'cnn_confidence': d.get('cnn_confidence')
             })
     elif chart_type == 'histogram':
         data = []
@@ -452,20 +537,20 @@ def get_detections():
                 'timestamp': d['timestamp']
             })
     elif chart_type == 'peaks':
-        # Peak detection: spectrum and peak indices
+        # Peak detection: spectrum, peak indices and their frequencies
         data = []
         for d in detections:
             if d.get('power_spectrum'):
-                arr = np.array(d['power_spectrum'])
-                noise_floor = np.median(arr)
-                peaks = np.where(arr > noise_floor + 6)[0].tolist()
+                arr = np.frombuffer(d['power_spectrum'], dtype=np.float32)
+                peaks, peak_freqs = stored_spectrum_peaks(arr, d['freq'], row_spectrum_span(d))
             else:
-                arr, peaks = [], []
+                arr, peaks, peak_freqs = [], [], []
             data.append({
                 'id': d['id'],
                 'label': d['label'],
                 'power_spectrum': arr.tolist() if len(arr) else [],
                 'peaks': peaks,
+                'peak_freqs_mhz': peak_freqs,
                 'timestamp': d['timestamp']
             })
     elif chart_type == 'scatter':
@@ -559,39 +644,40 @@ def delete_detection(det_id):
 
 @app.route('/statistics', methods=['GET'])
 def get_statistics():
-    """Get comprehensive statistics for dashboard."""
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
+    """Get comprehensive statistics for dashboard (detector=classic|ml|all)."""
+    try:
+        table = detections_source(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    conn = get_read_connection()
     c = conn.cursor()
     
     # Basic counts
-    c.execute('SELECT COUNT(*) as total_detections FROM detections')
+    c.execute(f'SELECT COUNT(*) as total_detections FROM {table}')
     total = c.fetchone()['total_detections']
     
-    c.execute('SELECT COUNT(DISTINCT device_label) as device_count FROM detections')
+    c.execute(f'SELECT COUNT(DISTINCT device_label) as device_count FROM {table}')
     devices = c.fetchone()['device_count']
     
-    c.execute('SELECT COUNT(DISTINCT label) as signal_types FROM detections')
+    c.execute(f'SELECT COUNT(DISTINCT label) as signal_types FROM {table}')
     signal_types = c.fetchone()['signal_types']
     
     # Recent activity (last 24 hours)
-    c.execute("SELECT COUNT(*) as recent FROM detections WHERE datetime(timestamp) > datetime('now', '-24 hours')")
+    c.execute(f"SELECT COUNT(*) as recent FROM {table} WHERE datetime(timestamp) > datetime('now', '-24 hours')")
     recent = c.fetchone()['recent']
     
     # Quality metrics
-    c.execute('SELECT AVG(snr) as avg_snr, AVG(signal_quality_index) as avg_quality FROM detections WHERE snr IS NOT NULL')
+    c.execute(f'SELECT AVG(snr) as avg_snr, AVG(signal_quality_index) as avg_quality FROM {table} WHERE snr IS NOT NULL')
     quality = c.fetchone()
     
     # Frequency distribution
-    c.execute('SELECT label, COUNT(*) as count FROM detections GROUP BY label ORDER BY count DESC LIMIT 10')
+    c.execute(f'SELECT label, COUNT(*) as count FROM {table} GROUP BY label ORDER BY count DESC LIMIT 10')
     freq_dist = [dict(row) for row in c.fetchall()]
     
     # Time distribution (hourly)
-    c.execute("SELECT strftime('%H', timestamp) as hour, COUNT(*) as count FROM detections GROUP BY hour ORDER BY hour")
+    c.execute(f"SELECT strftime('%H', timestamp) as hour, COUNT(*) as count FROM {table} GROUP BY hour ORDER BY hour")
     hourly = [dict(row) for row in c.fetchall()]
     
-    conn.close()
-    
     return jsonify({
         'summary': {
             'total_detections': total,
@@ -623,7 +709,10 @@ def get_chart_data(chart_type):
     }
     
     params['page_size'] = chart_page_sizes.get(chart_type, 50)
-    detections, total, page, limit = fetch_detections(params)
+    try:
+        detections, total, page, limit = fetch_detections(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Process data based on chart type
     if chart_type in ['time_series', 'frequency_analysis', 'signal_quality', 'advanced_spectral', 'modulation_analysis', 'performance_metrics', 'constellation', 'peaks', 'spectrum', 'waterfall', 'histogram', 'scatter', 'timeline', 'signal_strength', 'frequency_distribution']:
@@ -655,6 +744,202 @@ def get_chart_data(chart_type):
 
 
 
+# Server-side aggregation for heatmap and distribution charts
+AGGREGATIONS = {
+    'heatmap': detection_aggregates.heatmap,
+    'frequency': detection_aggregates.frequency_distribution,
+    'time': detection_aggregates.time_distribution
+}
+
+@app.route('/aggregate/<kind>', methods=['GET'])
+def get_aggregate(kind):
+    """
+    Binned detections over the full history.
+    heatmap: time x frequency matrix (by_label=1 splits per label);
+    frequency: count and mean metric per frequency bin and label;
+    time: statistic per time bin and label.
+    Query params: metric, stat (count|mean|min|max), freq_bin (Hz), time_bin (s),
+    plus the usual start/end/device_label/label(s)/min_freq/max_freq filters
+    and detector (classic|ml|all).
+    """
+    if kind not in AGGREGATIONS:
+        return jsonify({'error': f"Unknown aggregation '{kind}'", 'available': list(AGGREGATIONS)}), 404
+    params = request.args.to_dict()
+    try:
+        return jsonify(AGGREGATIONS[kind](get_read_connection(), params, table=detections_source(params)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Level-of-detail time series for long-range charts
+@app.route('/timeseries', methods=['GET'])
+def get_time_series():
+    """
+    Fixed number of min/max/mean points for any time range.
+    Query params: metrics (comma-separated: snr, peak_power, confidence_score,
+    activity_score), points (default 500), start/end (ISO), device_label, label(s).
+    Rollups are built from the classic detections table only.
+    """
+    try:
+        return jsonify(detection_rollups.time_series(get_read_connection(), request.args.to_dict()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Detection events: one row per anomalous period, rewritten at each heartbeat
+@app.route('/events', methods=['GET'])
+def get_events():
+    """
+    Detection events, newest first.
+    Query params: status (open|closed), limit (default 100, max 1000), plus the
+    usual start/end/device_label/label(s)/min_freq/max_freq filters on the event start.
+    """
+    params = request.args.to_dict()
+    try:
+        clause, args = filter_clause(params)
+        limit = min(max(int(params.get('limit', 100)), 1), 1000)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if 'status' in params:
+        clause += " AND status = ?"
+        args.append(params['status'])
+    c = get_read_connection().execute(
+        f"SELECT * FROM detection_events WHERE 1=1{clause} ORDER BY timestamp DESC LIMIT ?", args + [limit])
+    return jsonify([dict(row) for row in c.fetchall()])
+
+# Bulk export: streams every matching row in fixed-size chunks (constant memory)
+@app.route('/export', methods=['GET'])
+def export_detections():
+    """
+    Stream detections as CSV, Parquet or NPZ.
+    Query params: format (csv|parquet|npz), columns (comma-separated),
+    include_blobs (1 to add BLOB columns), start/end (ISO timestamps),
+    device_label, label/labels, min_freq/max_freq, detector, limit, chunk.
+    """
+    params = request.args.to_dict()
+    fmt = params.get('format', 'csv').lower()
+    if fmt not in detection_export.FORMATS:
+        return jsonify({'error': f"Unsupported format '{fmt}'", 'formats': list(detection_export.FORMATS)}), 400
+    if fmt == 'parquet' and not detection_export.PARQUET_AVAILABLE:
+        return jsonify({'error': 'Parquet export requires pyarrow on the server'}), 501
+    try:
+        table = detections_source(params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Dedicated connection: a long export must not hold a request thread's pooled one
+    conn = open_read_db(DB_PATH)
+    conn.row_factory = None
+    try:
+        if table != 'detections':
+            attach_ml(conn, ML_DB_PATH)
+        types = detection_export.table_columns(conn, table)
+        requested = [c.strip() for c in params['columns'].split(',') if c.strip()] if params.get('columns') else None
+        columns = detection_export.select_columns(types, requested, params.get('include_blobs') in ('1', 'true', 'yes'))
+        # Malformed numbers (min_freq/max_freq, limit, chunk) are a bad request, not a server error
+        clause, args = filter_clause(params)
+        limit = int(params['limit']) if 'limit' in params else None
+        chunk_rows = min(max(int(params.get('chunk', detection_export.default_chunk_rows(columns, types))), 10), 50000)
+    except (ValueError, sqlite3.Error) as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 400
+
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE 1=1{clause}"
+    # Rowid order streams straight off the table without a sort; the views stream store by store
+    if table == 'detections':
+        query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT ?"
+        args.append(limit)
+
+    def generate():
+        try:
+            cursor = conn.execute(query, args)
+            yield from detection_export.STREAMERS[fmt](cursor, columns, types, chunk_rows)
+        finally:
+            conn.close()
+
+    mimetype, extension = detection_export.FORMATS[fmt]
+    filename = f"detections-{datetime.datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# Collector for field listeners (detection_shipper.py): one gzip batch per request
+INGEST_TOKEN = os.getenv('INGEST_TOKEN')
+INGEST_DATABASES = {'detections': ('classic', DB_PATH), 'detection_events': ('classic', DB_PATH),
+                    'detections_ml': ('ml', ML_DB_PATH)}
+# refresh_rollups serialises refreshers across processes with BEGIN IMMEDIATE; this lock only
+# keeps concurrent ingest threads from queueing on SQLite's busy timeout
+rollup_lock = threading.Lock()
+
+@app.route('/ingest', methods=['POST'])
+def ingest_batch():
+    """
+    Bulk-insert one batch from a remote listener. Batches are idempotent: the
+    batch_id is logged in ingest_batches in the same transaction as the rows,
+    so a retried upload returns 'duplicate' without inserting again.
+    """
+    if INGEST_TOKEN and request.headers.get('Authorization') != f'Bearer {INGEST_TOKEN}':
+        return jsonify({'error': 'Invalid or missing ingest token'}), 401
+    try:
+        batch = detection_shipper.decode_batch(request.get_data(), request.headers.get('Content-Encoding') == 'gzip')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    table = batch['table']
+    if table not in INGEST_DATABASES:
+        return jsonify({'error': f"Unknown table '{table}'", 'tables': list(INGEST_DATABASES)}), 400
+    kind, path = INGEST_DATABASES[table]
+    if kind == 'ml' and not os.path.exists(path):
+        migrate_database(path, kind)
+
+    conn = open_db(path)
+    try:
+        allowed = set(detection_export.table_columns(conn, table)) - {'id'}
+        columns = batch['columns']
+        unknown = [c for c in columns if c not in allowed]
+        if unknown:
+            return jsonify({'error': f"Unknown column(s): {', '.join(unknown)}"}), 400
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO ingest_batches (batch_id, device_label, table_name, rows, received_at) VALUES (?, ?, ?, ?, ?)',
+                (batch['batch_id'], batch.get('device_label'), table, len(batch['rows']), datetime.datetime.now().isoformat())
+            )
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return jsonify({'status': 'duplicate', 'batch_id': batch['batch_id'], 'rows': 0})
+        # Event rows are upserts: heartbeats rewrite the open event in place
+        try:
+            conn.executemany(insert_sql(table, columns), batch['rows'])
+        except (sqlite3.ProgrammingError, sqlite3.InterfaceError, sqlite3.DataError,
+                TypeError, ValueError, OverflowError) as e:
+            # Rows SQLite can't bind (wrong length, nested lists/dicts, huge ints) fail on every
+            # retry, so reject them: 503 would hold every batch spooled behind this one
+            conn.rollback()
+            return jsonify({'error': f"Invalid rows: {e}"}), 400
+        conn.commit()
+        if table == 'detections':
+            with rollup_lock:
+                detection_rollups.refresh_rollups(conn)
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'error': f"Database error: {e}"}), 503
+    finally:
+        conn.close()
+    return jsonify({'status': 'ingested', 'batch_id': batch['batch_id'], 'rows': len(batch['rows'])})
+
+# Prometheus-style metrics written by the listeners (data/*.prom status files)
+@app.route('/metrics')
+def metrics():
+    """Serve listener stage timings, sweep and writer metrics for scraping."""
+    parts = []
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(DB_PATH), '*.prom'))):
+        try:
+            with open(path) as f:
+                parts.append(f.read())
+        except OSError:
+            continue
+    parts.append("# TYPE rtlsdr_api_up gauge\nrtlsdr_api_up 1\n")
+    return Response(''.join(parts), mimetype='text/plain; version=0.0.4')
+
 # HTML page with Chart.js for interactive charting
 @app.route('/')
 def dashboard():
@@ -666,9 +951,7 @@ def health_check():
     """Health check endpoint for container monitoring."""
     try:
         # Check database connectivity
-        conn = get_db_connection()
-        conn.execute("SELECT 1")
-        conn.close()
+        get_read_connection().execute("SELECT 1")
         
         return jsonify({
             'status': 'healthy',
@@ -676,6 +959,7 @@ def health_check():
             'service': 'rtl-sdr-api'
         }), 200
     except Exception as e:
+        read_pool.reset()
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
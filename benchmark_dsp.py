@@ -0,0 +1,308 @@
+"""
+Reproducible DSP benchmark for the detection pipeline.
+Feeds fixed synthetic captures (and optionally recorded IQ files) through the
+same stages the listeners run per capture, and reports per-stage time,
+throughput and peak memory. Results are stored as JSON so runs can be compared:
+
+    python benchmark_dsp.py                          # run and save data/benchmarks/dsp-<time>.json
+    python benchmark_dsp.py --compare old.json       # also flag stages slower than old.json
+    python benchmark_dsp.py --iq capture.cu8         # add a recorded rtl_sdr capture
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT_DIR = os.path.join(SCRIPT_DIR, 'data', 'benchmarks')
+
+SAMPLE_RATE = 2.048e6
+SAMPLES = 256*1024
+SEED = 1234
+
+# Synthetic signals: name -> (baseline label, nominal frequency)
+SIGNALS = {
+    "fm_broadcast": ("wfm", 98.1e6),
+    "gsm_burst": ("gsm_nigeria_900", 935.2e6),
+    "pmr446_voice": ("walkie_pmr446", 446.00625e6),
+    "dmr_tdma": ("dmr", 446.1e6),
+    "noise": ("wfm", 88.5e6)
+}
+
+# Differences smaller than this are timer noise, never reported as regressions
+MIN_DELTA_S = 50e-6
+
+STAGES = ["iq_convert", "fft", "cfar", "bursts", "basic_features", "advanced_features", "quality_metrics",
+          "matcher", "ml_extract_features", "db_insert"]
+
+def _noise(rng, n, level=0.02):
+    return level * (rng.standard_normal(n) + 1j * rng.standard_normal(n)) / np.sqrt(2)
+
+def _fm(message, deviation, sample_rate=SAMPLE_RATE):
+    phase = 2 * np.pi * deviation * np.cumsum(message) / sample_rate
+    return np.exp(1j * phase)
+
+def synth_fm_broadcast(rng, n=SAMPLES):
+    """Wideband FM carrier, 75 kHz deviation, modulated by a mix of tones."""
+    t = np.arange(n) / SAMPLE_RATE
+    audio = 0.5 * np.sin(2 * np.pi * 1000 * t) + 0.3 * np.sin(2 * np.pi * 3700 * t) + 0.2 * np.sin(2 * np.pi * 19e3 * t)
+    return 0.5 * _fm(audio, 75e3) + _noise(rng, n)
+
+def synth_gsm_burst(rng, n=SAMPLES):
+    """GMSK-like 270.833 kbit/s burst in one of eight 577 us timeslots."""
+    bit_rate = 270833.0
+    sps = SAMPLE_RATE / bit_rate
+    bits = rng.integers(0, 2, int(n / sps) + 2) * 2 - 1
+    symbols = bits[(np.arange(n) / sps).astype(int)].astype(float)
+    # Gaussian pulse shaping (BT = 0.3) of the frequency pulses
+    taps = np.arange(-2 * int(sps), 2 * int(sps) + 1)
+    gauss = np.exp(-0.5 * (taps / (0.44 * sps / 0.3)) ** 2)
+    shaped = np.convolve(symbols, gauss / gauss.sum(), mode='same')
+    carrier = _fm(shaped, bit_rate / 4)
+    slot = int(577e-6 * SAMPLE_RATE)
+    gate = (np.arange(n) // slot) % 8 == 0
+    return 0.4 * carrier * gate + _noise(rng, n)
+
+def synth_pmr446_voice(rng, n=SAMPLES):
+    """Narrowband FM voice, 2.5 kHz deviation, band-limited noise plus CTCSS tone."""
+    t = np.arange(n) / SAMPLE_RATE
+    voice = np.convolve(rng.standard_normal(n), np.ones(64) / 64, mode='same') * 4
+    audio = np.clip(voice, -1, 1) + 0.1 * np.sin(2 * np.pi * 88.5 * t)
+    return 0.3 * _fm(audio, 2.5e3) + _noise(rng, n)
+
+def synth_dmr_tdma(rng, n=SAMPLES):
+    """4FSK at 4800 symbols/s in alternating 30 ms TDMA slots."""
+    sps = SAMPLE_RATE / 4800
+    levels = np.array([-1944.0, -648.0, 648.0, 1944.0])
+    symbols = levels[rng.integers(0, 4, int(n / sps) + 2)]
+    freq = symbols[(np.arange(n) / sps).astype(int)]
+    carrier = np.exp(2j * np.pi * np.cumsum(freq) / SAMPLE_RATE)
+    gate = (np.arange(n) // int(0.03 * SAMPLE_RATE)) % 2 == 0
+    return 0.3 * carrier * gate + _noise(rng, n)
+
+def synth_noise(rng, n=SAMPLES):
+    return _noise(rng, n, level=0.05)
+
+def synthetic_captures(n=SAMPLES, seed=SEED):
+    """Fixed-seed captures keyed by signal name: (samples, freq, label)."""
+    generators = {
+        "fm_broadcast": synth_fm_broadcast,
+        "gsm_burst": synth_gsm_burst,
+        "pmr446_voice": synth_pmr446_voice,
+        "dmr_tdma": synth_dmr_tdma,
+        "noise": synth_noise
+    }
+    captures = {}
+    for name, make in generators.items():
+        rng = np.random.default_rng(seed)
+        label, freq = SIGNALS[name]
+        captures[name] = (make(rng, n).astype(np.complex64), freq, label)
+    return captures
+
+def load_iq(path, n=SAMPLES):
+    """Load a recorded capture: rtl_sdr .cu8/.bin (interleaved uint8) or a complex .npy array."""
+    if path.endswith('.npy'):
+        samples = np.load(path)
+    else:
+        from sdr_capture import IQConverter
+        raw = np.fromfile(path, dtype=np.uint8, count=2 * n)
+        samples = IQConverter(len(raw) // 2).convert(raw)
+    if len(samples) < n:
+        raise ValueError(f"{path} holds {len(samples)} samples, need {n}")
+    return samples[:n].astype(np.complex64)
+
+def time_call(fn, repeat, min_time=0.02):
+    """
+    Median wall time of one fn() call over repeat runs, after a warm-up call.
+    Fast stages are looped inside each run until it lasts min_time, so
+    microsecond-scale steps are not lost in timer noise.
+    """
+    start = time.perf_counter()
+    fn()
+    number = max(1, int(min_time / max(time.perf_counter() - start, 1e-7)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return float(np.median(times))
+
+def peak_memory(fn):
+    """Peak traced allocation (bytes) of a single fn() call."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def stage_calls(listen, ml_listen, samples, freq, label, conn):
+    """Build zero-argument callables for each pipeline stage on one capture."""
+    from detection_store import insert_rows
+    from sdr_capture import IQConverter
+    from burst_detector import CaptureBursts
+    from cfar import spectrum_noise
+    # The capture as the dongle delivers it: interleaved uint8 I/Q
+    iq = np.stack([samples.real, samples.imag], axis=1).ravel()
+    raw_bytes = np.clip(np.round(iq / max(np.abs(iq).max(), 1e-12) * 127 + 127.5), 0, 255).astype(np.uint8)
+    converter = IQConverter(len(samples))
+    power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
+    raw = samples[:2048]
+    # As in listen_and_flag: thresholds follow the local CFAR noise level unless CFAR=0
+    noise = spectrum_noise(power) if listen.CFAR_ENABLED else None
+    basic = listen.calculate_basic_features(power, noise=noise)
+    reference = basic["noise_floor"] if noise is None else noise
+    advanced = listen.calculate_advanced_features(raw, power, SAMPLE_RATE, basic["noise_floor"])
+    # As in listen_and_flag: the peak set is found with the advanced features and reused
+    peaks = listen.find_spectrum_peaks(power, reference)
+    measured = dict(basic, frequency_stability=advanced['frequency_stability'])
+    tol = listen.get_tolerances(label, freq)
+    row = dict(basic, timestamp=datetime.datetime.now().isoformat(), freq=freq, label=label,
+               power_spectrum=power[::len(power) // 512][:512].astype(np.float32).tobytes(),
+               raw_samples=raw.astype(np.complex64).tobytes(), device_label="BENCH",
+               **{k: v for k, v in advanced.items()})
+    def db_insert():
+        insert_rows(conn, 'detections', [row])
+        conn.commit()
+    return {
+        "iq_convert": lambda: converter.convert(raw_bytes),
+        "fft": lambda: 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2),
+        "cfar": lambda: spectrum_noise(power),
+        "bursts": lambda: CaptureBursts(samples, SAMPLE_RATE, freq).features(freq, label),
+        "basic_features": lambda: listen.calculate_basic_features(power, noise=noise),
+        "advanced_features": lambda: listen.calculate_advanced_features(
+            raw, power, SAMPLE_RATE, basic["noise_floor"], listen.find_spectrum_peaks(power, reference)),
+        "quality_metrics": lambda: listen.calculate_signal_quality_metrics(power, None, measured, peaks),
+        "matcher": lambda: listen.match_baseline(freq, label, basic, tol),
+        "ml_extract_features": lambda: ml_listen.extract_features(samples, freq, label),
+        "db_insert": db_insert
+    }
+
+def run_benchmark(captures, stages=STAGES, repeat=5):
+    # listen.py reads baseline.json from the working directory at import time
+    os.chdir(SCRIPT_DIR)
+    import listen
+    import ml_listen
+    from init_db import init_db
+    from detection_store import open_db
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = open_db(init_db(os.path.join(tmp, 'bench.db')))
+        try:
+            for name, (samples, freq, label) in captures.items():
+                calls = stage_calls(listen, ml_listen, samples, freq, label, conn)
+                for stage in stages:
+                    seconds = time_call(calls[stage], repeat)
+                    results.setdefault(stage, {})[name] = {
+                        "seconds": seconds,
+                        "captures_per_s": 1.0 / seconds if seconds > 0 else None,
+                        "msps": len(samples) / seconds / 1e6 if seconds > 0 else None,
+                        "peak_mem_mb": peak_memory(calls[stage]) / 1e6
+                    }
+                    print(f"  {stage:<20} {name:<16} {seconds*1e3:9.3f} ms")
+        finally:
+            conn.close()
+
+    # Per-stage summary across signals
+    for stage, per_signal in results.items():
+        seconds = float(np.mean([r["seconds"] for r in per_signal.values()]))
+        per_signal["all"] = {
+            "seconds": seconds,
+            "captures_per_s": 1.0 / seconds if seconds > 0 else None,
+            "msps": SAMPLES / seconds / 1e6 if seconds > 0 else None,
+            "peak_mem_mb": max(r["peak_mem_mb"] for r in per_signal.values())
+        }
+    return results
+
+def environment_info():
+    try:
+        import scipy
+        scipy_version = scipy.__version__
+    except ImportError:
+        scipy_version = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy_version,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine()
+    }
+
+def compare(current, previous, tolerance):
+    """Print per-stage ratios against a previous run; return stages that regressed."""
+    regressions = []
+    print(f"\n{'Stage':<22}{'Before (ms)':>12}{'Now (ms)':>12}{'Ratio':>8}")
+    for stage, per_signal in current["stages"].items():
+        old = previous.get("stages", {}).get(stage, {}).get("all")
+        if not old:
+            continue
+        now = per_signal["all"]["seconds"]
+        ratio = now / old["seconds"] if old["seconds"] > 0 else float('inf')
+        flag = ""
+        if ratio > 1 + tolerance and now - old["seconds"] > MIN_DELTA_S:
+            flag = "  ⚠️  REGRESSION"
+            regressions.append(stage)
+        elif ratio < 1 - tolerance and old["seconds"] - now > MIN_DELTA_S:
+            flag = "  ✅ faster"
+        print(f"{stage:<22}{old['seconds']*1e3:>12.3f}{now*1e3:>12.3f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-capture DSP pipeline")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage and signal")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--iq", nargs="*", default=[], help="recorded captures (.cu8/.bin or .npy) to include")
+    parser.add_argument("--iq-label", default="wfm", help="baseline label used for recorded captures")
+    parser.add_argument("--output", help="result file (default data/benchmarks/dsp-<timestamp>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before a stage counts as a regression")
+    args = parser.parse_args()
+
+    captures = synthetic_captures()
+    for path in args.iq:
+        captures[os.path.basename(path)] = (load_iq(path), 100e6, args.iq_label)
+
+    print(f"📊 DSP benchmark | {len(captures)} captures x {SAMPLES} samples | repeat {args.repeat}")
+    stages = run_benchmark(captures, args.stages, args.repeat)
+    result = {
+        "created": datetime.datetime.now().isoformat(),
+        "samples": SAMPLES,
+        "sample_rate": SAMPLE_RATE,
+        "repeat": args.repeat,
+        "seed": SEED,
+        "signals": list(captures),
+        "environment": environment_info(),
+        "stages": stages
+    }
+
+    print(f"\n{'Stage':<22}{'ms/capture':>12}{'captures/s':>12}{'MS/s':>10}{'peak MB':>10}")
+    for stage, per_signal in stages.items():
+        s = per_signal["all"]
+        print(f"{stage:<22}{s['seconds']*1e3:>12.3f}{s['captures_per_s']:>12.1f}{s['msps']:>10.1f}{s['peak_mem_mb']:>10.1f}")
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"dsp-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n💾 Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(result, previous, args.tolerance)
+        if regressions:
+            print(f"\n❌ Slower than {args.compare}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Constant false alarm rate (CFAR) thresholding shared by scan.py, listen.py,
+collect_baseline.py and burst_detector.py.
+A fixed offset over the global spectrum median (scan.py's 10 dB, listen.py's
++6/+3 dB) puts ~8% of a 262k-bin noise-only spectrum above threshold, and the
+median itself rises wherever signals fill much of the capture or the tuner's
+filter rolls the noise off at the band edges. spectrum_noise() instead
+estimates the noise level locally: the linear spectrum is averaged into
+blocks of CFAR_BLOCK bins and each block's noise is an ordered statistic
+(OS-CFAR, default) or a cell average (CA/SO/GO-CFAR, from one cumulative sum)
+of the training blocks either side of it, so the cost stays O(N) however
+wide the training windows are. A bin is detected when it exceeds that noise
+by offset_db(pfa), the level a single periodogram bin of pure noise crosses
+with probability pfa.
+
+listen.py and collect_baseline.py only use it with CFAR=1 (default off, as
+the committed baseline.json was measured over the median); scan.py always does.
+Baseline entries record the OCCUPANCY_RULE they were measured with, and
+listen.py does not compare bandwidth or num_peaks across rules.
+
+    CFAR=1 python collect_baseline.py --fresh && CFAR=1 python listen.py
+    CFAR=1 CFAR_PFA=1e-4 python listen.py
+    CFAR_METHOD=ca CFAR_TRAIN=16 python scan.py
+"""
+
+import os
+import math
+import numpy as np
+
+CFAR_ENABLED = os.getenv('CFAR', '0') == '1'
+# Per-bin false alarm probability of the detection threshold
+CFAR_PFA = float(os.getenv('CFAR_PFA', '1e-3'))
+# 'os' (ordered statistic), 'ca' (cell average), 'so' / 'go' (smallest / greatest of the two sides)
+CFAR_METHOD = os.getenv('CFAR_METHOD', 'os')
+CFAR_BLOCK = int(os.getenv('CFAR_BLOCK', '1024'))   # bins per cell (8 kHz at 2.048 MS/s, 256k FFT)
+CFAR_TRAIN = int(os.getenv('CFAR_TRAIN', '32'))     # training cells either side (~256 kHz)
+CFAR_GUARD = int(os.getenv('CFAR_GUARD', '2'))      # cells either side kept out of the estimate
+OS_RANK = 0.25  # training-cell quantile: signals may fill up to 3/4 of the window
+# How bandwidth / num_peaks are measured; stored with every baseline entry
+LEGACY_OCCUPANCY_RULE = 'median+6dB'   # entries without a rule
+OCCUPANCY_RULE = f'cfar-{CFAR_METHOD}-pfa{CFAR_PFA:g}' if CFAR_ENABLED else LEGACY_OCCUPANCY_RULE
+# 10**(x/10) == exp(x * ln(10)/10)
+DB_TO_NATURAL = math.log(10) / 10
+
+def offset_db(pfa=CFAR_PFA):
+    """Threshold over the mean noise power (dB) that exponentially distributed noise bins cross with probability pfa."""
+    return 10 * math.log10(-math.log(pfa))
+
+# Bins this far above the noise reference count towards bandwidth / num_peaks
+# (listen.py and collect_baseline.py): the CFAR offset, or 6 dB over the median
+OCCUPANCY_DB = offset_db(CFAR_PFA) if CFAR_ENABLED else 6.0
+
+def sliding_mean(values, window):
+    """Centred moving average of length `window` via one cumulative sum (edges use the cells available)."""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    lo = np.clip(np.arange(n) - window // 2, 0, n)
+    hi = np.clip(lo + window, 0, n)
+    return (csum[hi] - csum[lo]) / np.maximum(hi - lo, 1)
+
+def cell_average(values, train=CFAR_TRAIN, guard=CFAR_GUARD, mode='ca'):
+    """
+    Mean of the `train` cells either side of each cell, skipping `guard`
+    cells next to it: both sides together ('ca'), or the smaller ('so') or
+    larger ('go') side mean. Edges use the cells available.
+    """
+    values = np.asarray(values)
+    n = len(values)
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    i = np.arange(n)
+    lead_lo, lead_hi = np.clip(i - guard - train, 0, n), np.clip(i - guard, 0, n)
+    lag_lo, lag_hi = np.clip(i + guard + 1, 0, n), np.clip(i + guard + 1 + train, 0, n)
+    lead_n, lag_n = lead_hi - lead_lo, lag_hi - lag_lo
+    lead_sum, lag_sum = csum[lead_hi] - csum[lead_lo], csum[lag_hi] - csum[lag_lo]
+    if mode == 'ca':
+        noise = np.where(lead_n + lag_n > 0, (lead_sum + lag_sum) / np.maximum(lead_n + lag_n, 1), np.nan)
+    else:
+        with np.errstate(invalid='ignore'):
+            lead = np.where(lead_n > 0, lead_sum / np.maximum(lead_n, 1), np.nan)
+            lag = np.where(lag_n > 0, lag_sum / np.maximum(lag_n, 1), np.nan)
+        # fmin/fmax ignore a missing side, so edge cells use the side they have
+        noise = (np.fmin if mode == 'so' else np.fmax)(lead, lag)
+    # Windows that miss every cell (guard wider than the input) fall back to the overall mean
+    return np.where(np.isnan(noise), float(values.mean()) if n else 0.0, noise)
+
+def ordered_statistic(values, train=CFAR_TRAIN, guard=CFAR_GUARD, rank=OS_RANK):
+    """The `rank` quantile of the 2 x `train` training cells around each cell (edges mirrored)."""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values
+    reach = train + guard
+    padded = np.pad(values, reach, mode='reflect' if n > 1 else 'edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * reach + 1)
+    cells = np.concatenate([windows[:, :train], windows[:, -train:]], axis=1)
+    k = int(rank * (cells.shape[1] - 1))
+    return np.partition(cells, k, axis=1)[:, k]
+
+def spectrum_noise(power, block=CFAR_BLOCK, train=CFAR_TRAIN, guard=CFAR_GUARD, method=CFAR_METHOD):
+    """Local noise level (dB, one value per bin) of a dB power spectrum."""
+    power = np.asarray(power)
+    n = len(power)
+    if n == 0:
+        return np.zeros(0)
+    block = max(1, min(block, n))
+    # exp() is several times cheaper than 10**x and keeps float32 spectra in float32
+    linear = np.exp(power * DB_TO_NATURAL)
+    full = n // block
+    cells = linear[:full * block].reshape(full, block).mean(axis=1, dtype=np.float64)
+    if n % block:
+        cells = np.append(cells, linear[full * block:].mean(dtype=np.float64))
+    if method == 'os':
+        noise = ordered_statistic(cells, train, guard)
+    else:
+        noise = cell_average(cells, train, guard, mode=method)
+    noise_db = 10 * np.log10(np.maximum(noise, 1e-30))
+    return np.repeat(noise_db, block)[:n]
+
+def detect(power, pfa=CFAR_PFA, **kwargs):
+    """(noise, mask): the local noise level (dB) per bin and the bins above it by offset_db(pfa)."""
+    noise = spectrum_noise(power, **kwargs)
+    return noise, power > noise + offset_db(pfa)
+
+def runs(mask, min_length=1):
+    """(start, end) indices of the runs of True at least min_length long."""
+    edges = np.diff(np.asarray(mask).astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_length
+    return starts[keep], ends[keep]
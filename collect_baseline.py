@@ -1,11 +1,12 @@
-import json
 import numpy as np
-from rtlsdr import RtlSdr
-import time
 import datetime
-import os
-import sys
+import argparse
 import signal
+from sdr_capture import CaptureSession, CollectionLog, pending_plan, SETTLE_TIME
+from channel_plan import plan_capture_groups, channel_view
+from burst_detector import CaptureBursts
+from cfar import CFAR_ENABLED, OCCUPANCY_DB, OCCUPANCY_RULE, spectrum_noise
+from signal_features import basic_features
 
 # Example frequencies and types
 FREQUENCIES = [
@@ -29,46 +30,48 @@ SAMPLES = 256*1024
 
 
 
-def collect_samples(freq, label):
-    # Get device index from environment variable with fallback
-    device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
-    try:
-        sdr = RtlSdr(device_index=device_index)
-    except:
-        device_index = 1 if device_index == 0 else 0
-        print(f"Trying alternate device index {device_index}...")
-        sdr = RtlSdr(device_index=device_index)
-    sdr.sample_rate = SAMPLE_RATE
-    sdr.center_freq = freq
-    sdr.gain = 'auto'
-    samples = sdr.read_samples(SAMPLES)
-    power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
-    peak_power = float(np.max(power))
-    noise_floor = float(np.median(power))
-    mean_power = float(np.mean(power))
-    std_power = float(np.std(power))
-    snr = peak_power - noise_floor
-    bandwidth = float(np.sum(power > noise_floor + 6) * (SAMPLE_RATE / SAMPLES))
-    peaks = np.where(power > noise_floor + 6)[0]
-    num_peaks = int(len(peaks))
-    sdr.close()
+def collect_group(session, task):
+    """Capture once for a capture group and measure every channel in it."""
+    samples = session.capture(task.center_freq, SAMPLES)
+    capture_power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
+    bursts = CaptureBursts(samples, SAMPLE_RATE, task.center_freq)
+    # Same occupied-bin threshold as listen.py: local CFAR noise level, or the median with CFAR=0
+    capture_noise = spectrum_noise(capture_power) if CFAR_ENABLED else None
+    results = []
+    for freq, label in task.channels:
+        power, _ = channel_view(capture_power, samples, task, freq, label, SAMPLE_RATE)
+        noise = None
+        if capture_noise is not None:
+            noise, _ = channel_view(capture_noise, samples, task, freq, label, SAMPLE_RATE, raw_len=0)
+        props = measure_channel(power, freq, label, noise)
+        # Time-domain duty cycle, matched by listen.py with BURST_DUTY_TOL
+        props["burst_duty_cycle"] = bursts.features(freq, label)["burst_duty_cycle"]
+        props["capture_center"] = task.center_freq
+        results.append(props)
+    return results
+
+def measure_channel(power, freq, label, noise=None):
+    # Same statistics and occupied-bin rule as listen.py's calculate_basic_features
+    features = basic_features(power, SAMPLE_RATE / SAMPLES, noise, OCCUPANCY_DB)
     return {
         "freq": freq,
         "label": label,
-        "peak_power": peak_power,
-        "noise_floor": noise_floor,
-        "bandwidth": bandwidth,
-        "snr": snr,
-        "mean_power": mean_power,
-        "std_power": std_power,
-        "num_peaks": num_peaks,
+        **{key: features[key] for key in ("peak_power", "noise_floor", "bandwidth", "snr",
+                                          "mean_power", "std_power", "num_peaks")},
+        # listen.py only compares bandwidth / num_peaks measured with the same rule
+        "occupancy_rule": OCCUPANCY_RULE,
         "timestamp": datetime.datetime.now().isoformat()
     }
 
 
 def main():
-    baseline = []
-    baseline_file = "baseline.json"
+    parser = argparse.ArgumentParser(description="Collect baseline signal properties")
+    parser.add_argument("--output", default="baseline.json", help="Baseline file to write")
+    parser.add_argument("--fresh", action="store_true", help="Ignore existing entries instead of resuming")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME, help="Seconds to wait after each retune")
+    args = parser.parse_args()
+    
+    baseline_file = args.output
     interrupted = False
     
     def signal_handler(sig, frame):
@@ -78,17 +81,15 @@ def main():
     
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Load existing baseline if it exists
-    if os.path.exists(baseline_file):
-        try:
-            with open(baseline_file, "r") as f:
-                baseline = json.load(f)
-            print(f"Loaded {len(baseline)} existing baseline entries")
-        except:
-            print("Starting fresh baseline collection")
+    # Resume from existing baseline and any unfinished run
+    log = CollectionLog(baseline_file, fresh=args.fresh)
+    if log.records:
+        print(f"Loaded {len(log.records)} existing baseline entries")
+    # Same channel grouping as listen.py, so grouped channels are measured the same way
+    todo = plan_capture_groups([(freq, label) for freq, label, _ in pending_plan(FREQUENCIES, 1, log.completed())], SAMPLE_RATE)
     
     total_freqs = len(FREQUENCIES)
-    print(f"\nBaseline Collection - {total_freqs} frequencies")
+    print(f"\nBaseline Collection - {total_freqs} frequencies, {len(todo)} captures remaining")
     print("=" * 50)
     print("Press Ctrl+C at any time to stop and save current progress")
     print("=" * 50)
@@ -96,35 +97,28 @@ def main():
     
     def save_baseline():
         """Save current baseline to file"""
-        with open(baseline_file, "w") as f:
-            json.dump(baseline, f, indent=2)
-        print(f"\n✓ Saved {len(baseline)} entries to {baseline_file}")
+        count = log.finalize()
+        print(f"\n✓ Saved {count} entries to {baseline_file}")
     
     try:
-        for i, (freq, label) in enumerate(FREQUENCIES, 1):
-            # Check for interrupt
-            if interrupted:
-                print(f"\n\n⏭️  Stopped by user at {i}/{total_freqs}")
-                save_baseline()
-                return
-            
-            print(f"[{i}/{total_freqs}] Collecting {label} at {freq/1e6:.3f} MHz...", end=" ", flush=True)
-            
-            try:
-                props = collect_samples(freq, label)
-                baseline.append(props)
-                print("✓")
-                
-                # Auto-save every 10 items
-                if len(baseline) % 10 == 0:
+        with CaptureSession(settle_time=args.settle) as session:
+            for i, task in enumerate(todo, 1):
+                # Check for interrupt
+                if interrupted:
+                    print(f"\n\n⏭️  Stopped by user at {i}/{len(todo)}")
                     save_baseline()
+                    return
+                
+                channels = ", ".join(f"{freq/1e6:.3f}" for freq, _ in task.channels)
+                print(f"[{i}/{len(todo)}] Collecting {task.channels[0][1]} at {channels} MHz...", end=" ", flush=True)
                 
-            except Exception as e:
-                print(f"✗ Error: {e}")
-                continue
-            
-            # Short delay between samples
-            time.sleep(0.5)
+                try:
+                    for props in collect_group(session, task):
+                        log.append(props)
+                    print("✓")
+                except Exception as e:
+                    print(f"✗ Error: {e}")
+                    continue
         
         # Final save
         save_baseline()
@@ -133,11 +127,11 @@ def main():
         print("=" * 50)
         
     except KeyboardInterrupt:
-        print(f"\n\n⚠️  Interrupted by user at {len(baseline)}/{total_freqs}")
+        print(f"\n\n⚠️  Interrupted by user at {len(log.records)}/{total_freqs}")
         save_baseline()
     except Exception as e:
         print(f"\n\n❌ Error during collection: {e}")
-        if baseline:
+        if log.records:
             save_baseline()
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+"""
+Versioned schema migrations for detections.db and detections_ml.db.
+Each database records the last applied migration in PRAGMA user_version; the
+listeners, the API and init_db.py / init_ml_db.py bring it up to date at
+startup. Every step is idempotent, so two processes starting together are safe.
+Long-running steps (backfills, rollup builds) work in id-range batches of
+short transactions with a pause in between, so a live listener's writer gets
+the lock between batches; interrupted backfills resume from migration_state.
+
+    python db_migrations.py                       # migrate data/detections.db (+ detections_ml.db)
+    python db_migrations.py --status              # show schema versions only
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+BATCH_ROWS = 20000
+# Seconds between batches, so other writers are never locked out for long
+BATCH_PAUSE = 0.05
+
+# Current table definitions; columns added since a database was created are
+# filled in by the "add missing columns" migration
+DETECTIONS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        freq REAL,
+        label TEXT,
+        bandwidth REAL,
+        peak_power REAL,
+        noise_floor REAL,
+        snr REAL,
+        mean_power REAL,
+        std_power REAL,
+        min_power REAL,
+        max_power REAL,
+        kurtosis REAL,
+        skewness REAL,
+        num_peaks INTEGER,
+        power_spectrum BLOB,
+        device_label TEXT,
+        device_lat REAL,
+        device_long REAL,
+        raw_samples BLOB,
+        fft_history BLOB,
+        -- New fields for comprehensive analysis
+        confidence_score REAL,
+        signal_duration REAL,
+        center_freq_offset REAL,
+        bandwidth_efficiency REAL,
+        spectral_centroid REAL,
+        spectral_rolloff REAL,
+        spectral_flux REAL,
+        zero_crossing_rate REAL,
+        peak_frequencies BLOB,
+        modulation_index REAL,
+        phase_variance REAL,
+        amplitude_variance REAL,
+        dominant_frequency REAL,
+        frequency_stability REAL,
+        scan_number INTEGER,
+        detection_sequence INTEGER,
+        baseline_deviation REAL,
+        signal_quality_index REAL,
+        interference_level REAL,
+        doppler_shift REAL,
+        activity_score REAL,
+        event_id TEXT,
+        sigmf_path TEXT,
+        burst_count INTEGER,
+        burst_duty_cycle REAL,
+        burst_duration REAL,
+        burst_period REAL,
+        burst_times BLOB,
+        spectrum_span REAL
+    )
+'''
+
+DETECTIONS_ML_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS detections_ml (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        freq REAL,
+        label TEXT,
+        peak_power REAL,
+        noise_floor REAL,
+        snr REAL,
+        bandwidth REAL,
+        kurtosis REAL,
+        skewness REAL,
+        num_peaks INTEGER,
+        power_spectrum BLOB,
+        device_label TEXT,
+        device_lat REAL,
+        device_long REAL,
+        raw_samples BLOB,
+        iso_forest_anomaly BOOLEAN,
+        cnn_predicted_label TEXT,
+        cnn_confidence REAL
+    )
+'''
+
+def open_migration_db(db_path):
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def _declared_columns(create_sql, table):
+    """(name, type) of every column in a CREATE TABLE statement, via an in-memory probe."""
+    probe = sqlite3.connect(':memory:')
+    probe.execute(create_sql)
+    columns = [(row[1], row[2]) for row in probe.execute(f'PRAGMA table_info({table})')]
+    probe.close()
+    return columns
+
+def add_missing_columns(conn, table, create_sql):
+    """ALTER TABLE ADD COLUMN for columns the table predates (metadata only, no row rewrite)."""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    added = []
+    for name, kind in _declared_columns(create_sql, table):
+        if name in existing:
+            continue
+        try:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {kind}')
+            added.append(name)
+        except sqlite3.OperationalError as e:
+            # Another process added it first
+            if 'duplicate column' not in str(e):
+                raise
+    conn.commit()
+    return added
+
+def batched_update(conn, name, table, update_sql, batch_rows=BATCH_ROWS, pause=BATCH_PAUSE):
+    """
+    Run update_sql (with "id > ? AND id <= ?" placeholders) over the table in
+    id-range batches, one transaction each. Progress is kept in migration_state
+    under `name`, so an interrupted backfill resumes where it stopped.
+    Returns the number of rows updated.
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS migration_state (name TEXT PRIMARY KEY, value INTEGER)')
+    conn.commit()
+    row = conn.execute('SELECT value FROM migration_state WHERE name = ?', (name,)).fetchone()
+    watermark = row[0] if row else 0
+    latest = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+    updated = 0
+    while watermark < latest:
+        upper = min(latest, watermark + batch_rows)
+        updated += conn.execute(update_sql, (watermark, upper)).rowcount
+        conn.execute('INSERT OR REPLACE INTO migration_state (name, value) VALUES (?, ?)', (name, upper))
+        conn.commit()
+        watermark = upper
+        if watermark < latest and pause:
+            time.sleep(pause)
+    return updated
+
+# Classic detections.db
+
+def _create_detections(conn):
+    conn.execute(DETECTIONS_TABLE_SQL)
+    conn.commit()
+
+def _detections_columns(conn):
+    add_missing_columns(conn, 'detections', DETECTIONS_TABLE_SQL)
+
+def _detections_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_device ON detections(device_label, timestamp)')
+    conn.commit()
+
+def _detections_rollups(conn):
+    # Imported here: detection_rollups imports detection_store, which the listeners load first
+    from detection_rollups import ensure_rollup_tables, refresh_rollups
+    ensure_rollup_tables(conn)
+    refresh_rollups(conn, batch_rows=BATCH_ROWS)
+
+def _backfill_snr(conn):
+    # Rows from listeners that stored peak power and noise floor but no SNR
+    batched_update(conn, 'backfill_snr', 'detections',
+                   "UPDATE detections SET snr = peak_power - noise_floor "
+                   "WHERE id > ? AND id <= ? AND snr IS NULL AND peak_power IS NOT NULL AND noise_floor IS NOT NULL")
+
+def _detection_events(conn):
+    # Imported here like the rollups: event_tracker is loaded by the listener after this module
+    from event_tracker import ensure_event_tables
+    add_missing_columns(conn, 'detections', DETECTIONS_TABLE_SQL)
+    ensure_event_tables(conn)
+
+# Detections_ml.db
+
+def _create_detections_ml(conn):
+    conn.execute(DETECTIONS_ML_TABLE_SQL)
+    conn.commit()
+
+def _detections_ml_columns(conn):
+    add_missing_columns(conn, 'detections_ml', DETECTIONS_ML_TABLE_SQL)
+
+def _detections_ml_indexes(conn):
+    # Same read paths as detections.db so the API can page both stores by index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_ml_timestamp ON detections_ml(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_ml_device ON detections_ml(device_label, timestamp)')
+    conn.commit()
+
+def _ingest_log(conn):
+    # Batches received by api.py /ingest; the primary key makes retried uploads no-ops
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_batches (
+            batch_id TEXT PRIMARY KEY,
+            device_label TEXT,
+            table_name TEXT,
+            rows INTEGER,
+            received_at TEXT
+        )
+    ''')
+    conn.commit()
+
+# (version, description, step) per database kind; append only, never renumber
+MIGRATIONS = {
+    'classic': [
+        (1, "detections table", _create_detections),
+        (2, "add columns missing from older databases", _detections_columns),
+        (3, "timestamp and device indexes", _detections_indexes),
+        (4, "time series rollup tables and backfill", _detections_rollups),
+        (5, "backfill snr from peak_power - noise_floor", _backfill_snr),
+        (6, "ingest batch log", _ingest_log),
+        (7, "detection events table and detections.event_id", _detection_events),
+        (8, "detections.sigmf_path for IQ recordings", _detections_columns),
+        (9, "detections burst feature columns", _detections_columns),
+        (10, "detections.spectrum_span for grouped-channel spectra", _detections_columns),
+    ],
+    'ml': [
+        (1, "detections_ml table", _create_detections_ml),
+        (2, "add columns missing from older databases", _detections_ml_columns),
+        (3, "timestamp and device indexes", _detections_ml_indexes),
+        (4, "ingest batch log", _ingest_log),
+    ]
+}
+
+def latest_version(kind):
+    return MIGRATIONS[kind][-1][0]
+
+def migrate(conn, kind, verbose=True):
+    """Apply every pending migration of `kind` ('classic' or 'ml'). Returns the versions applied."""
+    applied = []
+    for version, description, step in MIGRATIONS[kind]:
+        if schema_version(conn) >= version:
+            continue
+        start = time.perf_counter()
+        step(conn)
+        # Bump under the write lock so a concurrent migrator never moves it backwards
+        conn.execute('BEGIN IMMEDIATE')
+        if schema_version(conn) < version:
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.commit()
+        applied.append(version)
+        if verbose:
+            print(f"🗄️  Migration {kind} v{version}: {description} ({time.perf_counter() - start:.1f}s)")
+    return applied
+
+def migrate_database(db_path, kind='classic', verbose=True):
+    """Open, migrate and close a database file (created if missing)."""
+    conn = open_migration_db(db_path)
+    try:
+        return migrate(conn, kind, verbose)
+    finally:
+        conn.close()
+
+def main():
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the detection databases")
+    parser.add_argument("--db", default=os.getenv('DB_PATH', os.path.join(data_dir, 'detections.db')))
+    parser.add_argument("--ml-db", default=os.getenv('ML_DB_PATH', os.path.join(data_dir, 'detections_ml.db')))
+    parser.add_argument("--status", action="store_true", help="print schema versions without migrating")
+    args = parser.parse_args()
+
+    for kind, path in (('classic', args.db), ('ml', args.ml_db)):
+        if not os.path.exists(path):
+            print(f"⏭️  {path} not found, skipping")
+            continue
+        if not args.status:
+            migrate_database(path, kind)
+        conn = sqlite3.connect(path, timeout=30.0)
+        version = schema_version(conn)
+        conn.close()
+        state = "✅ up to date" if version >= latest_version(kind) else "⚠️  pending migrations"
+        print(f"{state}: {path} at v{version} (latest v{latest_version(kind)})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Server-side aggregation of detections for heatmap and distribution charts.
+Rows are binned by time, frequency and label in SQL (GROUP BY over integer
+bucket expressions) and reshaped into compact matrices with numpy, so charts
+over weeks of data transfer kilobytes and cover the full history instead of
+the last page of raw rows.
+"""
+
+import datetime
+import numpy as np
+from detection_store import filter_clause
+
+# Numeric columns that can be aggregated
+METRICS = ('peak_power', 'snr', 'bandwidth', 'noise_floor', 'confidence_score',
+           'signal_quality_index', 'activity_score', 'interference_level', 'baseline_deviation')
+STATS = ('count', 'mean', 'min', 'max')
+
+# Time bucket sizes (s) chosen from when the caller leaves time_bin unset
+NICE_TIME_BINS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400)
+DEFAULT_TIME_BUCKETS = 200
+MAX_TIME_BUCKETS = 5000
+MAX_FREQ_BUCKETS = 5000
+
+TIME_BUCKET_SQL = "CAST(strftime('%s', timestamp) AS INTEGER) / ?"
+FREQ_BUCKET_SQL = "CAST(freq / ? AS INTEGER)"
+
+def parse_options(params):
+    """Validate metric/stat/bin parameters; raises ValueError with a readable message."""
+    metric = params.get('metric', 'peak_power')
+    stat = params.get('stat', 'count')
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+    if stat not in STATS:
+        raise ValueError(f"stat must be one of {', '.join(STATS)}")
+    freq_bin = float(params.get('freq_bin', 1e6))
+    if freq_bin <= 0:
+        raise ValueError("freq_bin must be positive (Hz)")
+    time_bin = int(params['time_bin']) if params.get('time_bin') else None
+    if time_bin is not None and time_bin <= 0:
+        raise ValueError("time_bin must be positive (seconds)")
+    return metric, stat, freq_bin, time_bin
+
+def time_range(conn, clause, args, table='detections'):
+    """Epoch seconds of the first and last matching detection, or (None, None)."""
+    row = conn.execute(
+        f"SELECT MIN(CAST(strftime('%s', timestamp) AS INTEGER)), MAX(CAST(strftime('%s', timestamp) AS INTEGER)) "
+        f"FROM {table} WHERE 1=1{clause}", args
+    ).fetchone()
+    return row[0], row[1]
+
+def choose_time_bin(first, last, buckets=DEFAULT_TIME_BUCKETS):
+    """Smallest nice bucket size that covers the range in about `buckets` buckets."""
+    span = max(1, (last or 0) - (first or 0))
+    for size in NICE_TIME_BINS:
+        if span / size <= buckets:
+            return size
+    return int(np.ceil(span / buckets / 86400)) * 86400
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+def _stat_sql(metric, stat):
+    if stat == 'count':
+        return "COUNT(*)"
+    return {"mean": "AVG", "min": "MIN", "max": "MAX"}[stat] + f"({metric})"
+
+def _resolve_time_bin(conn, clause, args, time_bin, table):
+    first, last = time_range(conn, clause, args, table)
+    if first is None:
+        return None, None, None
+    if time_bin is None:
+        time_bin = choose_time_bin(first, last)
+    if (last - first) // time_bin + 1 > MAX_TIME_BUCKETS:
+        raise ValueError(f"time_bin {time_bin}s gives more than {MAX_TIME_BUCKETS} buckets; use a larger bin")
+    return time_bin, first // time_bin, last // time_bin
+
+def heatmap(conn, params, table='detections'):
+    """
+    Time x frequency matrix of one statistic, optionally split per label.
+    The time axis is contiguous (empty buckets included); the frequency axis
+    holds only occupied frequency buckets, which keeps sparse bands compact.
+    """
+    metric, stat, freq_bin, time_bin = parse_options(params)
+    by_label = params.get('by_label') in ('1', 'true', 'yes')
+    clause, args = filter_clause(params)
+    time_bin, t0, t1 = _resolve_time_bin(conn, clause, args, time_bin, table)
+    result = {'metric': metric, 'stat': stat, 'freq_bin': freq_bin, 'time_bin': time_bin,
+              'time_bins': [], 'freq_bins_mhz': [], 'total': 0}
+    if time_bin is None:
+        result['labels' if by_label else 'values'] = {} if by_label else []
+        return result
+
+    label_sql = "label" if by_label else "''"
+    rows = conn.execute(
+        f"SELECT {TIME_BUCKET_SQL} AS tb, {FREQ_BUCKET_SQL} AS fb, {label_sql} AS lb, COUNT(*), {_stat_sql(metric, stat)} "
+        f"FROM {table} WHERE 1=1{clause} GROUP BY tb, fb, lb",
+        [time_bin, freq_bin] + args
+    ).fetchall()
+
+    freq_buckets = sorted({r[1] for r in rows})
+    if len(freq_buckets) > MAX_FREQ_BUCKETS:
+        raise ValueError(f"freq_bin {freq_bin:g} Hz gives more than {MAX_FREQ_BUCKETS} buckets; use a larger bin")
+    freq_index = {fb: i for i, fb in enumerate(freq_buckets)}
+    labels = sorted({r[2] for r in rows})
+    fill = 0 if stat == 'count' else np.nan
+    cube = np.full((len(labels), t1 - t0 + 1, len(freq_buckets)), fill, dtype=float)
+    label_index = {lb: i for i, lb in enumerate(labels)}
+    for tb, fb, lb, count, value in rows:
+        cube[label_index[lb], tb - t0, freq_index[fb]] = value
+        result['total'] += count
+
+    def as_list(matrix):
+        rounded = np.round(matrix, 3)
+        return [[None if np.isnan(v) else v for v in row] for row in rounded.tolist()] if stat != 'count' else matrix.astype(int).tolist()
+
+    result['time_bins'] = [_iso(tb * time_bin) for tb in range(t0, t1 + 1)]
+    result['freq_bins_mhz'] = [fb * freq_bin / 1e6 for fb in freq_buckets]
+    if by_label:
+        result['labels'] = {lb: as_list(cube[i]) for lb, i in label_index.items()}
+    else:
+        result['values'] = as_list(cube[0]) if labels else []
+    return result
+
+def frequency_distribution(conn, params, table='detections'):
+    """Detection count and mean of a metric per frequency bucket and label."""
+    metric, _, freq_bin, _ = parse_options(params)
+    clause, args = filter_clause(params)
+    rows = conn.execute(
+        f"SELECT {FREQ_BUCKET_SQL} AS fb, label, COUNT(*), AVG({metric}) FROM {table} "
+        f"WHERE 1=1{clause} GROUP BY fb, label ORDER BY fb",
+        [freq_bin] + args
+    ).fetchall()
+    buckets = {}
+    for fb, label, count, mean in rows:
+        bucket = buckets.setdefault(fb, {'freq_mhz': fb * freq_bin / 1e6, 'count': 0, 'labels': {}})
+        bucket['count'] += count
+        bucket['labels'][label] = {'count': count, f'mean_{metric}': None if mean is None else round(mean, 3)}
+    return {'metric': metric, 'freq_bin': freq_bin, 'bins': list(buckets.values()),
+            'total': sum(b['count'] for b in buckets.values())}
+
+def time_distribution(conn, params, table='detections'):
+    """One statistic per time bucket and label (contiguous time axis)."""
+    metric, stat, _, time_bin = parse_options(params)
+    clause, args = filter_clause(params)
+    time_bin, t0, t1 = _resolve_time_bin(conn, clause, args, time_bin, table)
+    if time_bin is None:
+        return {'metric': metric, 'stat': stat, 'time_bin': None, 'time_bins': [], 'labels': {}}
+    rows = conn.execute(
+        f"SELECT {TIME_BUCKET_SQL} AS tb, label, {_stat_sql(metric, stat)} FROM {table} "
+        f"WHERE 1=1{clause} GROUP BY tb, label",
+        [time_bin] + args
+    ).fetchall()
+    series = {}
+    for tb, label, value in rows:
+        values = series.setdefault(label, [0 if stat == 'count' else None] * (t1 - t0 + 1))
+        values[tb - t0] = value if stat == 'count' or value is None else round(value, 3)
+    return {'metric': metric, 'stat': stat, 'time_bin': time_bin,
+            'time_bins': [_iso(tb * time_bin) for tb in range(t0, t1 + 1)], 'labels': series}
@@ -0,0 +1,203 @@
+"""
+Streaming bulk export of detections as CSV, Parquet or NPZ.
+Rows are read with fetchmany() in fixed-size chunks and each chunk is encoded
+and yielded immediately, so memory stays constant however many rows match.
+Parquet needs pyarrow (optional); CSV and NPZ only need the standard library
+and numpy.
+
+NPZ layout: one structured array per chunk ("chunk_000000.npy", ...) holding
+the scalar columns; BLOB columns are stored per chunk as concatenated bytes
+("chunk_000000.power_spectrum.npy") plus row offsets
+("chunk_000000.power_spectrum_offsets.npy"). Load with
+np.concatenate([z[k] for k in sorted(z.files) if k.count('.') == 0]).
+"""
+
+import io
+import csv
+import base64
+import zipfile
+import numpy as np
+
+CHUNK_ROWS = 5000
+# Rows with spectrum/IQ/waterfall BLOBs are ~40 KB each, so chunk them smaller
+BLOB_CHUNK_ROWS = 250
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'npz': ('application/zip', 'npz')
+}
+
+# Fixed widths so every NPZ chunk has the same structured dtype
+TEXT_WIDTHS = {'timestamp': 32}
+DEFAULT_TEXT_WIDTH = 64
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+def table_columns(conn, table):
+    """Ordered {column: declared type} for a table."""
+    return {row[1]: (row[2] or '').upper() for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def select_columns(available, requested=None, include_blobs=False):
+    """
+    Validate the requested column list against the table. Without a request,
+    every scalar column is exported, plus BLOB columns if include_blobs is set.
+    Raises ValueError for unknown columns.
+    """
+    if requested:
+        unknown = [c for c in requested if c not in available]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+        return list(requested)
+    return [c for c, kind in available.items() if include_blobs or kind != 'BLOB']
+
+def default_chunk_rows(columns, types):
+    return BLOB_CHUNK_ROWS if any(types[c] == 'BLOB' for c in columns) else CHUNK_ROWS
+
+def iter_chunks(cursor, chunk_rows=CHUNK_ROWS):
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+class _Drain:
+    """Write-only sink whose contents are handed out (and dropped) after each chunk."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = self.buffer.getvalue()
+        self.buffer = io.BytesIO()
+        return data
+
+def stream_csv(cursor, columns, types, chunk_rows=CHUNK_ROWS):
+    """CSV with a header row; BLOBs are base64 encoded."""
+    blob_idx = [i for i, c in enumerate(columns) if types[c] == 'BLOB']
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for rows in iter_chunks(cursor, chunk_rows):
+        if blob_idx:
+            rows = [list(r) for r in rows]
+            for r in rows:
+                for i in blob_idx:
+                    if r[i] is not None:
+                        r[i] = base64.b64encode(r[i]).decode('ascii')
+        writer.writerows(rows)
+        yield out.getvalue().encode('utf-8')
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode('utf-8')
+
+def _arrow_type(kind):
+    if kind == 'BLOB':
+        return pa.binary()
+    if kind == 'INTEGER':
+        return pa.int64()
+    if kind in ('REAL', 'FLOAT', 'DOUBLE'):
+        return pa.float64()
+    if kind == 'BOOLEAN':
+        return pa.bool_()
+    return pa.string()
+
+def stream_parquet(cursor, columns, types, chunk_rows=CHUNK_ROWS):
+    """Parquet file with one row group per chunk."""
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    schema = pa.schema([(c, _arrow_type(types[c])) for c in columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='snappy')
+    try:
+        for rows in iter_chunks(cursor, chunk_rows):
+            arrays = [pa.array([r[i] for r in rows], type=schema.field(i).type) for i in range(len(columns))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+def _npz_dtype(columns, types):
+    fields = []
+    for c in columns:
+        kind = types[c]
+        if kind == 'INTEGER':
+            fields.append((c, np.int64))
+        elif kind == 'BOOLEAN':
+            fields.append((c, np.int8))
+        elif kind in ('REAL', 'FLOAT', 'DOUBLE'):
+            fields.append((c, np.float64))
+        else:
+            fields.append((c, f"U{TEXT_WIDTHS.get(c, DEFAULT_TEXT_WIDTH)}"))
+    return np.dtype(fields)
+
+def _npz_scalar(value, kind):
+    if value is None:
+        # NaN for missing reals, -1 for missing integers, empty string for text
+        if kind in ('REAL', 'FLOAT', 'DOUBLE'):
+            return np.nan
+        return -1 if kind in ('INTEGER', 'BOOLEAN') else ''
+    return value
+
+def stream_npz(cursor, columns, types, chunk_rows=CHUNK_ROWS):
+    """Uncompressed NPZ (zip) archive written member by member as chunks arrive."""
+    scalar = [c for c in columns if types[c] != 'BLOB']
+    blobs = [c for c in columns if types[c] == 'BLOB']
+    scalar_idx = [columns.index(c) for c in scalar]
+    dtype = _npz_dtype(scalar, types)
+    sink = _Drain()
+    archive = zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True)
+    try:
+        for n, rows in enumerate(iter_chunks(cursor, chunk_rows)):
+            name = f"chunk_{n:06d}"
+            if scalar:
+                records = np.array(
+                    [tuple(_npz_scalar(r[i], types[c]) for i, c in zip(scalar_idx, scalar)) for r in rows],
+                    dtype=dtype
+                )
+                with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, records, allow_pickle=False)
+            for c in blobs:
+                i = columns.index(c)
+                parts = [r[i] or b'' for r in rows]
+                offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([len(p) for p in parts])
+                with archive.open(f"{name}.{c}.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.frombuffer(b''.join(parts), dtype=np.uint8), allow_pickle=False)
+                with archive.open(f"{name}.{c}_offsets.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, offsets, allow_pickle=False)
+            yield sink.take()
+    finally:
+        archive.close()
+    yield sink.take()
+
+STREAMERS = {
+    'csv': stream_csv,
+    'parquet': stream_parquet,
+    'npz': stream_npz
+}
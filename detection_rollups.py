@@ -0,0 +1,222 @@
+"""
+Multi-resolution rollups for long-range time series charts.
+detection_rollups holds count, min, max and sum per (resolution, time bucket,
+device, label) for the charted metrics at 1 min, 15 min, 1 h, 6 h and 1 day.
+The listener's writer folds new rows in incrementally (tracked by a rowid
+watermark), and the API answers any time range from the coarsest resolution
+that still gives the requested number of points.
+
+    python detection_rollups.py                 # bring rollups up to date (backfill)
+    python detection_rollups.py --rebuild       # recompute after bulk deletes/cleanup
+"""
+
+import os
+import argparse
+import datetime
+import numpy as np
+from detection_store import filter_clause, open_db
+
+RESOLUTIONS = (60, 900, 3600, 6 * 3600, 86400)
+ROLLUP_METRICS = ('peak_power', 'snr', 'confidence_score', 'activity_score')
+DEFAULT_POINTS = 500
+MAX_POINTS = 5000
+
+def ensure_rollup_tables(conn):
+    metric_columns = ",\n".join(
+        f"{m}_min REAL, {m}_max REAL, {m}_sum REAL, {m}_n INTEGER" for m in ROLLUP_METRICS
+    )
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS detection_rollups (
+            resolution INTEGER,
+            bucket INTEGER,
+            device_label TEXT,
+            label TEXT,
+            count INTEGER,
+            {metric_columns},
+            PRIMARY KEY (resolution, bucket, device_label, label)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+    # Short ranges are answered from raw rows
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections(timestamp)')
+    conn.commit()
+
+def _upsert_sql(resolution):
+    selects = ", ".join(
+        f"MIN({m}), MAX({m}), SUM({m}), COUNT({m})" for m in ROLLUP_METRICS
+    )
+    columns = ", ".join(f"{m}_min, {m}_max, {m}_sum, {m}_n" for m in ROLLUP_METRICS)
+    updates = ", ".join(
+        f"{m}_min = MIN(COALESCE({m}_min, excluded.{m}_min), COALESCE(excluded.{m}_min, {m}_min)), "
+        f"{m}_max = MAX(COALESCE({m}_max, excluded.{m}_max), COALESCE(excluded.{m}_max, {m}_max)), "
+        f"{m}_sum = COALESCE({m}_sum, 0) + COALESCE(excluded.{m}_sum, 0), "
+        f"{m}_n = {m}_n + excluded.{m}_n"
+        for m in ROLLUP_METRICS
+    )
+    return f'''
+        INSERT INTO detection_rollups (resolution, bucket, device_label, label, count, {columns})
+        SELECT {resolution}, CAST(strftime('%s', timestamp) AS INTEGER) / {resolution} AS b,
+               COALESCE(device_label, ''), COALESCE(label, ''), COUNT(*), {selects}
+        FROM detections WHERE id > ? AND id <= ? AND timestamp IS NOT NULL
+        GROUP BY b, COALESCE(device_label, ''), COALESCE(label, '')
+        ON CONFLICT (resolution, bucket, device_label, label) DO UPDATE SET
+            count = count + excluded.count, {updates}
+    '''
+
+def refresh_rollups(conn, batch_rows=50000):
+    """
+    Fold detections added since the last refresh into every resolution.
+    Works in batches of batch_rows ids, one short transaction each, so a
+    large backfill never holds the write lock for long. Each batch reads the
+    watermark inside its BEGIN IMMEDIATE transaction and commits the rollup
+    rows with the new watermark, so refreshers in other processes (listener
+    writer, API /ingest, migrations) never fold the same ids twice. Commits
+    any transaction already open on conn. Returns rows folded in.
+    """
+    # Upper bound for this call; rows added meanwhile wait for the next refresh
+    latest = conn.execute("SELECT MAX(id) FROM detections").fetchone()[0] or 0
+    folded = 0
+    while True:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM rollup_state WHERE name = 'detections_id'").fetchone()
+            watermark = row[0] if row else 0
+            if watermark >= latest:
+                conn.rollback()
+                return folded
+            upper = min(latest, watermark + batch_rows)
+            for resolution in RESOLUTIONS:
+                conn.execute(_upsert_sql(resolution), (watermark, upper))
+            conn.execute("INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('detections_id', ?)", (upper,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        folded += upper - watermark
+
+def rebuild_rollups(conn):
+    conn.execute("DELETE FROM detection_rollups")
+    conn.execute("DELETE FROM rollup_state WHERE name = 'detections_id'")
+    conn.commit()
+    return refresh_rollups(conn)
+
+def rollups_available(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detection_rollups'"
+    ).fetchone() is not None
+
+def _epoch(value):
+    return int(datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+def _label_filter(params):
+    """Device/label filters only; time is handled through bucket ranges."""
+    return filter_clause({k: params[k] for k in ('device_label', 'label', 'labels') if k in params})
+
+def _merge(buckets, counts, mins, maxs, sums, ns, width, t0):
+    """Merge fine buckets into groups of `width` seconds starting at t0."""
+    group = (buckets - t0) // width
+    order, start = np.unique(group, return_index=True)
+    count = np.add.reduceat(counts, start)
+    n = np.add.reduceat(np.nan_to_num(ns), start, axis=0)
+    total = np.add.reduceat(np.nan_to_num(sums), start, axis=0)
+    lo = np.fmin.reduceat(mins, start, axis=0)
+    hi = np.fmax.reduceat(maxs, start, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, total / np.maximum(n, 1), np.nan)
+    return t0 + order * width, count, lo, hi, mean
+
+def time_series(conn, params):
+    """
+    At most `points` buckets of min/max/mean per metric over [start, end].
+    Long ranges read the coarsest rollup that still gives enough points;
+    ranges shorter than `points` minutes are bucketed from raw rows.
+    """
+    metrics = [m.strip() for m in params.get('metrics', params.get('metric', 'snr,peak_power')).split(',')]
+    unknown = [m for m in metrics if m not in ROLLUP_METRICS]
+    if unknown:
+        raise ValueError(f"metrics must be among {', '.join(ROLLUP_METRICS)}")
+    points = min(max(int(params.get('points', DEFAULT_POINTS)), 10), MAX_POINTS)
+    clause, args = _label_filter(params)
+    use_rollups = rollups_available(conn)
+
+    if 'start' in params and 'end' in params:
+        t_start, t_end = _epoch(params['start']), _epoch(params['end'])
+    else:
+        source = "detection_rollups WHERE resolution = 60" if use_rollups else "detections WHERE 1=1"
+        expr = "bucket * 60" if use_rollups else "CAST(strftime('%s', timestamp) AS INTEGER)"
+        first, last = conn.execute(f"SELECT MIN({expr}), MAX({expr}) FROM {source}{clause}", args).fetchone()
+        if first is None:
+            return {'metrics': metrics, 'resolution': None, 'source': None, 'timestamps': [], 'count': [], 'series': {}}
+        t_start = _epoch(params['start']) if 'start' in params else first
+        t_end = _epoch(params['end']) if 'end' in params else last + 60
+    span = max(1, t_end - t_start)
+    # points - 1 so aligning the first bucket never adds an extra point
+    width = max(1, int(np.ceil(span / (points - 1))))
+
+    resolution = None
+    if use_rollups:
+        usable = [r for r in RESOLUTIONS if r <= width]
+        resolution = usable[-1] if usable else None
+    if resolution is not None:
+        columns = ", ".join(f"MIN({m}_min), MAX({m}_max), SUM({m}_sum), SUM({m}_n)" for m in metrics)
+        rows = conn.execute(
+            f"SELECT bucket * {resolution}, SUM(count), {columns} FROM detection_rollups "
+            f"WHERE resolution = ? AND bucket >= ? AND bucket <= ?{clause} GROUP BY bucket ORDER BY bucket",
+            [resolution, t_start // resolution, t_end // resolution] + args
+        ).fetchall()
+        source = f"rollup_{resolution}s"
+    else:
+        columns = ", ".join(f"MIN({m}), MAX({m}), SUM({m}), COUNT({m})" for m in metrics)
+        rows = conn.execute(
+            f"SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / {width}) * {width} AS b, COUNT(*), {columns} "
+            f"FROM detections WHERE timestamp >= ? AND timestamp <= ?{clause} GROUP BY b ORDER BY b",
+            [_iso(t_start), _iso(t_end)] + args
+        ).fetchall()
+        source = "raw"
+
+    if not rows:
+        return {'metrics': metrics, 'resolution': width, 'source': source, 'timestamps': [], 'count': [], 'series': {}}
+    data = np.array(rows, dtype=float)
+    k = len(metrics)
+    stats = data[:, 2:].reshape(len(rows), k, 4)
+    times, count, lo, hi, mean = _merge(
+        data[:, 0].astype(np.int64), data[:, 1], stats[:, :, 0], stats[:, :, 1], stats[:, :, 2], stats[:, :, 3],
+        width, (t_start // width) * width
+    )
+
+    def clean(values):
+        return [None if np.isnan(v) else round(float(v), 3) for v in values]
+
+    return {
+        'metrics': metrics,
+        'resolution': width,
+        'source': source,
+        'timestamps': [_iso(int(t)) for t in times],
+        'count': count.astype(int).tolist(),
+        'series': {m: {'min': clean(lo[:, i]), 'max': clean(hi[:, i]), 'mean': clean(mean[:, i])} for i, m in enumerate(metrics)}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the time series rollups")
+    default_db = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'detections.db')
+    parser.add_argument("--db", default=os.getenv('DB_PATH', default_db))
+    parser.add_argument("--rebuild", action="store_true", help="recompute from scratch (after deletes)")
+    args = parser.parse_args()
+    conn = open_db(args.db)
+    ensure_rollup_tables(conn)
+    folded = rebuild_rollups(conn) if args.rebuild else refresh_rollups(conn)
+    conn.close()
+    print(f"✅ Rollups up to date ({folded:,} detections folded in)")
+
+if __name__ == "__main__":
+    main()
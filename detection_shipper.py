@@ -0,0 +1,235 @@
+"""
+Push detections from field listeners to a central collector (api.py /ingest).
+Rows committed by the local DetectionWriter are batched, gzip-compressed and
+spooled to disk before sending, so nothing is lost while the collector is
+unreachable. Every batch carries an id that the collector records in the same
+transaction as its rows, so retries after a timeout never insert twice.
+
+    COLLECTOR_URL=http://gateway:5000 DEVICE_LABEL=SENSOR_07 python listen.py
+"""
+
+import os
+import glob
+import gzip
+import json
+import time
+import uuid
+import zlib
+import base64
+import queue
+import threading
+import urllib.error
+import urllib.request
+
+BATCH_ROWS = 200
+BATCH_INTERVAL = 5.0
+# Oldest spooled batches are dropped beyond this, so a long outage cannot fill the disk
+SPOOL_MAX_MB = 512
+MAX_BACKOFF = 300.0
+# Largest decompressed batch the collector accepts
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+def _json_default(value):
+    # numpy scalars (np.float32, np.bool_) from the DSP code
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+def encode_batch(table, rows, device_label, batch_id=None):
+    """
+    Gzip JSON batch: column names once, one list per row, BLOB columns base64
+    encoded and listed under "blobs". Returns (batch_id, body).
+    """
+    batch_id = batch_id or uuid.uuid4().hex
+    columns = []
+    for row in rows:
+        columns.extend(c for c in row if c not in columns and c != 'id')
+    blobs = [c for c in columns if any(isinstance(row.get(c), (bytes, bytearray, memoryview)) for row in rows)]
+    encoded = []
+    for row in rows:
+        values = [row.get(c) for c in columns]
+        for i, c in enumerate(columns):
+            if c in blobs and values[i] is not None:
+                values[i] = base64.b64encode(bytes(values[i])).decode('ascii')
+        encoded.append(values)
+    payload = {'batch_id': batch_id, 'device_label': device_label, 'table': table,
+               'created': time.time(), 'columns': columns, 'blobs': blobs, 'rows': encoded}
+    body = gzip.compress(json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8'), compresslevel=6)
+    return batch_id, body
+
+def decode_batch(body, compressed=True, max_bytes=MAX_BATCH_BYTES):
+    """
+    Parse a batch from encode_batch(); BLOB columns come back as bytes.
+    Raises ValueError for malformed or oversized batches.
+    """
+    if compressed:
+        inflater = zlib.decompressobj(wbits=31)
+        try:
+            body = inflater.decompress(body, max_bytes)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Batch larger than {max_bytes} bytes uncompressed")
+    try:
+        payload = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid batch JSON: {e}")
+    for key in ('batch_id', 'table', 'columns', 'rows'):
+        if key not in payload:
+            raise ValueError(f"Batch is missing '{key}'")
+    columns = payload['columns']
+    blob_idx = [columns.index(c) for c in payload.get('blobs', []) if c in columns]
+    rows = []
+    for values in payload['rows']:
+        if len(values) != len(columns):
+            raise ValueError("Row length does not match the column list")
+        for i in blob_idx:
+            if values[i] is not None:
+                values[i] = base64.b64decode(values[i])
+        rows.append(values)
+    payload['rows'] = rows
+    return payload
+
+def shipper_from_env(device_label, data_dir, name='detections'):
+    """
+    DetectionShipper configured from COLLECTOR_URL / INGEST_TOKEN / SPOOL_DIR,
+    or None when COLLECTOR_URL is unset (local database only).
+    """
+    url = os.getenv('COLLECTOR_URL')
+    if not url:
+        return None
+    spool_dir = os.getenv('SPOOL_DIR', os.path.join(data_dir, 'spool'))
+    return DetectionShipper(url, device_label, os.path.join(spool_dir, name), token=os.getenv('INGEST_TOKEN'),
+                            spool_max_mb=float(os.getenv('SPOOL_MAX_MB', str(SPOOL_MAX_MB))))
+
+class DetectionShipper:
+    """
+    Background thread that batches committed rows into the spool directory and
+    sends spooled batches to the collector oldest first, backing off
+    exponentially while it is unreachable.
+    """
+
+    def __init__(self, collector_url, device_label, spool_dir, token=None, batch_rows=BATCH_ROWS,
+                 batch_interval=BATCH_INTERVAL, spool_max_mb=SPOOL_MAX_MB, timeout=30.0):
+        self.url = collector_url.rstrip('/') + '/ingest'
+        self.device_label = device_label
+        self.spool_dir = spool_dir
+        self.token = token
+        self.batch_rows = batch_rows
+        self.batch_interval = batch_interval
+        self.spool_max_bytes = int(spool_max_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.batches_sent = 0
+        self.rows_sent = 0
+        self.send_errors = 0
+        self.batches_dropped = 0
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self.queue = queue.Queue()
+        os.makedirs(spool_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="detection-shipper", daemon=True)
+        self._thread.start()
+
+    def submit(self, table, rows):
+        """Queue rows (column -> value dicts) that were committed locally."""
+        self.queue.put((table, list(rows)))
+
+    def spooled(self):
+        """Batches waiting in the spool directory."""
+        return len(glob.glob(os.path.join(self.spool_dir, '*.json.gz')))
+
+    def close(self, drain_timeout=10.0):
+        """Spool everything still queued and make one last attempt to send it."""
+        self.queue.put(None)
+        self._thread.join()
+        deadline = time.monotonic() + drain_timeout
+        self._next_attempt = 0.0
+        while time.monotonic() < deadline and self._send_spooled():
+            pass
+
+    def _run(self):
+        pending = {}
+        count = 0
+        oldest = None
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                stopping = True
+            elif item:
+                table, rows = item
+                pending.setdefault(table, []).extend(rows)
+                count += len(rows)
+                oldest = oldest or time.monotonic()
+            if count and (stopping or count >= self.batch_rows or time.monotonic() - oldest >= self.batch_interval):
+                for table, rows in pending.items():
+                    for start in range(0, len(rows), self.batch_rows):
+                        self._spool(table, rows[start:start + self.batch_rows])
+                pending, count, oldest = {}, 0, None
+            if not stopping:
+                self._send_spooled()
+
+    def _spool(self, table, rows):
+        batch_id, body = encode_batch(table, rows, self.device_label)
+        # Nanosecond prefix keeps the directory listing in send order
+        name = f"{time.time_ns()}-{batch_id}.json.gz"
+        tmp = os.path.join(self.spool_dir, name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, os.path.join(self.spool_dir, name))
+        self._enforce_spool_limit()
+
+    def _enforce_spool_limit(self):
+        files = sorted(glob.glob(os.path.join(self.spool_dir, '*.json.gz')))
+        total = sum(os.path.getsize(f) for f in files)
+        while files and total > self.spool_max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            self.batches_dropped += 1
+            print(f"⚠️  Spool over {self.spool_max_bytes // (1024 * 1024)} MB, dropped {os.path.basename(oldest)}")
+
+    def _send_spooled(self):
+        """Send spooled batches until one fails. Returns True if anything was sent."""
+        if time.monotonic() < self._next_attempt:
+            return False
+        sent = False
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, '*.json.gz'))):
+            with open(path, 'rb') as f:
+                body = f.read()
+            status = self._post(body)
+            if status in (200, 201):
+                os.remove(path)
+                self.batches_sent += 1
+                self._backoff = 0.0
+                sent = True
+            elif status is not None and 400 <= status < 500 and status not in (401, 403, 408, 429):
+                # The collector will never accept this batch; keep it aside instead of retrying forever
+                rejected = os.path.join(self.spool_dir, 'rejected')
+                os.makedirs(rejected, exist_ok=True)
+                os.replace(path, os.path.join(rejected, os.path.basename(path)))
+                print(f"⚠️  Collector rejected {os.path.basename(path)} (HTTP {status}), moved to {rejected}")
+            else:
+                self.send_errors += 1
+                self._backoff = min(MAX_BACKOFF, max(1.0, self._backoff * 2))
+                self._next_attempt = time.monotonic() + self._backoff
+                break
+        return sent
+
+    def _post(self, body):
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read() or b'{}')
+                self.rows_sent += result.get('rows', 0)
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
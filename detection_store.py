@@ -0,0 +1,311 @@
+"""
+Detection database access shared by the listeners and the API.
+A single background writer batches inserts so capture and DSP never wait on
+SQLite commits, and several capture workers can feed one database connection.
+The API reads through per-thread, read-only pooled connections.
+"""
+
+import os
+import sqlite3
+import threading
+import queue
+import time
+
+def open_db(db_path):
+    """Open a detections database with WAL mode for concurrent access."""
+    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA busy_timeout=30000')
+    return conn
+
+def open_read_db(db_path, mmap_size=256 * 1024 * 1024, cache_size_kb=16384, cached_statements=256):
+    """
+    Open a read-only connection tuned for the API: query_only so a stray write
+    can never block the listener, memory-mapped reads and a larger page cache.
+    """
+    conn = sqlite3.connect(db_path, timeout=30.0, cached_statements=cached_statements)
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.execute('PRAGMA query_only=ON')
+    conn.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    conn.execute(f'PRAGMA cache_size={-int(cache_size_kb)}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+DETECTORS = ('classic', 'ml', 'all')
+# Views over the classic table and the attached ML database, per detector
+DETECTOR_VIEWS = {'classic': 'detections', 'ml': 'ml_detections', 'all': 'all_detections'}
+
+def unified_arms(conn, detector='all'):
+    """
+    (select list, table) per store for a detector: the classic column set, then
+    the ML-only columns, then a detector column, NULL where a store lacks a column.
+    The ML arm is present only while the ML database is attached.
+    """
+    classic = [row[1] for row in conn.execute('PRAGMA main.table_info(detections)')]
+    attached = any(row[1] == 'ml' for row in conn.execute('PRAGMA database_list'))
+    ml = [row[1] for row in conn.execute('PRAGMA ml.table_info(detections_ml)')] if attached else []
+    ml_only = [c for c in ml if c not in classic]
+    arms = []
+    if detector in ('classic', 'all'):
+        arms.append((", ".join(classic + [f"NULL AS {c}" for c in ml_only] + ["'classic' AS detector"]),
+                     'main.detections'))
+    if detector in ('ml', 'all') and ml:
+        arms.append((", ".join([c if c in ml else f"NULL AS {c}" for c in classic] + ml_only + ["'ml' AS detector"]),
+                     'ml.detections_ml'))
+    return arms
+
+def attach_ml(conn, ml_db_path):
+    """
+    Attach the ML listener's database as 'ml' and (re)create the temp views
+    ml_detections and all_detections with the unified_arms() column set.
+    Without an ML database the ML view is empty and all_detections holds the
+    classic rows. Returns True if the ML table is attached.
+    """
+    if ml_db_path and os.path.exists(ml_db_path):
+        if not any(row[1] == 'ml' for row in conn.execute('PRAGMA database_list')):
+            conn.execute('ATTACH DATABASE ? AS ml', (ml_db_path,))
+    attached = bool(unified_arms(conn, 'ml'))
+    classic_arm = unified_arms(conn, 'classic')[0]
+    views = {
+        DETECTOR_VIEWS['ml']: unified_arms(conn, 'ml') or [(classic_arm[0], 'main.detections WHERE 0')],
+        DETECTOR_VIEWS['all']: unified_arms(conn, 'all')
+    }
+    # query_only also blocks temp schema changes; these views only touch the temp schema
+    query_only = conn.execute('PRAGMA query_only').fetchone()[0]
+    conn.execute('PRAGMA query_only=OFF')
+    try:
+        for name, arms in views.items():
+            conn.execute(f'DROP VIEW IF EXISTS temp.{name}')
+            conn.execute(f"CREATE TEMP VIEW {name} AS " +
+                         " UNION ALL ".join(f"SELECT {columns} FROM {table}" for columns, table in arms))
+    finally:
+        conn.execute(f'PRAGMA query_only={"ON" if query_only else "OFF"}')
+    return attached
+
+def detections_source(params):
+    """
+    Table or view to read for the request's detector parameter (classic by
+    default, ml or all). Raises ValueError for unknown detectors.
+    """
+    detector = params.get('detector', 'classic')
+    if detector not in DETECTOR_VIEWS:
+        raise ValueError(f"detector must be one of {', '.join(DETECTORS)}")
+    return DETECTOR_VIEWS[detector]
+
+def union_count(conn, detector, clause, args):
+    """Matching rows across the detector's stores, counted per store on its own indexes."""
+    arms = unified_arms(conn, detector)
+    return sum(conn.execute(f"SELECT COUNT(*) FROM {table} WHERE 1=1{clause}", args).fetchone()[0]
+               for _, table in arms)
+
+def union_page(conn, detector, clause, args, sort, order, limit, offset):
+    """
+    One page of rows across the detector's stores, sorted as requested.
+    Each store returns its own first offset+limit rows through its index and
+    only those are merged, instead of sorting the whole union.
+    """
+    arms = unified_arms(conn, detector)
+    if not arms:
+        # detector=ml before the ML database exists
+        return []
+    top = limit + offset
+    parts = [f"SELECT * FROM (SELECT {columns} FROM {table} WHERE 1=1{clause} ORDER BY {sort} {order} LIMIT ?)"
+             for columns, table in arms]
+    query = " UNION ALL ".join(parts) + f" ORDER BY {sort} {order} LIMIT ? OFFSET ?"
+    return conn.execute(query, (list(args) + [top]) * len(arms) + [limit, offset]).fetchall()
+
+class ReadConnectionPool:
+    """
+    One read-only connection per thread, kept open across requests so the
+    connect, PRAGMA setup and statement preparation happen once per thread
+    instead of once per request. Sized implicitly by the server's thread count.
+    With ml_db_path, each connection also attaches the ML database and exposes
+    the ml_detections/all_detections views; an ML database created later is picked up.
+    """
+
+    def __init__(self, db_path, ml_db_path=None, **options):
+        self.db_path = db_path
+        self.ml_db_path = ml_db_path
+        self.options = options
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_read_db(self.db_path, **self.options)
+            self._local.conn = conn
+            self._local.ml_attached = self._attach(conn)
+        elif not self._local.ml_attached and self.ml_db_path and os.path.exists(self.ml_db_path):
+            self._local.ml_attached = self._attach(conn)
+        return conn
+
+    def _attach(self, conn):
+        try:
+            return attach_ml(conn, self.ml_db_path)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not attach ML detections database: {e}")
+            return False
+
+    def reset(self):
+        """Drop this thread's connection (e.g. after an error left it unusable)."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+def filter_clause(params):
+    """
+    SQL WHERE fragment (starting with ' AND') and arguments for the standard
+    request filters: start/end timestamps, device_label, label/labels, min_freq/max_freq.
+    """
+    clause = ""
+    args = []
+    if 'start' in params:
+        clause += " AND timestamp >= ?"
+        args.append(params['start'])
+    if 'end' in params:
+        clause += " AND timestamp <= ?"
+        args.append(params['end'])
+    if 'device_label' in params:
+        clause += " AND device_label = ?"
+        args.append(params['device_label'])
+    if 'label' in params:
+        clause += " AND label = ?"
+        args.append(params['label'])
+    if 'labels' in params:
+        labels_list = [l.strip() for l in params['labels'].split(',')]
+        clause += f" AND label IN ({','.join('?' for _ in labels_list)})"
+        args.extend(labels_list)
+    if 'min_freq' in params:
+        clause += " AND freq >= ?"
+        args.append(float(params['min_freq']))
+    if 'max_freq' in params:
+        clause += " AND freq <= ?"
+        args.append(float(params['max_freq']))
+    return clause, args
+
+# Tables whose rows are rewritten in place (keyed on this column) instead of appended
+UPSERT_KEYS = {'detection_events': 'event_id'}
+
+def insert_sql(table, columns):
+    """INSERT statement for `columns`; an upsert on the key column for UPSERT_KEYS tables."""
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    key = UPSERT_KEYS.get(table)
+    if key in columns:
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != key)
+        sql += f" ON CONFLICT({key}) DO UPDATE SET {updates}" if updates else f" ON CONFLICT({key}) DO NOTHING"
+    return sql
+
+def insert_rows(conn, table, rows):
+    """Insert a list of column->value dicts, one executemany per column set."""
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row.keys()), []).append(tuple(row.values()))
+    for columns, values in groups.items():
+        conn.executemany(insert_sql(table, columns), values)
+
+class DetectionWriter:
+    """Background thread that owns the database connection and commits in batches."""
+
+    def __init__(self, db_path, batch_size=50, flush_interval=1.0, max_queue=1000, metrics=None,
+                 rollups=False, rollup_interval=10.0, shipper=None):
+        self.db_path = db_path
+        self.metrics = metrics
+        # Committed rows are also handed to a DetectionShipper (central collector)
+        self.shipper = shipper
+        # Keep detection_rollups (long-range time series) current from this writer
+        self.rollups = rollups
+        self.rollup_interval = rollup_interval
+        self._last_rollup = 0.0
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.rows_written = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="detection-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, table, row):
+        """Queue one row (dict of column -> value) for insertion."""
+        self.queue.put((table, row))
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def flush(self):
+        """Block until every submitted row has been committed."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = open_db(self.db_path)
+        if self.rollups:
+            self._refresh_rollups(conn, setup=True)
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self.rollups and time.monotonic() - self._last_rollup >= self.rollup_interval:
+                    self._refresh_rollups(conn)
+                continue
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                    self.queue.task_done()
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self._write(conn, batch)
+            if self.rollups and (stopping or time.monotonic() - self._last_rollup >= self.rollup_interval):
+                self._refresh_rollups(conn)
+        conn.close()
+
+    def _refresh_rollups(self, conn, setup=False):
+        # Imported here: detection_rollups itself builds on this module
+        from detection_rollups import ensure_rollup_tables, refresh_rollups
+        self._last_rollup = time.monotonic()
+        try:
+            if setup:
+                ensure_rollup_tables(conn)
+            refresh_rollups(conn)
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Warning: Could not update time series rollups: {e}")
+
+    def _write(self, conn, batch):
+        if not batch:
+            return
+        by_table = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        start = time.perf_counter()
+        try:
+            for table, rows in by_table.items():
+                insert_rows(conn, table, rows)
+            conn.commit()
+            self.rows_written += len(batch)
+            if self.metrics is not None:
+                self.metrics.observe("db_commit", time.perf_counter() - start)
+            if self.shipper is not None:
+                for table, rows in by_table.items():
+                    self.shipper.submit(table, rows)
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.errors += 1
+            print(f"Warning: Failed to write {len(batch)} detection(s): {e}")
+        finally:
+            for _ in batch:
+                self.queue.task_done()
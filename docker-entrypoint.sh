@@ -11,7 +11,7 @@ if [ ! -f /app/data/detections.db ]; then
 fi
 
 # Initialize ML database if it doesn't exist
-if [ ! -f /app/data/ml_detections.db ]; then
+if [ ! -f /app/data/detections_ml.db ]; then
     echo "🤖 Initializing ML database..."
     python init_ml_db.py
 fi
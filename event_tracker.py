@@ -0,0 +1,174 @@
+"""
+Detection events for the classic listener.
+While a channel stays off its baseline, every sweep used to store a full
+detection row (~25 KB of spectrum, waterfall and I/Q BLOBs). The tracker
+instead opens one event per channel when it goes anomalous, keeps running
+aggregates in memory (duration, observation count, min/max/mean of the key
+metrics) and writes a single detection_events row, rewritten in place at a
+heartbeat and when the event closes. Full detection rows are only stored for
+the opening sweep and then as a sparse snapshot series.
+
+    EVENT_HEARTBEAT=60 EVENT_SNAPSHOT_INTERVAL=300 EVENT_CLOSE_SWEEPS=2 python listen.py
+    EVENT_SNAPSHOT_INTERVAL=0 python listen.py       # opening row only
+"""
+
+import os
+import uuid
+
+# Seconds between rewrites of an open event's row
+EVENT_HEARTBEAT = float(os.getenv('EVENT_HEARTBEAT', '60'))
+# Seconds between full detection rows while an event is open (0 = opening row only)
+EVENT_SNAPSHOT_INTERVAL = float(os.getenv('EVENT_SNAPSHOT_INTERVAL', '300'))
+# Sweeps without an anomalous visit before an event closes
+EVENT_CLOSE_SWEEPS = int(os.getenv('EVENT_CLOSE_SWEEPS', '2'))
+
+# Aggregated per event as <metric>_min / _max / _mean
+EVENT_METRICS = ('snr', 'peak_power', 'bandwidth', 'noise_floor', 'confidence_score', 'activity_score')
+
+def ensure_event_tables(conn):
+    metric_columns = ",\n".join(f"{m}_min REAL, {m}_max REAL, {m}_mean REAL" for m in EVENT_METRICS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS detection_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT UNIQUE,
+            timestamp TEXT,
+            end_time TEXT,
+            duration REAL,
+            status TEXT,
+            freq REAL,
+            label TEXT,
+            device_label TEXT,
+            device_lat REAL,
+            device_long REAL,
+            observations INTEGER,
+            snapshots INTEGER,
+            {metric_columns}
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detection_events_timestamp ON detection_events(timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detection_events_device ON detection_events(device_label, timestamp)')
+    conn.commit()
+
+class DetectionEvent:
+    """Running aggregates of one channel's anomalous period."""
+
+    def __init__(self, freq, label, start):
+        self.event_id = uuid.uuid4().hex
+        self.freq = freq
+        self.label = label
+        self.start = start
+        self.last_seen = start
+        self.observations = 0
+        self.snapshots = 0
+        self.last_snapshot = None
+        self.last_written = None
+        self.quiet_sweeps = 0
+        # metric -> [min, max, sum, n]
+        self.stats = {m: [None, None, 0.0, 0] for m in EVENT_METRICS}
+
+    @property
+    def duration(self):
+        return (self.last_seen - self.start).total_seconds()
+
+    def update(self, timestamp, measurements):
+        self.last_seen = timestamp
+        self.observations += 1
+        self.quiet_sweeps = 0
+        for metric, value in measurements.items():
+            if metric not in self.stats or value is None:
+                continue
+            value = float(value)
+            s = self.stats[metric]
+            s[0] = value if s[0] is None else min(s[0], value)
+            s[1] = value if s[1] is None else max(s[1], value)
+            s[2] += value
+            s[3] += 1
+
+    def row(self, status, device_label=None, device_lat=None, device_long=None):
+        """detection_events row (column -> value) for the current aggregates."""
+        row = {
+            'event_id': self.event_id, 'timestamp': self.start.isoformat(),
+            'end_time': self.last_seen.isoformat(), 'duration': self.duration, 'status': status,
+            'freq': self.freq, 'label': self.label,
+            'device_label': device_label, 'device_lat': device_lat, 'device_long': device_long,
+            'observations': self.observations, 'snapshots': self.snapshots
+        }
+        for metric, (low, high, total, n) in self.stats.items():
+            row[f'{metric}_min'] = low
+            row[f'{metric}_max'] = high
+            row[f'{metric}_mean'] = total / n if n else None
+        return row
+
+class EventTracker:
+    """
+    Open events per (freq, label), or per caller key such as a sweep-wide
+    broadband event, for one listener. observe() is called for every
+    anomalous visit, end_sweep() once per sweep; rows go to the
+    listener's DetectionWriter.
+    """
+
+    def __init__(self, writer, device_label=None, device_lat=None, device_long=None,
+                 heartbeat=EVENT_HEARTBEAT, snapshot_interval=EVENT_SNAPSHOT_INTERVAL, close_sweeps=EVENT_CLOSE_SWEEPS):
+        self.writer = writer
+        self.device = (device_label, device_lat, device_long)
+        self.heartbeat = heartbeat
+        self.snapshot_interval = snapshot_interval
+        self.close_sweeps = max(1, close_sweeps)
+        self.events = {}
+        self.opened = 0
+        self.closed = 0
+        self.snapshots = 0
+        self.suppressed = 0
+
+    def observe(self, freq, label, timestamp, measurements, key=None):
+        """
+        Fold one anomalous visit into the channel's event, opening one if
+        needed. Returns (event, snapshot): snapshot is True when this visit's
+        full detection row should be stored. `key` (default (freq, label))
+        identifies the event across sweeps.
+        """
+        key = key or (freq, label)
+        event = self.events.get(key)
+        if event is None:
+            event = self.events[key] = DetectionEvent(freq, label, timestamp)
+            self.opened += 1
+        event.update(timestamp, measurements)
+        snapshot = event.last_snapshot is None or (
+            self.snapshot_interval > 0 and (timestamp - event.last_snapshot).total_seconds() >= self.snapshot_interval)
+        if snapshot:
+            event.last_snapshot = timestamp
+            event.snapshots += 1
+            self.snapshots += 1
+        else:
+            self.suppressed += 1
+        if event.last_written is None:
+            self._write(event, 'open', timestamp)
+        return event, snapshot
+
+    def end_sweep(self, timestamp):
+        """
+        Close events that had no anomalous visit for close_sweeps
+        sweeps (channels the pre-screen skipped count as quiet) and rewrite
+        open events that are due a heartbeat.
+        """
+        for key, event in list(self.events.items()):
+            if event.last_seen < timestamp:
+                event.quiet_sweeps += 1
+            if event.quiet_sweeps >= self.close_sweeps:
+                self._close(key, timestamp)
+            elif (timestamp - event.last_written).total_seconds() >= self.heartbeat:
+                self._write(event, 'open', timestamp)
+
+    def close_all(self, timestamp):
+        """Close every open event (listener shutdown)."""
+        for key in list(self.events):
+            self._close(key, timestamp)
+
+    def _close(self, key, timestamp):
+        event = self.events.pop(key)
+        self._write(event, 'closed', timestamp)
+        self.closed += 1
+
+    def _write(self, event, status, timestamp):
+        event.last_written = timestamp
+        self.writer.submit('detection_events', event.row(status, *self.device))
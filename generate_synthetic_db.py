@@ -0,0 +1,236 @@
+"""
+Generate large synthetic detection databases for API and dashboard load testing.
+Rows follow the baseline channels (frequencies, labels, power levels) with
+realistic jitter, spread over a configurable time span and number of devices,
+and carry BLOBs shaped like the listener's (spectrum, raw IQ, waterfall, peaks):
+
+    python generate_synthetic_db.py --rows 2000000 --days 90 --devices 8
+    python generate_synthetic_db.py --rows 500000 --blobs light --output data/synthetic/detections.db
+
+Point api.py at the result with DB_PATH=<output> (and load_test_api.py --db).
+"""
+
+import os
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+from init_db import init_db
+from init_ml_db import init_ml_db
+from detection_store import open_db, insert_rows
+from detection_rollups import ensure_rollup_tables, refresh_rollups
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(SCRIPT_DIR, 'data', 'synthetic', 'detections.db')
+
+SAMPLE_RATE = 2.048e6
+SAMPLES = 256*1024
+SPECTRUM_BINS = 512     # downsampled spectrum stored by listen.py
+RAW_SAMPLES = 2048      # raw IQ segment stored by both listeners
+BLOB_VARIANTS = 64      # distinct BLOBs generated per label, reused across rows
+
+# Rough device positions (Lagos area) for multi-device dashboards
+BASE_LAT, BASE_LONG = 6.5244, 3.3792
+
+def load_channels(baseline_file=os.path.join(SCRIPT_DIR, 'baseline.json')):
+    """Unique (freq, label, stats) channels from the baseline, with sane defaults."""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    channels = {}
+    for sig in baseline:
+        channels.setdefault((sig['freq'], sig['label']), sig)
+    return list(channels.values())
+
+class BlobFactory:
+    """Pre-generated spectrum/IQ/waterfall BLOBs per label so bulk generation stays fast."""
+
+    def __init__(self, labels, rng, blobs='full', waterfall_sweeps=8, ml_spectrum_bins=8192):
+        self.blobs = blobs
+        self.rng = rng
+        self.variants = {}
+        for label in labels:
+            self.variants[label] = [self._make(waterfall_sweeps, ml_spectrum_bins) for _ in range(BLOB_VARIANTS)]
+
+    def _spectrum(self, bins):
+        noise_floor = self.rng.normal(25, 3)
+        spectrum = noise_floor + self.rng.normal(0, 2, bins)
+        width = max(1, int(bins * self.rng.uniform(0.01, 0.2)))
+        start = bins // 2 - width // 2
+        spectrum[start:start + width] += self.rng.uniform(10, 40)
+        return spectrum.astype(np.float32)
+
+    def _make(self, waterfall_sweeps, ml_spectrum_bins):
+        if self.blobs == 'none':
+            return {}
+        variant = {
+            'power_spectrum': self._spectrum(SPECTRUM_BINS).tobytes(),
+            'peak_frequencies': np.sort(self.rng.uniform(-SAMPLE_RATE / 2, SAMPLE_RATE / 2, 10)).astype(np.float32).tobytes()
+        }
+        if self.blobs == 'full':
+            iq = (self.rng.normal(0, 0.3, RAW_SAMPLES) + 1j * self.rng.normal(0, 0.3, RAW_SAMPLES)).astype(np.complex64)
+            variant['raw_samples'] = iq.tobytes()
+            variant['fft_history'] = np.concatenate([self._spectrum(SPECTRUM_BINS) for _ in range(waterfall_sweeps)]).tobytes()
+            variant['ml_power_spectrum'] = self._spectrum(ml_spectrum_bins).tobytes()
+        return variant
+
+    def pick(self, label):
+        return self.variants[label][self.rng.integers(BLOB_VARIANTS)]
+
+def timestamps(rng, count, start, end):
+    """Sorted ISO timestamps uniformly spread between start and end."""
+    offsets = np.sort(rng.uniform(0, (end - start).total_seconds(), count))
+    return [(start + datetime.timedelta(seconds=float(s))).isoformat() for s in offsets]
+
+def detection_rows(rng, channels, devices, blob_factory, count, start, end, first_sequence):
+    """One batch of classic detections rows."""
+    picks = rng.integers(len(channels), size=count)
+    device_ids = rng.integers(len(devices), size=count)
+    stamps = timestamps(rng, count, start, end)
+    rows = []
+    for i in range(count):
+        sig = channels[picks[i]]
+        device = devices[device_ids[i]]
+        noise_floor = float(sig.get('noise_floor', 25) + rng.normal(0, 2))
+        peak_power = float(sig.get('peak_power', 55) + rng.normal(0, 6))
+        snr = peak_power - noise_floor
+        bandwidth = float(max(0, sig.get('bandwidth', 200e3) * rng.uniform(0.5, 1.5)))
+        stability = float(abs(rng.normal(0, 500)))
+        row = {
+            'timestamp': stamps[i], 'freq': sig['freq'], 'label': sig['label'],
+            'bandwidth': bandwidth, 'peak_power': peak_power, 'noise_floor': noise_floor, 'snr': snr,
+            'mean_power': float(sig.get('mean_power', noise_floor + 1) + rng.normal(0, 1)),
+            'std_power': float(sig.get('std_power', 8) + rng.normal(0, 1)),
+            'min_power': noise_floor - float(rng.uniform(20, 40)), 'max_power': peak_power,
+            'kurtosis': float(rng.normal(3, 2)), 'skewness': float(rng.normal(1, 0.5)),
+            'num_peaks': int(sig.get('num_peaks', 100) * rng.uniform(0.5, 1.5)),
+            'device_label': device['label'], 'device_lat': device['lat'], 'device_long': device['long'],
+            'confidence_score': float(rng.uniform(40, 100)), 'signal_duration': float(rng.exponential(300)),
+            'center_freq_offset': 0.0, 'bandwidth_efficiency': snr / np.log10(max(bandwidth, 10)),
+            'spectral_centroid': float(rng.normal(0, 2e4)), 'spectral_rolloff': float(rng.uniform(-1e6, 1e6)),
+            'spectral_flux': float(rng.uniform(1e5, 1e6)), 'zero_crossing_rate': float(rng.uniform(0.01, 0.5)),
+            'modulation_index': float(rng.uniform(0.5, 1.5)), 'phase_variance': float(rng.uniform(2, 3.5)),
+            'amplitude_variance': float(rng.uniform(0, 0.1)), 'dominant_frequency': float(rng.normal(0, 1e4)),
+            'frequency_stability': stability, 'scan_number': int(first_sequence + i) // 20 + 1,
+            'detection_sequence': first_sequence + i, 'baseline_deviation': float(abs(rng.normal(0, 5))),
+            'signal_quality_index': float(min(100, max(0, rng.normal(60, 15)))),
+            'interference_level': float(rng.choice([0, 20, 40, 60, 80, 100])),
+            'doppler_shift': 0.0, 'activity_score': float(min(100, (snr / 10) / max(stability / 1000, 0.1)))
+        }
+        blobs = blob_factory.pick(sig['label'])
+        for column in ('power_spectrum', 'raw_samples', 'fft_history', 'peak_frequencies'):
+            if column in blobs:
+                row[column] = blobs[column]
+        rows.append(row)
+    return rows
+
+def ml_rows(rng, channels, devices, blob_factory, count, start, end):
+    """One batch of detections_ml rows."""
+    labels = sorted({c['label'] for c in channels})
+    picks = rng.integers(len(channels), size=count)
+    device_ids = rng.integers(len(devices), size=count)
+    stamps = timestamps(rng, count, start, end)
+    rows = []
+    for i in range(count):
+        sig = channels[picks[i]]
+        device = devices[device_ids[i]]
+        noise_floor = float(sig.get('noise_floor', 25) + rng.normal(0, 2))
+        peak_power = float(sig.get('peak_power', 55) + rng.normal(0, 6))
+        anomaly = bool(rng.random() < 0.2)
+        row = {
+            'timestamp': stamps[i], 'freq': sig['freq'], 'label': sig['label'],
+            'peak_power': peak_power, 'noise_floor': noise_floor, 'snr': peak_power - noise_floor,
+            'bandwidth': float(max(0, sig.get('bandwidth', 200e3) * rng.uniform(0.5, 1.5))),
+            'kurtosis': float(rng.normal(3, 2)), 'skewness': float(rng.normal(1, 0.5)),
+            'num_peaks': int(sig.get('num_peaks', 100) * rng.uniform(0.5, 1.5)),
+            'device_label': device['label'], 'device_lat': device['lat'], 'device_long': device['long'],
+            'iso_forest_anomaly': anomaly,
+            'cnn_predicted_label': sig['label'] if rng.random() < 0.85 else labels[rng.integers(len(labels))],
+            'cnn_confidence': float(rng.uniform(0.3, 1.0))
+        }
+        blobs = blob_factory.pick(sig['label'])
+        if 'ml_power_spectrum' in blobs:
+            row['power_spectrum'] = blobs['ml_power_spectrum']
+            row['raw_samples'] = blobs['raw_samples']
+        rows.append(row)
+    return rows
+
+def populate(db_path, table, make_batch, total, batch_size, start, end):
+    """Insert total rows in time order, batch_size rows per transaction."""
+    conn = open_db(db_path)
+    conn.execute('PRAGMA synchronous=OFF')
+    span = (end - start) / max(1, -(-total // batch_size))
+    written = 0
+    begun = time.perf_counter()
+    try:
+        while written < total:
+            count = min(batch_size, total - written)
+            batch_start = start + span * (written // batch_size)
+            insert_rows(conn, table, make_batch(count, batch_start, batch_start + span, written))
+            conn.commit()
+            written += count
+            rate = written / max(time.perf_counter() - begun, 1e-9)
+            print(f"\r  {table}: {written:,}/{total:,} rows ({rate:,.0f} rows/s)", end="", flush=True)
+    finally:
+        conn.close()
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-populate synthetic detection databases")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="classic detections to generate")
+    parser.add_argument("--ml-rows", type=int, default=None, help="ML detections to generate (default rows/10)")
+    parser.add_argument("--days", type=float, default=30, help="time span covered, ending now")
+    parser.add_argument("--devices", type=int, default=4, help="number of simulated field devices")
+    parser.add_argument("--blobs", choices=["full", "light", "none"], default="full",
+                        help="full: spectrum, raw IQ and waterfall like the listener; light: spectrum and peaks only")
+    parser.add_argument("--waterfall-sweeps", type=int, default=8, help="FFT sweeps per stored waterfall (listener keeps up to 64)")
+    parser.add_argument("--ml-spectrum-bins", type=int, default=8192, help="ML spectrum length (ml_listen stores the full FFT, 262144)")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="classic database path")
+    parser.add_argument("--ml-output", help="ML database path (default detections_ml.db next to --output)")
+    args = parser.parse_args()
+
+    ml_total = args.rows // 10 if args.ml_rows is None else args.ml_rows
+    ml_output = args.ml_output or os.path.join(os.path.dirname(os.path.abspath(args.output)), 'detections_ml.db')
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(ml_output)), exist_ok=True)
+
+    rng = np.random.default_rng(args.seed)
+    channels = load_channels()
+    devices = [
+        {'label': f"DEVICE_{i + 1}", 'lat': BASE_LAT + float(rng.normal(0, 0.05)), 'long': BASE_LONG + float(rng.normal(0, 0.05))}
+        for i in range(args.devices)
+    ]
+    blob_factory = BlobFactory({c['label'] for c in channels}, rng, args.blobs, args.waterfall_sweeps, args.ml_spectrum_bins)
+    end = datetime.datetime.now()
+    start = end - datetime.timedelta(days=args.days)
+
+    print(f"🧪 Synthetic DB | {args.rows:,} detections + {ml_total:,} ML detections | {args.days:g} days | "
+          f"{args.devices} devices | {len(channels)} channels | BLOBs: {args.blobs}")
+    classic_blob = sum(len(v) for k, v in blob_factory.pick(channels[0]['label']).items() if k != 'ml_power_spectrum')
+    ml_blob = sum(len(v) for k, v in blob_factory.pick(channels[0]['label']).items() if k in ('ml_power_spectrum', 'raw_samples'))
+    estimate = (args.rows * (classic_blob + 400) + ml_total * (ml_blob + 200)) / 1e9
+    print(f"   ~{args.rows / (args.days * 24):,.0f} detections/hour | estimated size {estimate:,.1f} GB")
+
+    if args.rows:
+        init_db(args.output)
+        populate(args.output, 'detections',
+                 lambda count, s, e, offset: detection_rows(rng, channels, devices, blob_factory, count, s, e, offset + 1),
+                 args.rows, args.batch, start, end)
+        conn = open_db(args.output)
+        ensure_rollup_tables(conn)
+        print(f"  rollups: {refresh_rollups(conn):,} rows folded in")
+        conn.close()
+    if ml_total:
+        init_ml_db(ml_output)
+        populate(ml_output, 'detections_ml',
+                 lambda count, s, e, offset: ml_rows(rng, channels, devices, blob_factory, count, s, e),
+                 ml_total, args.batch, start, end)
+
+    for path in (args.output, ml_output):
+        if os.path.exists(path):
+            print(f"💾 {path}: {os.path.getsize(path) / 1e6:,.1f} MB")
+
+if __name__ == "__main__":
+    main()
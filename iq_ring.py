@@ -0,0 +1,354 @@
+"""
+Pre-trigger IQ ring buffers and SigMF capture-on-detection for the listener.
+Every capture of a tuned window (the full capture and, with the pre-screen on,
+its short capture) is copied into that window's memory-mapped ring, so the last
+IQ_RING_SECONDS of dwells survive the reusable capture buffers. When a
+detection row is stored, the window's ring contents (pre-trigger) plus the
+next IQ_POST_CAPTURES captures (post-trigger) are written by a background
+thread as a SigMF recording, and the row's sigmf_path points at it.
+
+The listener dwells on each window for one capture per sweep, so a recording
+is a series of SigMF capture segments (one per dwell, each with its own
+core:datetime) rather than one continuous stream.
+
+Disk use is bounded twice: the rings share IQ_RING_MB (least recently
+captured window evicted first) and recordings share IQ_RECORD_MB (least
+recently written recording evicted first).
+
+    IQ_RING=1 python listen.py
+    IQ_RING=1 IQ_RING_DIR=/dev/shm/iq_ring IQ_RECORD_MB=4096 python listen.py
+"""
+
+import os
+import glob
+import json
+import queue
+import datetime
+import threading
+from collections import OrderedDict
+import numpy as np
+
+IQ_RING_ENABLED = os.getenv('IQ_RING', '0') == '1'
+# Captures kept per tuned window, and how far back the pre-trigger window reaches
+IQ_RING_SLOTS = int(os.getenv('IQ_RING_SLOTS', '8'))
+IQ_RING_SECONDS = float(os.getenv('IQ_RING_SECONDS', '60'))
+IQ_RING_MB = float(os.getenv('IQ_RING_MB', '512'))
+# Captures of the window recorded after the triggering one
+IQ_POST_CAPTURES = int(os.getenv('IQ_POST_CAPTURES', '1'))
+IQ_RECORD_MB = float(os.getenv('IQ_RECORD_MB', '2048'))
+
+SIGMF_VERSION = '1.0.0'
+
+class IQRing:
+    """
+    Fixed number of capture slots for one tuned window in a memory-mapped
+    complex64 file. Each slot carries a sequence number that changes on every
+    overwrite, so a background reader can tell whether its copy is intact.
+    Pending recordings hold a reference (acquire/release); an evicted ring is
+    unmapped and deleted once the last one is released, since Windows cannot
+    delete a file that is still mapped.
+    """
+
+    def __init__(self, path, slots, capacity):
+        self.path = path
+        self.capacity = capacity
+        # A fresh file is sparse: slots only take disk space once written
+        self.data = np.memmap(path, dtype=np.complex64, mode='w+', shape=(slots, capacity))
+        self.seq = [-1] * slots
+        self.lengths = [0] * slots
+        self.times = [None] * slots
+        self.counter = 0
+        self.refs = 0
+        self.evicted = False
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def append(self, samples, timestamp):
+        """Copy one capture into the next slot. Returns its sequence number."""
+        slot = self.counter % len(self.seq)
+        n = min(len(samples), self.capacity)
+        self.seq[slot] = -1
+        self.data[slot, :n] = samples[:n]
+        self.lengths[slot] = n
+        self.times[slot] = timestamp
+        self.counter += 1
+        self.seq[slot] = self.counter
+        return self.counter
+
+    def segments(self, since=None):
+        """(slot, seq) of the held captures not older than `since`, oldest first."""
+        held = [(seq, slot) for slot, seq in enumerate(self.seq)
+                if seq > 0 and (since is None or self.times[slot] >= since)]
+        return [(slot, seq) for seq, slot in sorted(held)]
+
+    def read(self, slot, seq):
+        """(samples copy, start time) of a slot, or None if it was overwritten."""
+        if self.seq[slot] != seq:
+            return None
+        samples = np.array(self.data[slot, :self.lengths[slot]])
+        start = self.times[slot]
+        return (samples, start) if self.seq[slot] == seq else None
+
+    def acquire(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            discard = self.evicted and self.refs <= 0
+        if discard:
+            self._discard()
+
+    def evict(self):
+        """Drop the ring now, or when the last pending recording releases it."""
+        with self._lock:
+            self.evicted = True
+            discard = self.refs <= 0
+        if discard:
+            self._discard()
+
+    def _discard(self):
+        # Unmap before unlinking: Windows refuses to delete a mapped file
+        mmap = getattr(self.data, '_mmap', None)
+        if mmap is not None:
+            mmap.close()
+        self.data = None
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            print(f"Warning: Could not remove IQ ring {self.path}: {e}")
+
+class RingStore:
+    """IQ rings per tuned window, evicting the least recently captured window beyond max_mb."""
+
+    def __init__(self, directory, capacity, slots=IQ_RING_SLOTS, max_mb=IQ_RING_MB):
+        self.directory = directory
+        self.capacity = capacity
+        self.slots = max(2, slots)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.rings = OrderedDict()
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+        # Rings never outlive a listener run
+        for stale in glob.glob(os.path.join(directory, '*.cf32')):
+            try:
+                os.remove(stale)
+            except OSError as e:
+                print(f"Warning: Could not remove stale IQ ring {stale}: {e}")
+
+    def ring(self, center_freq):
+        ring = self.rings.get(center_freq)
+        if ring is None:
+            path = os.path.join(self.directory, f"{int(center_freq)}.cf32")
+            ring = self.rings[center_freq] = IQRing(path, self.slots, self.capacity)
+            self._evict()
+        self.rings.move_to_end(center_freq)
+        return ring
+
+    def bytes_used(self):
+        return sum(ring.nbytes for ring in self.rings.values())
+
+    def _evict(self):
+        while len(self.rings) > 1 and self.bytes_used() > self.max_bytes:
+            _, ring = self.rings.popitem(last=False)
+            # Pending recordings keep the mapping until they are written
+            ring.evict()
+            self.evicted += 1
+
+def _utc(timestamp):
+    return timestamp.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def write_sigmf(base_path, segments, sample_rate, description=None, hw=None):
+    """
+    Write base_path.sigmf-data (cf32_le) and base_path.sigmf-meta. segments is
+    a list of (samples, start datetime, center_freq, annotations), each
+    annotation a dict of SigMF annotation fields relative to its segment.
+    Returns the number of samples written.
+    """
+    global_info = {'core:datatype': 'cf32_le', 'core:sample_rate': float(sample_rate),
+                   'core:version': SIGMF_VERSION, 'core:recorder': 'rtl-sdr-detection listen.py'}
+    if description:
+        global_info['core:description'] = description
+    if hw:
+        global_info['core:hw'] = hw
+    captures, annotations = [], []
+    offset = 0
+    tmp = base_path + '.sigmf-data.tmp'
+    with open(tmp, 'wb') as f:
+        for samples, start, center_freq, notes in segments:
+            captures.append({'core:sample_start': offset, 'core:frequency': float(center_freq),
+                             'core:datetime': _utc(start)})
+            for note in notes:
+                annotations.append(dict(note, **{'core:sample_start': offset + note.get('core:sample_start', 0),
+                                                 'core:sample_count': note.get('core:sample_count', len(samples))}))
+            np.asarray(samples, dtype=np.complex64).tofile(f)
+            offset += len(samples)
+    os.replace(tmp, base_path + '.sigmf-data')
+    meta = {'global': global_info, 'captures': captures,
+            'annotations': sorted(annotations, key=lambda a: a['core:sample_start'])}
+    with open(base_path + '.sigmf-meta.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(base_path + '.sigmf-meta.tmp', base_path + '.sigmf-meta')
+    return offset
+
+class _Recording:
+    def __init__(self, base_path, ring, center_freq, segments, post_captures, device):
+        self.base_path = base_path
+        self.ring = ring
+        ring.acquire()
+        self.center_freq = center_freq
+        self.device = device
+        # [slot, seq, annotations] per capture, oldest first
+        self.segments = [[slot, seq, []] for slot, seq in segments]
+        self.remaining = post_captures
+
+def recorder_from_env(data_dir, sample_rate, num_samples, device_label=None):
+    """
+    SigMFRecorder configured from IQ_RING_* / IQ_RECORD_*, or None when IQ_RING
+    is off. Recordings are named after device_label and the capturing dongle.
+    """
+    if not IQ_RING_ENABLED:
+        return None
+    store = RingStore(os.getenv('IQ_RING_DIR', os.path.join(data_dir, 'iq_ring')), num_samples)
+    return SigMFRecorder(store, os.getenv('IQ_RECORD_DIR', os.path.join(data_dir, 'recordings')),
+                         sample_rate, device_label=device_label)
+
+class SigMFRecorder:
+    """
+    Feeds captures into a RingStore and turns triggers into SigMF recordings,
+    written by a background thread so the capture loop only pays for the copy
+    into the ring.
+    """
+
+    def __init__(self, store, directory, sample_rate, pre_seconds=IQ_RING_SECONDS,
+                 post_captures=IQ_POST_CAPTURES, max_mb=IQ_RECORD_MB, device_label=None):
+        self.store = store
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.pre_seconds = pre_seconds
+        self.post_captures = max(0, post_captures)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.device_label = device_label or 'rtlsdr'
+        self.pending = {}
+        self.recordings_written = 0
+        self.segments_lost = 0
+        self.recordings_evicted = 0
+        self.errors = 0
+        self.queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="sigmf-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, capture):
+        """Copy a capture into its window's ring and complete recordings waiting for it."""
+        self._release()
+        center_freq = capture.task.center_freq
+        ring = self.store.ring(center_freq)
+        seq = ring.append(capture.samples, capture.timestamp - datetime.timedelta(seconds=capture.read_time or 0.0))
+        for recording in self.pending.get(center_freq, []):
+            if recording.remaining <= 0:
+                continue
+            if recording.ring is not ring:
+                # The window's ring was evicted and recreated; nothing more to add
+                recording.remaining = 0
+            else:
+                recording.segments.append([(seq - 1) % len(ring.seq), seq, []])
+                recording.remaining -= 1
+
+    def trigger(self, capture, freq, label, bandwidth=None, comment=None):
+        """
+        Record the capture just passed to record() around a detection at `freq`.
+        Channels of the same capture share one recording. Returns the path of
+        its .sigmf-meta file (written once the post-trigger captures arrive).
+        """
+        center_freq = capture.task.center_freq
+        ring = self.store.ring(center_freq)
+        seq = ring.counter
+        waiting = self.pending.setdefault(center_freq, [])
+        recording = next((r for r in waiting if r.ring is ring and any(s[1] == seq for s in r.segments)), None)
+        if recording is None:
+            since = capture.timestamp - datetime.timedelta(seconds=self.pre_seconds)
+            device = self.capture_device(capture)
+            name = f"{device}_{int(freq)}_{capture.timestamp.strftime('%Y%m%dT%H%M%S_%f')}"
+            # Leave room for the post-trigger captures, which overwrite the oldest slots
+            keep = max(1, len(ring.seq) - self.post_captures)
+            recording = _Recording(os.path.join(self.directory, name), ring, center_freq,
+                                   ring.segments(since)[-keep:], self.post_captures, device)
+            waiting.append(recording)
+        half = (bandwidth or 0.0) / 2
+        note = {'core:freq_lower_edge': float(freq - half), 'core:freq_upper_edge': float(freq + half),
+                'core:label': label}
+        if comment:
+            note['core:comment'] = comment
+        for segment in recording.segments:
+            if segment[1] == seq:
+                segment[2].append(note)
+        return recording.base_path + '.sigmf-meta'
+
+    def capture_device(self, capture):
+        """Label of the dongle that made a capture (listeners can run several, RTL_SDR_DEVICES)."""
+        return f"{self.device_label}-sdr{capture.device_index}"
+
+    def _release(self, everything=False):
+        """Hand complete recordings (or all of them) to the writer thread."""
+        for center_freq, waiting in list(self.pending.items()):
+            done = [r for r in waiting if everything or r.remaining <= 0]
+            for recording in done:
+                waiting.remove(recording)
+                self.queue.put(recording)
+            if not waiting:
+                del self.pending[center_freq]
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def close(self):
+        """Write every pending recording with the captures it has, then stop."""
+        self._release(everything=True)
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            recording = self.queue.get()
+            if recording is None:
+                break
+            try:
+                self._write(recording)
+            except OSError as e:
+                self.errors += 1
+                print(f"Warning: Could not write IQ recording {recording.base_path}: {e}")
+            finally:
+                recording.ring.release()
+
+    def _write(self, recording):
+        segments = []
+        for slot, seq, notes in recording.segments:
+            held = recording.ring.read(slot, seq)
+            if held is None:
+                # Overwritten before the writer got to it
+                self.segments_lost += 1
+                continue
+            samples, start = held
+            segments.append((samples, start, recording.center_freq, notes))
+        if not segments:
+            return
+        write_sigmf(recording.base_path, segments, self.sample_rate,
+                    description=f"Detection IQ from {recording.device}", hw=f"RTL-SDR ({recording.device})")
+        self.recordings_written += 1
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        files = sorted(glob.glob(os.path.join(self.directory, '*.sigmf-data')), key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        while len(files) > 1 and total > self.max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            for path in (oldest, oldest[:-len('.sigmf-data')] + '.sigmf-meta'):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.recordings_evicted += 1
@@ -1,35 +1,37 @@
-DEVICE_LABEL = "DEVICE_1"  # Change this for each device
-DEVICE_LAT = 0.0            # Set device latitude
-DEVICE_LONG = 0.0           # Set device longitude
-
 import json
 import numpy as np
-from rtlsdr import RtlSdr
 import time
 import datetime
-import sqlite3
 import struct
 import os
+from sdr_capture import CapturePool
+from channel_plan import plan_capture_groups, channel_view
+from detection_store import DetectionWriter
+from db_migrations import migrate_database
+from listener_metrics import ListenerMetrics
+from detection_shipper import shipper_from_env
+from prescreen import ChannelPrescreen, PRESCREEN_ENABLED
+from event_tracker import EventTracker
+from iq_ring import recorder_from_env
+from sweep_analysis import SweepAnalyzer, BROADBAND_ENABLED
+from burst_detector import CaptureBursts, BURST_DUTY_TOL
+from cfar import CFAR_ENABLED, OCCUPANCY_DB, OCCUPANCY_RULE, LEGACY_OCCUPANCY_RULE, spectrum_noise
+from signal_features import basic_features, spectral_shape, median, SpectrumPeaks, frequency_axis
 
-# Import scipy functions where needed to avoid import issues
-SCIPY_AVAILABLE = False
-try:
-    from scipy import signal as scipy_signal
-    from scipy.stats import kurtosis, skew
-    # Test if find_peaks is actually available
-    if hasattr(scipy_signal, 'find_peaks'):
-        SCIPY_AVAILABLE = True
-    else:
-        print("Warning: scipy.signal.find_peaks not available, using numpy alternatives")
-except ImportError as e:
-    print(f"Warning: scipy not available ({e}), using numpy alternatives")
-except Exception as e:
-    print(f"Warning: scipy import failed ({e}), using numpy alternatives")
+# Set per device (environment or .env), so every sensor reports under its own label
+DEVICE_LABEL = os.getenv('DEVICE_LABEL', 'DEVICE_1')
+DEVICE_LAT = float(os.getenv('DEVICE_LAT', '0.0'))
+DEVICE_LONG = float(os.getenv('DEVICE_LONG', '0.0'))
 
 SAMPLE_RATE = 2.048e6
 SAMPLES = 256*1024
 THRESHOLD_DB = 10
+# Thresholds above the noise reference: occupied bins and peak features / interference estimate.
+# The reference is the local CFAR noise level (cfar.py), or the spectrum median with CFAR=0.
+PEAK_DB = OCCUPANCY_DB
+INTERFERENCE_PEAK_DB = PEAK_DB - 3
 SCAN_INTERVAL = 10
+REVISIT_TARGET = float(os.getenv('REVISIT_TARGET', str(SCAN_INTERVAL * 3)))  # seconds before a channel visit counts as late
 
 # Load baseline
 with open("baseline.json") as f:
@@ -44,10 +46,18 @@ known_signals = [
         "label": sig["label"],
         "bandwidth": sig["bandwidth"],
         "peak_power": sig.get("peak_power", None),
-        "noise_floor": sig.get("noise_floor", None)
+        "noise_floor": sig.get("noise_floor", None),
+        "burst_duty_cycle": sig.get("burst_duty_cycle", None),
+        "occupancy_rule": sig.get("occupancy_rule", LEGACY_OCCUPANCY_RULE),
+        # Older baselines tuned every channel to its own frequency
+        "capture_center": sig.get("capture_center", sig["freq"])
     }
     for sig in baseline
 ]
+other_rule = sum(sig["occupancy_rule"] != OCCUPANCY_RULE for sig in known_signals)
+if other_rule:
+    print(f"⚠️ {other_rule}/{len(known_signals)} baseline entries were measured with another occupancy rule "
+          f"(not {OCCUPANCY_RULE}); their bandwidth and num_peaks are not compared. Re-collect baseline.json.")
 
 # Scan frequencies from baseline
 FREQUENCIES = [(sig["freq"], sig["label"]) for sig in baseline]
@@ -160,59 +170,66 @@ def calculate_confidence(measured, baseline_val, tolerance, max_deviation=20):
         deviation_pct = min((deviation / max_deviation) * 100, 100)
         return max(0, 50 - (deviation_pct / 2))  # 0-50% confidence
 
-def find_peaks_numpy(data, height_threshold):
-    """Simple peak detection using numpy (fallback for scipy)."""
-    if len(data) < 3:
-        return np.array([])
-    
-    peaks = []
-    data = np.asarray(data)
-    for i in range(1, len(data) - 1):
-        if data[i] > data[i-1] and data[i] > data[i+1] and data[i] > height_threshold:
-            peaks.append(i)
-    return np.array(peaks)
+def find_spectrum_peaks(power, noise):
+    """
+    Peak set shared by the advanced features and quality metrics of one
+    capture. `noise` is the noise floor or the per-bin CFAR noise level.
+    """
+    return SpectrumPeaks(power, noise, min(PEAK_DB, INTERFERENCE_PEAK_DB))
 
-def calculate_kurtosis_numpy(data):
-    """Calculate kurtosis using numpy."""
-    mean = np.mean(data)
-    std = np.std(data)
-    if std == 0:
-        return 0.0
-    normalized = (data - mean) / std
-    return float(np.mean(normalized**4) - 3)
+def calculate_basic_features(power, sample_rate=SAMPLE_RATE, num_samples=SAMPLES, noise=None):
+    """
+    Power statistics of one channel spectrum, as stored in the detections
+    table and measured by collect_baseline.py (signal_features.basic_features).
+    Bandwidth and num_peaks count the bins PEAK_DB above `noise` (the per-bin
+    CFAR noise level), or above the median when it is None.
+    """
+    return basic_features(power, sample_rate / num_samples, noise, PEAK_DB)
 
-def calculate_skew_numpy(data):
-    """Calculate skewness using numpy."""
-    mean = np.mean(data)
-    std = np.std(data)
-    if std == 0:
-        return 0.0
-    normalized = (data - mean) / std
-    return float(np.mean(normalized**3))
+def match_baseline(freq, label, measured, tol, signals=None, capture_center=None):
+    """
+    Return the first known signal the measurement is consistent with, or None.
+    capture_center is the tuning of the capture the measurement came from; power
+    levels are only compared with entries captured at the same tuning.
+    """
+    bandwidth = measured['bandwidth']
+    for sig in known_signals if signals is None else signals:
+        if label == sig["label"]:
+            # Bandwidth and num_peaks measured with another occupancy rule are not comparable
+            same_rule = sig.get("occupancy_rule", LEGACY_OCCUPANCY_RULE) == OCCUPANCY_RULE
+            # Nor are levels from a different tuned window (span, DC spike, roll-off)
+            same_window = capture_center is None or sig.get("capture_center", sig["freq"]) == capture_center
+            if (
+                abs(freq - sig["freq"]) <= tol["freq_tol"]
+                and (not same_rule or abs(bandwidth - sig.get("bandwidth", bandwidth)) <= tol["bandwidth_tol"])
+                and (sig.get("peak_power") is None or not same_window
+                     or abs(measured['peak_power'] - sig["peak_power"]) <= tol["peak_power_tol"])
+                and (sig.get("noise_floor") is None or not same_window
+                     or abs(measured['noise_floor'] - sig["noise_floor"]) <= tol["noise_floor_tol"])
+                and (sig.get("snr") is None or not same_window or abs(measured['snr'] - sig["snr"]) <= tol["snr_tol"])
+                and (sig.get("mean_power") is None or not same_window
+                     or abs(measured['mean_power'] - sig["mean_power"]) <= tol["mean_power_tol"])
+                and (sig.get("std_power") is None or not same_window
+                     or abs(measured['std_power'] - sig["std_power"]) <= tol["std_power_tol"])
+                and (sig.get("num_peaks") is None or not same_rule
+                     or abs(measured['num_peaks'] - sig["num_peaks"]) <= tol["num_peaks_tol"])
+                and (sig.get("burst_duty_cycle") is None or measured.get('burst_duty_cycle') is None
+                     or abs(measured['burst_duty_cycle'] - sig["burst_duty_cycle"]) <= tol.get("burst_duty_tol", BURST_DUTY_TOL))
+            ):
+                return sig
+    return None
 
-def calculate_advanced_features(samples, power_spectrum, sample_rate):
-    """Calculate comprehensive signal features for analysis."""
-    features = {}
-    
-    # Spectral features
-    freqs = np.fft.fftfreq(len(power_spectrum), 1/sample_rate)
-    power_linear = 10**(power_spectrum/10)
-    
-    # Spectral centroid (center of mass of spectrum)
-    features['spectral_centroid'] = float(np.sum(freqs * power_linear) / np.sum(power_linear)) if np.sum(power_linear) > 0 else 0.0
-    
-    # Spectral rolloff (frequency below which 85% of energy lies)
-    cumsum_power = np.cumsum(power_linear)
-    rolloff_threshold = 0.85 * cumsum_power[-1]
-    rolloff_idx = np.where(cumsum_power >= rolloff_threshold)[0]
-    features['spectral_rolloff'] = float(freqs[rolloff_idx[0]]) if len(rolloff_idx) > 0 else 0.0
-    
-    # Spectral flux (rate of change in spectrum)
-    if len(power_spectrum) > 1:
-        spectral_flux = np.sum(np.diff(power_spectrum)**2)
-        features['spectral_flux'] = float(spectral_flux)
-    else:
-        features['spectral_flux'] = 0.0
+def calculate_advanced_features(samples, power_spectrum, sample_rate, noise_floor=None, peaks=None):
+    """Calculate comprehensive signal features for analysis.
+    power_spectrum is fftshifted and spans sample_rate, so frequencies are
+    offsets from the channel centre. Pass the noise_floor from
+    calculate_basic_features and the capture's find_spectrum_peaks() result
+    to skip recomputing the median and peaks."""
+    # Spectral features: centroid, 85% rolloff and flux
+    freqs = frequency_axis(len(power_spectrum), sample_rate)
+    features = spectral_shape(power_spectrum, freqs)
+    if noise_floor is None:
+        noise_floor = median(power_spectrum)
     
     # Time domain features from I/Q samples
     if len(samples) > 0:
@@ -236,33 +253,28 @@ def calculate_advanced_features(samples, power_spectrum, sample_rate):
         features['amplitude_variance'] = 0.0
         features['modulation_index'] = 0.0
     
-    # Peak analysis (use scipy if available, otherwise numpy fallback)
-    try:
-        if SCIPY_AVAILABLE:
-            peaks, _ = scipy_signal.find_peaks(power_spectrum, height=np.median(power_spectrum) + 6)
-        else:
-            peaks = find_peaks_numpy(power_spectrum, np.median(power_spectrum) + 6)
-    except (AttributeError, NameError):
-        # Fallback to numpy implementation if scipy fails
-        peaks = find_peaks_numpy(power_spectrum, np.median(power_spectrum) + 6)
+    # Peak analysis, strongest peaks first
+    if peaks is None:
+        peaks = find_spectrum_peaks(power_spectrum, noise_floor)
+    strong = peaks.above(PEAK_DB)
     
-    if len(peaks) > 0:
-        peak_freqs = freqs[peaks[:10]]  # Store up to 10 strongest peaks
-        features['peak_frequencies'] = peak_freqs.astype(np.float32).tobytes()
-        features['dominant_frequency'] = float(freqs[peaks[np.argmax(power_spectrum[peaks])]])
+    if len(strong) > 0:
+        strongest = peaks.strongest(PEAK_DB, limit=10)  # Store up to 10 strongest peaks
+        features['peak_frequencies'] = freqs[strongest].astype(np.float32).tobytes()
+        features['dominant_frequency'] = float(freqs[strongest[0]])
     else:
         features['peak_frequencies'] = np.array([], dtype=np.float32).tobytes()
         features['dominant_frequency'] = 0.0
     
     # Frequency stability (standard deviation of peak frequencies)
-    if len(peaks) > 1:
-        features['frequency_stability'] = float(np.std(freqs[peaks]))
+    if len(strong) > 1:
+        features['frequency_stability'] = float(np.std(freqs[strong]))
     else:
         features['frequency_stability'] = 0.0
     
     return features
 
-def calculate_signal_quality_metrics(power_spectrum, baseline_match, measured_features):
+def calculate_signal_quality_metrics(power_spectrum, baseline_match, measured_features, peaks=None):
     """Calculate signal quality and confidence metrics."""
     metrics = {}
     
@@ -288,13 +300,12 @@ def calculate_signal_quality_metrics(power_spectrum, baseline_match, measured_fe
     
     # Interference level estimation
     if len(power_spectrum) > 10:
-        # Look for multiple peaks indicating interference
-        if SCIPY_AVAILABLE:
-            peaks, _ = scipy_signal.find_peaks(power_spectrum, height=np.median(power_spectrum) + 3)
-        else:
-            # Use numpy fallback for peak detection
-            peaks = find_peaks_numpy(power_spectrum, np.median(power_spectrum) + 3)
-        interference_score = min(len(peaks) / 5, 1) * 100  # More peaks = more interference
+        # Look for multiple peaks indicating interference (measured noise floor is the spectrum median)
+        median_power = measured_features['noise_floor'] if 'noise_floor' in measured_features else median(power_spectrum)
+        if peaks is None:
+            peaks = find_spectrum_peaks(power_spectrum, median_power)
+        num_peaks = peaks.count(INTERFERENCE_PEAK_DB)
+        interference_score = min(num_peaks / 5, 1) * 100  # More peaks = more interference
         metrics['interference_level'] = float(interference_score)
     else:
         metrics['interference_level'] = 0.0
@@ -351,24 +362,22 @@ def print_comparison_compact(measured, baseline, tolerances):
 
 def listen_and_flag():
     """Main listening function with enhanced console output."""
-    # Get device index from environment variable with fallback
-    device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
+    # One capture worker per dongle (RTL_SDR_DEVICES), or RTL_SDR_DEVICE with fallback
     try:
-        sdr = RtlSdr(device_index=device_index)
-        print(f"✓ Using RTL-SDR device at index {device_index}")
+        pool = CapturePool(sample_rate=SAMPLE_RATE, num_samples=SAMPLES).start()
     except Exception as e:
-        device_index = 1 if device_index == 0 else 0
-        print(f"⚠ Device {device_index} failed, trying alternate index {device_index}...")
-        try:
-            sdr = RtlSdr(device_index=device_index)
-            print(f"✓ Using RTL-SDR device at index {device_index}")
-        except Exception as e2:
-            print(f"✗ Could not open any RTL-SDR device: {e2}")
-            print("Make sure your RTL-SDR is connected and drivers are installed.")
-            raise
-    
-    sdr.sample_rate = SAMPLE_RATE
-    sdr.gain = 'auto'
+        print(f"✗ Could not open any RTL-SDR device: {e}")
+        print("Make sure your RTL-SDR is connected and drivers are installed.")
+        raise
+    # Channels that fit in one tuned window share a capture
+    capture_tasks = plan_capture_groups(FREQUENCIES, SAMPLE_RATE)
+    num_channels = sum(len(task.channels) for task in capture_tasks)
+    planned_center = {channel: task.center_freq for task in capture_tasks for channel in task.channels}
+    other_window = sum(planned_center.get((sig["freq"], sig["label"]), sig["capture_center"]) != sig["capture_center"]
+                       for sig in known_signals)
+    if other_window:
+        print(f"⚠️ {other_window}/{len(known_signals)} baseline entries were captured at another tuning "
+              f"(CHANNEL_GROUPING changed?); their power levels are not compared. Re-collect baseline.json.")
     
     # Use DB_PATH from environment or default to data directory
     # Check for Docker environment first, then use local data folder
@@ -380,10 +389,23 @@ def listen_and_flag():
             os.makedirs(data_dir)
         db_path = os.getenv('DB_PATH', os.path.join(data_dir, 'detections.db'))
     
-    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
-    conn.execute('PRAGMA journal_mode=WAL')
-    conn.execute('PRAGMA busy_timeout=30000')
+    # Bring older databases up to the schema the INSERT below expects
+    migrate_database(db_path, 'classic')
+    metrics = ListenerMetrics("classic")
+    metrics_path = os.getenv('METRICS_FILE', os.path.join(os.path.dirname(db_path), 'listener_metrics.prom'))
+    # COLLECTOR_URL set: also push committed detections to the central API
+    shipper = shipper_from_env(DEVICE_LABEL, os.path.dirname(db_path))
+    writer = DetectionWriter(db_path, metrics=metrics, rollups=True, shipper=shipper)
     print(f"📁 Database: {db_path}")
+    if shipper is not None:
+        print(f"📡 Shipping detections to {shipper.url} (spool: {shipper.spool_dir})")
+    # IQ_RING=1: keep recent captures per tuned window and save SigMF recordings of detections
+    recorder = recorder_from_env(os.path.dirname(db_path), SAMPLE_RATE, SAMPLES, DEVICE_LABEL)
+    if recorder is not None:
+        print(f"🎙️  IQ recordings: {recorder.directory} (rings: {recorder.store.directory})")
+    
+    # Short-capture first tier: quiet channels skip the full capture and feature pipeline
+    prescreen = ChannelPrescreen(SAMPLE_RATE) if PRESCREEN_ENABLED else None
     
     # For waterfall: keep a rolling buffer of FFTs per frequency
     fft_history = {}
@@ -393,61 +415,165 @@ def listen_and_flag():
     scan_count = 0
     detection_count = 0
     detection_sequence = 0
-    last_detection_time = {}
+    # Cross-channel view of each sweep: plan-wide deviations become one broadband event
+    analyzer = SweepAnalyzer([channel for task in capture_tasks for channel in task.channels]) if BROADBAND_ENABLED else None
+    
+    # One event per anomalous period; full detection rows only as sparse snapshots
+    events = EventTracker(writer, DEVICE_LABEL, DEVICE_LAT, DEVICE_LONG)
     frequency_history = {}  # Track frequency changes over time for Doppler analysis
     
-    print(f"🛰️  RTL-SDR LISTENER | Device: {DEVICE_LABEL} | {len(FREQUENCIES)} freqs | {SAMPLE_RATE/1e6:.1f}MHz | {SCAN_INTERVAL}s interval")
+    print(f"🛰️  RTL-SDR LISTENER | Device: {DEVICE_LABEL} | {num_channels} freqs in {len(capture_tasks)} captures | {SAMPLE_RATE/1e6:.1f}MHz | {SCAN_INTERVAL}s interval | SDRs: {pool.live_devices()}")
     
     try:
         while True:
             scan_count += 1
             scan_time = datetime.datetime.now()
+            sweep_start = time.perf_counter()
             
-            for freq, label in FREQUENCIES:
-                sdr.center_freq = freq
-                samples = sdr.read_samples(SAMPLES)
-                
-                # Store a short segment of raw samples
-                raw_samples = samples[:2048]
+            if prescreen is not None:
+                full_tasks, selected = prescreen.sweep(pool, capture_tasks, metrics, REVISIT_TARGET, recorder)
+            else:
+                full_tasks, selected = capture_tasks, None
+            
+            # Anomalous channels wait for the sweep-level analysis before the full feature pipeline
+            anomalies = []
+            sweep_rows = {}
+            for capture in pool.sweep(full_tasks):
+                samples = capture.samples
+                metrics.observe("retune", capture.tune_time)
+                metrics.observe("read_samples", capture.read_time)
+                metrics.inc("captures")
+                if recorder is not None:
+                    stage_start = time.perf_counter()
+                    recorder.record(capture)
+                    metrics.observe("iq_ring", time.perf_counter() - stage_start)
                 
-                # FFT for this sweep
-                power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
+                # FFT for this sweep, shared by every channel in the capture group
+                stage_start = time.perf_counter()
+                capture_power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
+                metrics.observe("fft", time.perf_counter() - stage_start)
                 
-                # Waterfall: update FFT history
-                if freq not in fft_history:
-                    fft_history[freq] = []
-                fft_history[freq].append(power.astype(np.float32))
-                if len(fft_history[freq]) > max_history:
-                    fft_history[freq].pop(0)
+                # Local noise level per bin, so thresholds follow the band instead of the global median
+                capture_noise = None
+                if CFAR_ENABLED:
+                    stage_start = time.perf_counter()
+                    capture_noise = spectrum_noise(capture_power)
+                    metrics.observe("cfar", time.perf_counter() - stage_start)
                 
-                # Basic features
-                peak_power = float(np.max(power))
-                noise_floor = float(np.median(power))
-                mean_power = float(np.mean(power))
-                std_power = float(np.std(power))
-                min_power = float(np.min(power))
-                max_power = float(np.max(power))
-                snr = peak_power - noise_floor
+                # Short-time FFT for the time-domain burst features, also shared by the group
+                stage_start = time.perf_counter()
+                bursts = CaptureBursts(samples, SAMPLE_RATE, capture.task.center_freq)
+                metrics.observe("bursts", time.perf_counter() - stage_start)
                 
-                # Use scipy if available, otherwise numpy fallback
-                try:
-                    if SCIPY_AVAILABLE:
-                        kurt = float(kurtosis(power))
-                        skewness = float(skew(power))
+                for freq, label in capture.task.channels:
+                    if selected is not None and (freq, label) not in selected:
+                        continue
+                    channel_start = stage_start = time.perf_counter()
+                    # With the pre-screen on, the short capture already counted as the visit
+                    revisit = metrics.visit(f"{freq/1e6:.4f}MHz", channel_start) if selected is None else None
+                    if revisit is not None and revisit > REVISIT_TARGET:
+                        metrics.inc("late_visits")
+                    
+                    # Channel spectrum and a short segment of raw samples
+                    power, raw_samples = channel_view(capture_power, samples, capture.task, freq, label, SAMPLE_RATE)
+                    noise = None
+                    if capture_noise is not None:
+                        noise, _ = channel_view(capture_noise, samples, capture.task, freq, label, SAMPLE_RATE, raw_len=0)
+                    
+                    # Waterfall: update FFT history
+                    if freq not in fft_history:
+                        fft_history[freq] = []
+                    fft_history[freq].append(power.astype(np.float32))
+                    if len(fft_history[freq]) > max_history:
+                        fft_history[freq].pop(0)
+                    
+                    # Basic features
+                    basic = calculate_basic_features(power, noise=noise)
+                    basic.update(bursts.features(freq, label))
+                    # A burst the pre-screen caught in its short dwell may be over by the full capture
+                    if selected is not None and not basic['burst_count'] and (freq, label) in prescreen.bursts:
+                        basic.update(prescreen.bursts[(freq, label)])
+                    sweep_rows[(freq, label)] = basic
+                    
+                    # Track frequency changes for Doppler analysis
+                    if freq not in frequency_history:
+                        frequency_history[freq] = []
+                    frequency_history[freq].append((scan_time, freq))
+                    if len(frequency_history[freq]) > 10:  # Keep last 10 measurements
+                        frequency_history[freq].pop(0)
+                    
+                    metrics.observe("features", time.perf_counter() - stage_start)
+                    stage_start = time.perf_counter()
+                    
+                    # Check if this signal matches any in the baseline
+                    tol = get_tolerances(label, freq)
+                    baseline_match = match_baseline(freq, label, basic, tol, capture_center=capture.task.center_freq)
+                    match_found = baseline_match is not None
+                    if selected is not None and selected.get((freq, label)) == 'burst':
+                        # Brief transmission on a channel that is rarely bursty
+                        match_found = False
+                    
+                    metrics.observe("matching", time.perf_counter() - stage_start)
+                    
+                    if not match_found:
+                        # The capture buffer is reused, so keep a copy of the raw segment
+                        anomalies.append({
+                            'freq': freq, 'label': label, 'capture': capture, 'power': power,
+                            'raw_samples': raw_samples.copy(), 'basic': basic, 'tol': tol, 'noise': noise,
+                            'baseline_match': baseline_match,
+                            'view_span': SAMPLE_RATE * len(power) / len(capture_power),
+                            'elapsed': time.perf_counter() - channel_start
+                        })
                     else:
-                        kurt = calculate_kurtosis_numpy(power)
-                        skewness = calculate_skew_numpy(power)
-                except (AttributeError, NameError):
-                    # Fallback to numpy implementations
-                    kurt = calculate_kurtosis_numpy(power)
-                    skewness = calculate_skew_numpy(power)
-                bandwidth = float(np.sum(power > noise_floor + 6) * (SAMPLE_RATE / SAMPLES))
-                peaks = np.where(power > noise_floor + 6)[0]
-                num_peaks = int(len(peaks))
+                        metrics.observe_channel(f"{freq/1e6:.4f}MHz", time.perf_counter() - channel_start)
+            
+            # One vectorised pass over the sweep: correlated deviations across the plan are one event
+            broadband = None
+            if analyzer is not None:
+                stage_start = time.perf_counter()
+                broadband = analyzer.analyze(sweep_rows)
+                metrics.observe("sweep_analysis", time.perf_counter() - stage_start)
+            if broadband is not None:
+                suppressed = [a for a in anomalies if (a['freq'], a['label']) in broadband.explained]
+                analyzer.suppressed += len(suppressed)
+                detection_count += 1
+                low, high = broadband.span
+                broadband_event, _ = events.observe((low + high) / 2, broadband.label, scan_time, {
+                    'snr': broadband.shifts['snr'], 'peak_power': broadband.shifts['peak_power'],
+                    'noise_floor': broadband.shifts['noise_floor'], 'bandwidth': high - low,
+                    'confidence_score': 100.0 * broadband.fraction
+                }, key='broadband')
+                shifts = ' '.join(f"{name}:{value:+.1f}dB" for name, value in broadband.shifts.items())
+                print(f"\n🌐 BROADBAND {broadband.label} @ {scan_time.strftime('%H:%M:%S')} | "
+                      f"{len(broadband.channels)} channels {low/1e6:.3f}-{high/1e6:.3f}MHz ({broadband.fraction:.0%} of plan) | "
+                      f"{shifts} | event {broadband_event.event_id[:8]}, {len(suppressed)} channel rows suppressed")
+            
+            for anomaly in anomalies:
+                freq, label, capture = anomaly['freq'], anomaly['label'], anomaly['capture']
+                if broadband is not None and (freq, label) in broadband.explained:
+                    metrics.observe_channel(f"{freq/1e6:.4f}MHz", anomaly['elapsed'])
+                    continue
+                channel_start = stage_start = time.perf_counter()
+                power, raw_samples, basic = anomaly['power'], anomaly['raw_samples'], anomaly['basic']
+                tol, baseline_match = anomaly['tol'], anomaly['baseline_match']
+                peak_power = basic['peak_power']
+                noise_floor = basic['noise_floor']
+                mean_power = basic['mean_power']
+                std_power = basic['std_power']
+                min_power = basic['min_power']
+                max_power = basic['max_power']
+                snr = basic['snr']
+                kurt = basic['kurtosis']
+                skewness = basic['skewness']
+                bandwidth = basic['bandwidth']
+                num_peaks = basic['num_peaks']
                 
                 # Calculate advanced features with error handling
+                spectrum_peaks = None
                 try:
-                    advanced_features = calculate_advanced_features(raw_samples, power, SAMPLE_RATE)
+                    spectrum_peaks = find_spectrum_peaks(power, noise_floor if anomaly['noise'] is None else anomaly['noise'])
+                    # A grouped channel's sub-band spans only its share of the capture bandwidth
+                    advanced_features = calculate_advanced_features(raw_samples, power, anomaly['view_span'], noise_floor, spectrum_peaks)
                 except Exception as e:
                     print(f"Warning: Failed to calculate advanced features: {e}")
                     # Provide default values
@@ -469,14 +595,7 @@ def listen_and_flag():
                     'snr': snr, 'bandwidth': bandwidth, 'peak_power': peak_power,
                     'noise_floor': noise_floor, 'frequency_stability': advanced_features['frequency_stability']
                 }
-                quality_metrics = calculate_signal_quality_metrics(power, None, measured_features)
-                
-                # Track frequency changes for Doppler analysis
-                if freq not in frequency_history:
-                    frequency_history[freq] = []
-                frequency_history[freq].append((scan_time, freq))
-                if len(frequency_history[freq]) > 10:  # Keep last 10 measurements
-                    frequency_history[freq].pop(0)
+                quality_metrics = calculate_signal_quality_metrics(power, None, measured_features, spectrum_peaks)
                 
                 # Calculate Doppler shift estimation
                 doppler_shift = 0.0
@@ -486,57 +605,56 @@ def listen_and_flag():
                         doppler_shift = float(np.std(freq_changes))
                 
                 # Center frequency offset from nominal
-                center_freq_offset = float(freq - sdr.center_freq) if hasattr(sdr, 'center_freq') else 0.0
+                center_freq_offset = float(freq - capture.task.center_freq)
                 
                 # Activity score (combination of power and stability)
                 activity_score = min(100, (snr / 10) * (1 / max(advanced_features['frequency_stability'] / 1000, 0.1)))
                 
-                # Check if this signal matches any in the baseline
-                match_found = False
-                baseline_match = None
-                tol = get_tolerances(label, freq)
+                metrics.observe("detection_features", time.perf_counter() - stage_start)
+                stage_start = time.perf_counter()
+                detection_count += 1
                 
-                for sig in known_signals:
-                    if label == sig["label"]:
-                        if (
-                            abs(freq - sig["freq"]) <= tol["freq_tol"]
-                            and abs(bandwidth - sig.get("bandwidth", bandwidth)) <= tol["bandwidth_tol"]
-                            and (sig.get("peak_power") is None or abs(peak_power - sig["peak_power"]) <= tol["peak_power_tol"])
-                            and (sig.get("noise_floor") is None or abs(noise_floor - sig["noise_floor"]) <= tol["noise_floor_tol"])
-                            and (sig.get("snr") is None or abs(snr - sig["snr"]) <= tol["snr_tol"])
-                            and (sig.get("mean_power") is None or abs(mean_power - sig["mean_power"]) <= tol["mean_power_tol"])
-                            and (sig.get("std_power") is None or abs(std_power - sig["std_power"]) <= tol["std_power_tol"])
-                            and (sig.get("num_peaks") is None or abs(num_peaks - sig["num_peaks"]) <= tol["num_peaks_tol"])
-                        ):
-                            match_found = True
-                            baseline_match = sig
-                            break
+                # Calculate confidence scores
+                confidence_scores = {}
+                overall_confidence = 0
                 
-                if not match_found:
-                    detection_count += 1
-                    
-                    # Calculate confidence scores
-                    confidence_scores = {}
-                    overall_confidence = 0
-                    
-                    if baseline_match:
-                        confidence_scores['peak_power'] = calculate_confidence(peak_power, baseline_match.get('peak_power'), tol.get('peak_power_tol', 10))
-                        confidence_scores['snr'] = calculate_confidence(snr, baseline_match.get('snr'), tol.get('snr_tol', 10))
-                        confidence_scores['bandwidth'] = calculate_confidence(bandwidth, baseline_match.get('bandwidth'), tol.get('bandwidth_tol', 1000))
-                        overall_confidence = np.mean(list(confidence_scores.values()))
-                    else:
-                        overall_confidence = 75.0  # Default confidence for new detections
-                    
-                    # Print compact detection
-                    print_compact_detection(scan_time, freq, label, DEVICE_LABEL, peak_power, snr, bandwidth, overall_confidence)
-                    
-                    # Add mini spectrum and baseline status
-                    spectrum_mini = print_mini_spectrum(power, noise_floor, width=20)
-                    baseline_status = print_comparison_compact({'peak_power': peak_power, 'snr': snr, 'bandwidth': bandwidth}, baseline_match, tol)
-                    print(f"    {spectrum_mini} {baseline_status}Peaks:{num_peaks} Kurt:{kurt:.1f}")
-                    
-                    # Save to database (essential data only)
-                    c = conn.cursor()
+                if baseline_match:
+                    confidence_scores['peak_power'] = calculate_confidence(peak_power, baseline_match.get('peak_power'), tol.get('peak_power_tol', 10))
+                    confidence_scores['snr'] = calculate_confidence(snr, baseline_match.get('snr'), tol.get('snr_tol', 10))
+                    confidence_scores['bandwidth'] = calculate_confidence(bandwidth, baseline_match.get('bandwidth'), tol.get('bandwidth_tol', 1000))
+                    overall_confidence = np.mean(list(confidence_scores.values()))
+                else:
+                    overall_confidence = 75.0  # Default confidence for new detections
+                
+                # Print compact detection
+                print_compact_detection(scan_time, freq, label, DEVICE_LABEL, peak_power, snr, bandwidth, overall_confidence)
+                
+                # Add mini spectrum and baseline status
+                spectrum_mini = print_mini_spectrum(power, noise_floor, width=20)
+                baseline_status = print_comparison_compact({'peak_power': peak_power, 'snr': snr, 'bandwidth': bandwidth}, baseline_match, tol)
+                print(f"    {spectrum_mini} {baseline_status}Peaks:{num_peaks} Kurt:{kurt:.1f} Bursts:{basic['burst_count']}")
+                
+                # Calculate baseline deviation if baseline exists
+                baseline_deviation = 0.0
+                if baseline_match:
+                    deviations = []
+                    if baseline_match.get('peak_power'):
+                        deviations.append(abs(peak_power - baseline_match['peak_power']))
+                    if baseline_match.get('bandwidth'):
+                        deviations.append(abs(bandwidth - baseline_match['bandwidth']) / 1000)  # Normalize
+                    baseline_deviation = float(np.mean(deviations)) if deviations else 0.0
+                
+                detection_sequence += 1
+                
+                # Fold this sweep into the channel's event; signal duration is the event's age
+                event, snapshot = events.observe(freq, label, scan_time, {
+                    'snr': snr, 'peak_power': peak_power, 'bandwidth': bandwidth, 'noise_floor': noise_floor,
+                    'confidence_score': overall_confidence, 'activity_score': activity_score
+                })
+                signal_duration = event.duration
+                
+                if snapshot:
+                    # Opening row and sparse snapshots get the full detection row (essential data only)
                     # Downsample FFT history for waterfall (reduce from 262k to 512 points per sweep)
                     waterfall_data = None
                     if len(fft_history[freq]) >= 2:  # Need at least 2 sweeps for waterfall
@@ -556,59 +674,89 @@ def listen_and_flag():
                     
                     # Store only a small raw sample segment for analysis (2048 samples = ~8KB)
                     raw_samples_light = raw_samples.astype(np.complex64).tobytes()
+                    # Full pre/post-trigger IQ goes to a SigMF recording instead
+                    sigmf_path = None
+                    if recorder is not None:
+                        sigmf_path = recorder.trigger(capture, freq, label, bandwidth, comment=f"event {event.event_id}")
                     
-                    # Calculate signal duration (time since first detection of this signal)
-                    signal_key = f"{freq}_{label}"
-                    if signal_key not in last_detection_time:
-                        last_detection_time[signal_key] = scan_time
-                        signal_duration = 0.0
-                    else:
-                        signal_duration = (scan_time - last_detection_time[signal_key]).total_seconds()
+                    writer.submit('detections', {
+                        'timestamp': scan_time.isoformat(), 'freq': freq, 'label': label,
+                        'bandwidth': bandwidth, 'peak_power': peak_power, 'noise_floor': noise_floor, 'snr': snr,
+                        'mean_power': mean_power, 'std_power': std_power, 'min_power': min_power, 'max_power': max_power,
+                        'kurtosis': kurt, 'skewness': skewness, 'num_peaks': num_peaks,
+                        'power_spectrum': power_spectrum_downsampled,
+                        'device_label': DEVICE_LABEL, 'device_lat': DEVICE_LAT, 'device_long': DEVICE_LONG,
+                        'raw_samples': raw_samples_light, 'fft_history': waterfall_data,
+                        'confidence_score': overall_confidence, 'signal_duration': signal_duration,
+                        'center_freq_offset': center_freq_offset,
+                        'bandwidth_efficiency': quality_metrics['bandwidth_efficiency'],
+                        'spectral_centroid': advanced_features['spectral_centroid'],
+                        'spectral_rolloff': advanced_features['spectral_rolloff'],
+                        'spectral_flux': advanced_features['spectral_flux'],
+                        'zero_crossing_rate': advanced_features['zero_crossing_rate'],
+                        'peak_frequencies': advanced_features['peak_frequencies'],
+                        'modulation_index': advanced_features['modulation_index'],
+                        'phase_variance': advanced_features['phase_variance'],
+                        'amplitude_variance': advanced_features['amplitude_variance'],
+                        'dominant_frequency': advanced_features['dominant_frequency'],
+                        'frequency_stability': advanced_features['frequency_stability'],
+                        'scan_number': scan_count, 'detection_sequence': detection_sequence,
+                        'baseline_deviation': baseline_deviation,
+                        'signal_quality_index': quality_metrics['signal_quality_index'],
+                        'interference_level': quality_metrics['interference_level'],
+                        'doppler_shift': doppler_shift, 'activity_score': activity_score,
+                        'event_id': event.event_id, 'sigmf_path': sigmf_path,
+                        'burst_count': basic['burst_count'], 'burst_duty_cycle': basic['burst_duty_cycle'],
+                        'burst_duration': basic['burst_duration'], 'burst_period': basic['burst_period'],
+                        'burst_times': basic['burst_times'],
+                        # Frequency span of power_spectrum: the capture rate, or a grouped channel's sub-band
+                        'spectrum_span': anomaly['view_span']
+                    })
                     
-                    # Calculate baseline deviation if baseline exists
-                    baseline_deviation = 0.0
-                    if baseline_match:
-                        deviations = []
-                        if baseline_match.get('peak_power'):
-                            deviations.append(abs(peak_power - baseline_match['peak_power']))
-                        if baseline_match.get('bandwidth'):
-                            deviations.append(abs(bandwidth - baseline_match['bandwidth']) / 1000)  # Normalize
-                        baseline_deviation = float(np.mean(deviations)) if deviations else 0.0
-                    
-                    detection_sequence += 1
-                    
-                    c.execute('''
-                        INSERT INTO detections (
-                            timestamp, freq, label, bandwidth, peak_power, noise_floor, snr,
-                            mean_power, std_power, min_power, max_power, kurtosis, skewness, num_peaks,
-                            power_spectrum, device_label, device_lat, device_long, raw_samples, fft_history,
-                            confidence_score, signal_duration, center_freq_offset, bandwidth_efficiency,
-                            spectral_centroid, spectral_rolloff, spectral_flux, zero_crossing_rate,
-                            peak_frequencies, modulation_index, phase_variance, amplitude_variance,
-                            dominant_frequency, frequency_stability, scan_number, detection_sequence,
-                            baseline_deviation, signal_quality_index, interference_level, doppler_shift, activity_score
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        scan_time.isoformat(), freq, label, bandwidth, peak_power, noise_floor, snr,
-                        mean_power, std_power, min_power, max_power, kurt, skewness, num_peaks,
-                        power_spectrum_downsampled, DEVICE_LABEL, DEVICE_LAT, DEVICE_LONG, 
-                        raw_samples_light, waterfall_data,
-                        overall_confidence, signal_duration, center_freq_offset, quality_metrics['bandwidth_efficiency'],
-                        advanced_features['spectral_centroid'], advanced_features['spectral_rolloff'], 
-                        advanced_features['spectral_flux'], advanced_features['zero_crossing_rate'],
-                        advanced_features['peak_frequencies'], advanced_features['modulation_index'],
-                        advanced_features['phase_variance'], advanced_features['amplitude_variance'],
-                        advanced_features['dominant_frequency'], advanced_features['frequency_stability'],
-                        scan_count, detection_sequence, baseline_deviation, quality_metrics['signal_quality_index'],
-                        quality_metrics['interference_level'], doppler_shift, activity_score
-                    ))
-                    conn.commit()
-                    
-                    print(f"\n✅ Saved to database. Total detections: {detection_count}")
+                    print(f"\n✅ Queued for database (event {event.event_id[:8]}, snapshot {event.snapshots}). Total detections: {detection_count}")
+                metrics.observe("record", time.perf_counter() - stage_start)
+                metrics.inc("detections")
+                metrics.observe_channel(f"{freq/1e6:.4f}MHz", anomaly['elapsed'] + time.perf_counter() - channel_start)
+            
+            events.end_sweep(scan_time)
+            
+            # Sweep-level metrics, published for the API's /metrics endpoint
+            metrics.observe_sweep(time.perf_counter() - sweep_start)
+            metrics.set_gauge("writer_queue_depth", writer.queue_depth())
+            metrics.set_gauge("writer_rows_written", writer.rows_written)
+            metrics.set_gauge("writer_errors", writer.errors)
+            metrics.set_gauge("live_devices", len(pool.live_devices()))
+            metrics.set_gauge("dropped_captures", pool.dropped_captures)
+            metrics.set_gauge("scan_number", scan_count)
+            if prescreen is not None:
+                metrics.set_gauge("prescreen_tripped", prescreen.tripped)
+                metrics.set_gauge("prescreen_drift_checks", prescreen.drift_checks)
+                metrics.set_gauge("prescreen_skipped", prescreen.skipped)
+                metrics.set_gauge("prescreen_burst_trips", prescreen.burst_trips)
+            if recorder is not None:
+                metrics.set_gauge("iq_recordings_written", recorder.recordings_written)
+                metrics.set_gauge("iq_recordings_evicted", recorder.recordings_evicted)
+                metrics.set_gauge("iq_segments_lost", recorder.segments_lost)
+                metrics.set_gauge("iq_recorder_queue_depth", recorder.queue_depth())
+            if analyzer is not None:
+                metrics.set_gauge("broadband_events", analyzer.events)
+                metrics.set_gauge("broadband_suppressed_rows", analyzer.suppressed)
+            metrics.set_gauge("events_open", len(events.events))
+            metrics.set_gauge("events_opened", events.opened)
+            metrics.set_gauge("events_closed", events.closed)
+            metrics.set_gauge("event_rows_suppressed", events.suppressed)
+            if shipper is not None:
+                metrics.set_gauge("ship_spooled_batches", shipper.spooled())
+                metrics.set_gauge("ship_batches_sent", shipper.batches_sent)
+                metrics.set_gauge("ship_errors", shipper.send_errors)
+            try:
+                metrics.write(metrics_path)
+            except OSError as e:
+                print(f"Warning: Could not write metrics: {e}")
             
             # Compact scan status
             if detection_count == 0:
-                print(f"⏱️  Scan #{scan_count} @ {scan_time.strftime('%H:%M:%S')} - {len(FREQUENCIES)} freqs monitored, no new signals")
+                print(f"⏱️  Scan #{scan_count} @ {scan_time.strftime('%H:%M:%S')} - {num_channels} freqs monitored, no new signals")
             time.sleep(SCAN_INTERVAL)
     
     except KeyboardInterrupt:
@@ -616,7 +764,14 @@ def listen_and_flag():
         print("🛑 LISTENER STOPPED BY USER")
         print(f"Total scans: {scan_count} | Total detections: {detection_count}")
         print("="*100 + "\n")
-        conn.close()
+    finally:
+        events.close_all(datetime.datetime.now())
+        pool.close()
+        if recorder is not None:
+            recorder.close()
+        writer.close()
+        if shipper is not None:
+            shipper.close()
 
 if __name__ == "__main__":
     listen_and_flag()
@@ -0,0 +1,124 @@
+"""
+Latency and throughput metrics for the listeners.
+Histograms per processing stage and per channel, plus sweep counters and gauges,
+rendered in the Prometheus text format. The listener writes them to a status
+file after every sweep and api.py serves the files at /metrics.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds, covering sub-millisecond DSP steps up to whole sweeps
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    """Cumulative-bucket histogram as used by Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class ListenerMetrics:
+    """Thread-safe metric registry for one listener process."""
+
+    def __init__(self, listener="classic"):
+        self.listener = listener
+        self.stages = {}
+        self.channels = {}
+        self.revisits = {}
+        self.sweeps = Histogram()
+        self.counters = {}
+        self.gauges = {}
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_channel(self, channel, seconds):
+        with self._lock:
+            self.channels.setdefault(channel, Histogram()).observe(seconds)
+
+    def visit(self, channel, timestamp):
+        """Record a channel visit; returns the interval since the previous one (or None)."""
+        with self._lock:
+            previous = self._last_seen.get(channel)
+            self._last_seen[channel] = timestamp
+            if previous is None:
+                return None
+            interval = timestamp - previous
+            self.revisits.setdefault(channel, Histogram()).observe(interval)
+            return interval
+
+    def observe_sweep(self, seconds):
+        with self._lock:
+            self.sweeps.observe(seconds)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def render(self):
+        base = f'listener="{self.listener}"'
+        with self._lock:
+            lines = [
+                "# HELP rtlsdr_stage_seconds Time spent in each processing stage",
+                "# TYPE rtlsdr_stage_seconds histogram"
+            ]
+            for stage, hist in sorted(self.stages.items()):
+                lines += hist.render("rtlsdr_stage_seconds", f'{base},stage="{stage}"')
+            lines += [
+                "# HELP rtlsdr_channel_seconds Processing time per channel and capture",
+                "# TYPE rtlsdr_channel_seconds histogram"
+            ]
+            for channel, hist in sorted(self.channels.items()):
+                lines += hist.render("rtlsdr_channel_seconds", f'{base},channel="{channel}"')
+            lines += [
+                "# HELP rtlsdr_revisit_seconds Achieved interval between visits to a channel",
+                "# TYPE rtlsdr_revisit_seconds histogram"
+            ]
+            for channel, hist in sorted(self.revisits.items()):
+                lines += hist.render("rtlsdr_revisit_seconds", f'{base},channel="{channel}"')
+            lines += [
+                "# HELP rtlsdr_sweep_seconds Wall-clock duration of a full sweep",
+                "# TYPE rtlsdr_sweep_seconds histogram"
+            ]
+            lines += self.sweeps.render("rtlsdr_sweep_seconds", base)
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE rtlsdr_{name}_total counter")
+                lines.append(f"rtlsdr_{name}_total{{{base}}} {value}")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE rtlsdr_{name} gauge")
+                lines.append(f"rtlsdr_{name}{{{base}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write the current metrics to a status file."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
@@ -0,0 +1,212 @@
+"""
+Load test for the dashboard API.
+Each virtual client replays the dashboard's polling pattern: /devices once, then
+/statistics plus the chart_data requests of one tab, cycling through the tabs
+like a user clicking around. Reports per-endpoint p50/p90/p99 latency,
+throughput and errors:
+
+    python load_test_api.py --url http://localhost:5000 --clients 20 --duration 60
+    python load_test_api.py --db data/synthetic/detections.db --clients 8   # in-process, no server needed
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+
+# Requests issued by templates/dashboard.html per tab (path, params)
+DASHBOARD_TABS = {
+    "overview": [
+        ("/timeseries", {"metrics": "peak_power,snr", "points": 300}),
+        ("/aggregate/frequency", {"freq_bin": 10e6}),
+        ("/statistics", {})
+    ],
+    "spectral": [
+        ("/chart_data/spectrum", {"page_size": 5}),
+        ("/chart_data/waterfall", {"page_size": 3}),
+        ("/chart_data/advanced_spectral", {"page_size": 50})
+    ],
+    "temporal": [
+        ("/chart_data/time_series", {"page_size": 100}),
+        ("/chart_data/performance_metrics", {"page_size": 100})
+    ],
+    "quality": [
+        ("/chart_data/signal_quality", {"page_size": 100})
+    ],
+    "advanced": [
+        ("/chart_data/modulation_analysis", {"page_size": 50}),
+        ("/chart_data/constellation", {"page_size": 5}),
+        ("/chart_data/features", {"page_size": 50})
+    ],
+    "raw": [
+        ("/detections", {"page_size": 100, "sort": "timestamp", "order": "desc"})
+    ]
+}
+
+class HttpClient:
+    """Plain HTTP against a running api.py / WSGI server."""
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, path, params):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+class InProcessClient:
+    """Flask test client: measures handler and database cost without HTTP."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path, params):
+        response = self.client.get(path, query_string=params)
+        return response.status_code, response.get_data()
+
+class LoadStats:
+    """Thread-safe latency samples per endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok, size):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        everything = []
+        for endpoint, samples in sorted(self.latencies.items()):
+            arr = np.asarray(samples)
+            everything.extend(samples)
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors.get(endpoint, 0),
+                "p50_ms": float(np.percentile(arr, 50) * 1e3),
+                "p90_ms": float(np.percentile(arr, 90) * 1e3),
+                "p99_ms": float(np.percentile(arr, 99) * 1e3),
+                "max_ms": float(arr.max() * 1e3),
+                "avg_kb": self.bytes.get(endpoint, 0) / len(samples) / 1e3
+            }
+        arr = np.asarray(everything) if everything else np.zeros(1)
+        return {
+            "elapsed_s": elapsed,
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "throughput_rps": len(everything) / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": float(np.percentile(arr, 50) * 1e3),
+            "p99_ms": float(np.percentile(arr, 99) * 1e3),
+            "endpoints": endpoints
+        }
+
+def virtual_client(client, stats, tabs, device, deadline, think_time, offset):
+    """One dashboard session: pick the device, then poll tab after tab until the deadline."""
+    def timed_get(path, params):
+        start = time.perf_counter()
+        try:
+            status, body = client.get(path, params)
+            ok = status == 200
+        except Exception:
+            body, ok = b"", False
+        stats.record(path, time.perf_counter() - start, ok, len(body))
+        return body if ok else None
+
+    if device is None:
+        body = timed_get("/devices", {})
+        devices = json.loads(body) if body else []
+        device = devices[0]["device_label"] if devices else None
+    else:
+        timed_get("/devices", {})
+
+    cycle = offset
+    while time.time() < deadline:
+        tab = tabs[cycle % len(tabs)]
+        cycle += 1
+        timed_get("/statistics", {})
+        for path, params in DASHBOARD_TABS[tab]:
+            if time.time() >= deadline:
+                break
+            request_params = dict(params)
+            if device is not None and path != "/statistics":
+                request_params["device_label"] = device
+            timed_get(path, request_params)
+        if think_time:
+            time.sleep(think_time)
+
+def run_load_test(make_client, clients, duration, tabs, device=None, think_time=0.0):
+    stats = LoadStats()
+    deadline = time.time() + duration
+    threads = [
+        threading.Thread(target=virtual_client, args=(make_client(), stats, tabs, device, deadline, think_time, i), daemon=True)
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return stats.summary(time.perf_counter() - start)
+
+def print_report(result):
+    print(f"\n{'Endpoint':<36}{'reqs':>7}{'err':>5}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'KB':>8}")
+    for endpoint, s in result["endpoints"].items():
+        print(f"{endpoint:<36}{s['requests']:>7}{s['errors']:>5}{s['p50_ms']:>9.1f}{s['p90_ms']:>9.1f}"
+              f"{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}{s['avg_kb']:>8.1f}")
+    print(f"\n📈 {result['requests']} requests in {result['elapsed_s']:.1f}s = {result['throughput_rps']:.1f} req/s | "
+          f"p50 {result['p50_ms']:.1f} ms | p99 {result['p99_ms']:.1f} ms | errors {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the dashboard polling pattern against api.py")
+    parser.add_argument("--url", default="http://localhost:5000", help="API base URL")
+    parser.add_argument("--db", help="run in-process against this database instead of --url")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent dashboard sessions")
+    parser.add_argument("--duration", type=float, default=30, help="test length in seconds")
+    parser.add_argument("--tabs", nargs="+", choices=list(DASHBOARD_TABS), default=list(DASHBOARD_TABS))
+    parser.add_argument("--device", help="device_label to filter on (default: first from /devices)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between tab refreshes (dashboard uses 30s)")
+    parser.add_argument("--output", help="write the JSON summary here")
+    args = parser.parse_args()
+
+    if args.db:
+        # api.py reads DB_PATH at import time
+        os.environ["DB_PATH"] = os.path.abspath(args.db)
+        import api
+        make_client = lambda: InProcessClient(api.app)
+        target = f"in-process ({args.db})"
+    else:
+        make_client = lambda: HttpClient(args.url)
+        target = args.url
+
+    print(f"🔥 API load test | {target} | {args.clients} clients | {args.duration:g}s | tabs: {', '.join(args.tabs)}")
+    result = run_load_test(make_client, args.clients, args.duration, args.tabs, args.device, args.think_time)
+    result.update({"target": target, "clients": args.clients, "tabs": args.tabs})
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Results saved to {args.output}")
+    if result["requests"] == 0 or result["errors"] == result["requests"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
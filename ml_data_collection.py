@@ -3,14 +3,12 @@ ML-based Signal Detection System
 Combines Isolation Forest for anomaly detection + CNN for classification
 """
 
-import json
 import numpy as np
-from rtlsdr import RtlSdr
-import time
 import datetime
-import pickle
-import os
+import argparse
 import base64
+from sdr_capture import CaptureSession, CollectionLog, pending_plan, SETTLE_TIME
+from signal_features import power_statistics
 
 # Configure GPU memory limiting (2GB max)
 try:
@@ -42,36 +40,23 @@ FREQUENCIES = [
 SAMPLE_RATE = 2.048e6
 SAMPLES = 256*1024
 
-def collect_samples(freq, label):
+def collect_samples(session, freq, label):
     """Collect a single sample at a frequency."""
-    # Get device index from environment variable with fallback
-    device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
-    try:
-        sdr = RtlSdr(device_index=device_index)
-    except:
-        device_index = 1 if device_index == 0 else 0
-        print(f"Trying alternate device index {device_index}...")
-        sdr = RtlSdr(device_index=device_index)
-    sdr.sample_rate = SAMPLE_RATE
-    sdr.center_freq = freq
-    sdr.gain = 'auto'
-    samples = sdr.read_samples(SAMPLES)
+    samples = session.capture(freq, SAMPLES)
     power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
-    peak_power = float(np.max(power))
-    noise_floor = float(np.median(power))
-    mean_power = float(np.mean(power))
-    std_power = float(np.std(power))
-    min_power = float(np.min(power))
-    max_power = float(np.max(power))
+    stats = power_statistics(power)
+    peak_power = stats['peak_power']
+    noise_floor = stats['noise_floor']
+    mean_power = stats['mean_power']
+    std_power = stats['std_power']
+    min_power = stats['min_power']
+    max_power = stats['peak_power']
     snr = peak_power - noise_floor
-    from scipy.stats import kurtosis, skew
-    kurt = float(kurtosis(power))
-    skewness = float(skew(power))
-    bandwidth = float(np.sum(power > noise_floor + 6) * (SAMPLE_RATE / SAMPLES))
-    peaks = np.where(power > noise_floor + 6)[0]
-    num_peaks = int(len(peaks))
+    kurt = stats['kurtosis']
+    skewness = stats['skewness']
+    bandwidth = float(stats['occupied_bins'] * (SAMPLE_RATE / SAMPLES))
+    num_peaks = stats['occupied_bins']
     raw_samples = samples[:2048]
-    sdr.close()
     return {
         "freq": freq,
         "label": label,
@@ -91,24 +76,34 @@ def collect_samples(freq, label):
         "timestamp": datetime.datetime.now().isoformat()
     }
 
-def collect_training_data(num_samples_per_freq=5, output_file="training_data.json"):
+def collect_training_data(num_samples_per_freq=5, output_file="training_data.json", fresh=False, settle_time=SETTLE_TIME):
     """
     Collect training data: multiple samples per frequency to build baseline.
     This data will be used to train Isolation Forest and CNN.
+    The SDR stays open for the whole run; progress is saved after every sample
+    and an interrupted run resumes where it stopped unless fresh=True.
     """
-    print(f"Collecting {num_samples_per_freq} samples per frequency for training...")
-    training_data = []
-    for freq, label in FREQUENCIES:
-        for i in range(num_samples_per_freq):
-            print(f"Collecting {label} at {freq/1e6:.3f} MHz (sample {i+1}/{num_samples_per_freq})...")
-            props = collect_samples(freq, label)
-            training_data.append(props)
-            time.sleep(0.5)
-    with open(output_file, "w") as f:
-        json.dump(training_data, f, indent=2)
+    log = CollectionLog(output_file, fresh=fresh)
+    todo = list(pending_plan(FREQUENCIES, num_samples_per_freq, log.completed()))
+    print(f"Collecting {num_samples_per_freq} samples per frequency for training "
+          f"({len(log.records)} already collected, {len(todo)} remaining)...")
+    try:
+        with CaptureSession(settle_time=settle_time) as session:
+            for freq, label, i in todo:
+                print(f"Collecting {label} at {freq/1e6:.3f} MHz (sample {i+1}/{num_samples_per_freq})...")
+                log.append(collect_samples(session, freq, label))
+    finally:
+        log.finalize()
     print(f"Training data saved to {output_file}")
-    return training_data
+    return log.records
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect ML training data")
     # Reduced from 10 to 5 samples per frequency to save memory
-    collect_training_data(num_samples_per_freq=5)
+    parser.add_argument("--samples", type=int, default=5, help="Samples per frequency")
+    parser.add_argument("--output", default="training_data.json", help="Training data file to write")
+    parser.add_argument("--fresh", action="store_true", help="Ignore existing samples instead of resuming")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME, help="Seconds to wait after each retune")
+    args = parser.parse_args()
+    collect_training_data(num_samples_per_freq=args.samples, output_file=args.output,
+                          fresh=args.fresh, settle_time=args.settle)
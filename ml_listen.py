@@ -8,104 +8,180 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress TF warnings
 
 import json
 import numpy as np
-from rtlsdr import RtlSdr
 import time
 import datetime
-import sqlite3
 import pickle
-from keras.models import load_model
-from keras.backend import clear_session
-import base64
-
-# Configure GPU memory limiting (2GB max)
-try:
-    import tensorflow as tf
-    gpus = tf.config.list_physical_devices('GPU')
-    if gpus:
-        try:
-            tf.config.set_logical_device_configuration(
-                gpus[0],
-                [tf.config.LogicalDeviceConfiguration(memory_limit=2048)]  # 2GB limit
-            )
-        except RuntimeError:
-            pass  # Silently continue if GPU config fails
-except Exception:
-    pass  # Silently continue if TF not available
-
-DEVICE_LABEL = "DEVICE_1"
-DEVICE_LAT = 0.0
-DEVICE_LONG = 0.0
+import argparse
+import threading
+from sdr_capture import CapturePool, single_channel_tasks
+from detection_store import DetectionWriter
+from init_ml_db import init_ml_db
+from online_anomaly import OnlineAnomalyDetector
+from detection_shipper import shipper_from_env
+from signal_features import power_statistics
+
+DEVICE_LABEL = os.getenv('DEVICE_LABEL', 'DEVICE_1')
+DEVICE_LAT = float(os.getenv('DEVICE_LAT', '0.0'))
+DEVICE_LONG = float(os.getenv('DEVICE_LONG', '0.0'))
 
 SAMPLE_RATE = 2.048e6
 SAMPLES = 256*1024
 SCAN_INTERVAL = 10
 
-# Load baseline from training data
-print("Loading training data as baseline...")
-with open("training_data.json") as f:
-    training_data = json.load(f)
-
-# Load trained models
-print("Loading trained models...")
-with open("iso_forest_scaler.pkl", "rb") as f:
-    scaler = pickle.load(f)
-with open("iso_forest_model.pkl", "rb") as f:
-    iso_forest = pickle.load(f)
-
-# Load CNN model (handle both .h5 and split architecture+weights formats)
-try:
-    cnn_model = load_model("cnn_classifier.h5")
-    print("✓ Loaded CNN model from cnn_classifier.h5")
-except Exception as e:
-    print(f"Note: Could not load cnn_classifier.h5, trying split format...")
+# Anomaly verdict: "forest" (Isolation Forest only), "online" (per-channel streaming
+# statistics only) or "both" (flag only when both agree; forest alone while warming up)
+ANOMALY_MODE = os.getenv('ML_ANOMALY_MODE', 'both')
+
+MANIFEST_FILE = "ml_manifest.json"
+TRAINING_FILE = "training_data.json"
+STATUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ml_listen_status.json')
+ONLINE_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'online_anomaly_state.json')
+
+# Filled in by load_manifest() / load_models() so importing this module stays cheap
+FREQUENCIES = []
+max_spectrum_len = None
+scaler = None
+iso_forest = None
+cnn_model = None
+idx_to_label = {}
+
+models_ready = threading.Event()
+model_load_error = None
+
+def configure_gpu():
+    """Configure GPU memory limiting (2GB max)."""
     try:
-        import json
-        with open("cnn_classifier_architecture.json", "r") as json_file:
-            model_json = json_file.read()
-        from keras.models import model_from_json
-        cnn_model = model_from_json(model_json)
-        cnn_model.load_weights("cnn_classifier_weights.h5")
-        print("✓ Loaded CNN model from architecture (JSON) + weights (H5)")
-    except Exception as e2:
-        print(f"ERROR: Could not load CNN model: {e}\n{e2}")
-        print("Please run ml_training.py first to generate the trained model.")
-        exit(1)
+        import tensorflow as tf
+        gpus = tf.config.list_physical_devices('GPU')
+        if gpus:
+            try:
+                tf.config.set_logical_device_configuration(
+                    gpus[0],
+                    [tf.config.LogicalDeviceConfiguration(memory_limit=2048)]  # 2GB limit
+                )
+            except RuntimeError:
+                pass  # Silently continue if GPU config fails
+    except Exception:
+        pass  # Silently continue if TF not available
+
+def report_status(state, **extra):
+    """Write listener readiness to a small status file for health checks."""
+    status = {"state": state, "ready": models_ready.is_set(), "updated": datetime.datetime.now().isoformat()}
+    status.update(extra)
+    try:
+        os.makedirs(os.path.dirname(STATUS_FILE), exist_ok=True)
+        tmp_path = STATUS_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp_path, STATUS_FILE)
+    except OSError:
+        pass
+
+def spectrum_len_from_b64(encoded):
+    """Number of float32 values in a base64 power spectrum, without decoding it."""
+    padding = len(encoded) - len(encoded.rstrip("="))
+    return (len(encoded) * 3 // 4 - padding) // 4
+
+def build_manifest_from_training_data(training_file=TRAINING_FILE):
+    """Derive the manifest from an older training run that did not write one."""
+    with open(training_file) as f:
+        training_data = json.load(f)
+    return {
+        "created": datetime.datetime.now().isoformat(),
+        "training_samples": len(training_data),
+        "frequencies": sorted({(d["freq"], d["label"]) for d in training_data}),
+        "max_spectrum_len": max(spectrum_len_from_b64(d["power_spectrum"]) for d in training_data)
+    }
 
-with open("label_to_idx.pkl", "rb") as f:
-    label_to_idx = pickle.load(f)
+def load_manifest(manifest_file=MANIFEST_FILE):
+    """Load frequency plan and CNN input shape written by ml_training.py."""
+    global FREQUENCIES, max_spectrum_len
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    else:
+        print(f"Note: {manifest_file} not found, deriving it once from {TRAINING_FILE}...")
+        manifest = build_manifest_from_training_data()
+        with open(manifest_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+    FREQUENCIES = [(freq, label) for freq, label in manifest["frequencies"]]
+    max_spectrum_len = int(manifest["max_spectrum_len"])
+    print(f"Manifest: {len(FREQUENCIES)} unique frequencies, spectrum length {max_spectrum_len} "
+          f"({manifest.get('training_samples', '?')} training samples)")
+    return manifest
 
-idx_to_label = {v: k for k, v in label_to_idx.items()}
+def load_cnn_model():
+    """Load CNN model (handle both .h5 and split architecture+weights formats)."""
+    from keras.models import load_model
+    try:
+        model = load_model("cnn_classifier.h5")
+        print("✓ Loaded CNN model from cnn_classifier.h5")
+        return model
+    except Exception as e:
+        print(f"Note: Could not load cnn_classifier.h5, trying split format...")
+        try:
+            with open("cnn_classifier_architecture.json", "r") as json_file:
+                model_json = json_file.read()
+            from keras.models import model_from_json
+            model = model_from_json(model_json)
+            model.load_weights("cnn_classifier_weights.h5")
+            print("✓ Loaded CNN model from architecture (JSON) + weights (H5)")
+            return model
+        except Exception as e2:
+            raise RuntimeError(f"Could not load CNN model: {e}\n{e2}")
 
-# Determine max spectrum length
-power_spectra = []
-for d in training_data:
-    arr = np.frombuffer(base64.b64decode(d["power_spectrum"]), dtype=np.float32)
-    power_spectra.append(arr)
-max_spectrum_len = max(len(p) for p in power_spectra)
+def load_models():
+    """Load Isolation Forest, scaler, CNN and label mapping, then signal readiness."""
+    global scaler, iso_forest, cnn_model, idx_to_label, model_load_error
+    try:
+        report_status("loading_models")
+        print("Loading trained models...")
+        with open("iso_forest_scaler.pkl", "rb") as f:
+            scaler = pickle.load(f)
+        with open("iso_forest_model.pkl", "rb") as f:
+            iso_forest = pickle.load(f)
+        configure_gpu()
+        cnn_model = load_cnn_model()
+        with open("label_to_idx.pkl", "rb") as f:
+            label_to_idx = pickle.load(f)
+        idx_to_label = {v: k for k, v in label_to_idx.items()}
+        models_ready.set()
+        print("Models loaded.")
+        report_status("ready")
+    except Exception as e:
+        model_load_error = e
+        print(f"ERROR: {e}")
+        print("Please run ml_training.py first to generate the trained model.")
+        report_status("error", error=str(e))
+    return models_ready.is_set()
 
-# Scan frequencies from training data (baseline)
-FREQUENCIES = [(d["freq"], d["label"]) for d in training_data]
-FREQUENCIES = list(set(FREQUENCIES))  # Remove duplicates
+def start_model_loading():
+    """Load models in the background so the SDR can be opened meanwhile."""
+    loader = threading.Thread(target=load_models, name="model-loader", daemon=True)
+    loader.start()
+    return loader
 
-print(f"Loaded baseline with {len(training_data)} samples")
-print(f"Models loaded. Scanning {len(FREQUENCIES)} unique frequencies.")
+def wait_for_models():
+    """Block until models are loaded; exit if loading failed."""
+    while not models_ready.wait(timeout=0.5):
+        if model_load_error is not None:
+            raise SystemExit(1)
 
 def extract_features(samples, freq, label):
     """Extract feature vector for anomaly detection."""
     power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
-    peak_power = float(np.max(power))
-    noise_floor = float(np.median(power))
-    mean_power = float(np.mean(power))
-    std_power = float(np.std(power))
-    min_power = float(np.min(power))
-    max_power = float(np.max(power))
+    stats = power_statistics(power)
+    peak_power = stats['peak_power']
+    noise_floor = stats['noise_floor']
+    mean_power = stats['mean_power']
+    std_power = stats['std_power']
+    min_power = stats['min_power']
+    max_power = stats['peak_power']
     snr = peak_power - noise_floor
-    from scipy.stats import kurtosis, skew
-    kurt = float(kurtosis(power))
-    skewness = float(skew(power))
-    bandwidth = float(np.sum(power > noise_floor + 6) * (SAMPLE_RATE / SAMPLES))
-    peaks = np.where(power > noise_floor + 6)[0]
-    num_peaks = int(len(peaks))
+    kurt = stats['kurtosis']
+    skewness = stats['skewness']
+    bandwidth = float(stats['occupied_bins'] * (SAMPLE_RATE / SAMPLES))
+    num_peaks = stats['occupied_bins']
     return {
         "power": power,
         "features": np.array([peak_power, noise_floor, mean_power, std_power, min_power, max_power, snr, kurt, skewness, bandwidth, num_peaks]),
@@ -126,7 +202,17 @@ def is_anomaly(features_vec):
     """Check if signal is anomalous using Isolation Forest."""
     features_scaled = scaler.transform([features_vec])
     prediction = iso_forest.predict(features_scaled)[0]
-    return prediction == -1  # -1 = anomaly
+    return bool(prediction == -1)  # -1 = anomaly
+
+def combine_verdicts(forest_anomaly, online_anomaly, mode=ANOMALY_MODE):
+    """Merge Isolation Forest and online detector verdicts according to mode."""
+    if mode == "forest":
+        return forest_anomaly
+    if mode == "online":
+        return bool(online_anomaly)
+    if online_anomaly is None:  # channel still warming up
+        return forest_anomaly
+    return forest_anomaly and online_anomaly
 
 def classify_signal(power_spectrum):
     """Classify signal using CNN."""
@@ -142,72 +228,96 @@ def classify_signal(power_spectrum):
     return pred_label, confidence
 
 def listen_and_flag():
-    # Get device index from environment variable with fallback
-    device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
-    try:
-        sdr = RtlSdr(device_index=device_index)
-        print(f"Using RTL-SDR device at index {device_index}")
-    except:
-        device_index = 1 if device_index == 0 else 0
-        print(f"Trying alternate device index {device_index}...")
-        sdr = RtlSdr(device_index=device_index)
-    sdr.sample_rate = SAMPLE_RATE
-    sdr.gain = 'auto'
+    # One capture worker per dongle (RTL_SDR_DEVICES), or RTL_SDR_DEVICE with fallback
+    pool = CapturePool(sample_rate=SAMPLE_RATE, num_samples=SAMPLES).start()
+    print(f"Using RTL-SDR device(s) {pool.live_devices()}")
+    report_status("running", devices=pool.live_devices())
+    capture_tasks = single_channel_tasks(FREQUENCIES)
     
     # Use data folder for database
     data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
-    db_path = os.path.join(data_dir, 'detections_ml.db')
-    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
-    conn.execute('PRAGMA journal_mode=WAL')
-    conn.execute('PRAGMA busy_timeout=30000')
+    db_path = os.getenv('ML_DB_PATH', os.path.join(data_dir, 'detections_ml.db'))
+    init_ml_db(db_path)
+    shipper = shipper_from_env(DEVICE_LABEL, os.path.dirname(db_path), name='detections_ml')
+    writer = DetectionWriter(db_path, shipper=shipper)
+    
+    online_detector = OnlineAnomalyDetector()
+    online_detector.load(ONLINE_STATE_FILE)
     
     fft_history = {}
     max_history = 32
     
-    while True:
-        for freq, label in FREQUENCIES:
-            sdr.center_freq = freq
-            samples = sdr.read_samples(SAMPLES)
-            
-            # Extract features
-            result = extract_features(samples, freq, label)
-            power = result["power"]
-            features_vec = result["features"]
-            
-            # Anomaly detection
-            anomaly = is_anomaly(features_vec)
-            
-            if anomaly:
-                # Further classify with CNN
-                pred_label, confidence = classify_signal(power)
+    print(f"Scanning {len(FREQUENCIES)} unique frequencies.")
+    try:
+        while True:
+            for capture in pool.sweep(capture_tasks):
+                freq, label = capture.task.channels[0]
+                samples = capture.samples
                 
-                print(f"[{datetime.datetime.now()}] ANOMALY DETECTED: {label} @ {freq/1e6:.3f} MHz")
-                print(f"  Isolation Forest: Anomaly")
-                print(f"  CNN Classification: {pred_label} (confidence: {confidence:.2%})")
-                print(f"  Peak Power: {result['peak_power']:.1f} dB, SNR: {result['snr']:.1f} dB, Bandwidth: {result['bandwidth']:.1f} Hz")
+                # Extract features
+                result = extract_features(samples, freq, label)
+                power = result["power"]
+                features_vec = result["features"]
                 
-                # Save detection
-                c = conn.cursor()
-                c.execute('''
-                    INSERT INTO detections_ml (
-                        timestamp, freq, label, peak_power, noise_floor, snr, bandwidth, 
-                        kurtosis, skewness, num_peaks, power_spectrum,
-                        device_label, device_lat, device_long, raw_samples,
-                        iso_forest_anomaly, cnn_predicted_label, cnn_confidence
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    datetime.datetime.now().isoformat(), freq, label, 
-                    result['peak_power'], result['noise_floor'], result['snr'], result['bandwidth'],
-                    result['kurtosis'], result['skewness'], result['num_peaks'], power.astype(np.float32).tobytes(),
-                    DEVICE_LABEL, DEVICE_LAT, DEVICE_LONG, samples[:2048].astype(np.complex64).tobytes(),
-                    True, pred_label, confidence
-                ))
-                conn.commit()
-        
-        print(f"Scan complete. Waiting {SCAN_INTERVAL}s...")
-        time.sleep(SCAN_INTERVAL)
+                # Per-channel streaming statistics, updated from every capture
+                online_anomaly, online_score = online_detector.observe((freq, label), features_vec)
+                
+                # Anomaly detection
+                forest_anomaly = None
+                if ANOMALY_MODE != "online":
+                    # Models load in the background; only the first sweep waits here
+                    wait_for_models()
+                    forest_anomaly = is_anomaly(features_vec)
+                anomaly = combine_verdicts(forest_anomaly, online_anomaly)
+                
+                if anomaly:
+                    # Further classify with CNN
+                    wait_for_models()
+                    pred_label, confidence = classify_signal(power)
+                    
+                    print(f"[{datetime.datetime.now()}] ANOMALY DETECTED: {label} @ {freq/1e6:.3f} MHz")
+                    print(f"  Isolation Forest: {'Anomaly' if forest_anomaly else 'n/a' if forest_anomaly is None else 'Normal'}")
+                    if online_score is not None:
+                        print(f"  Online score: {online_score:.1f} (threshold {online_detector.threshold:.1f})")
+                    print(f"  CNN Classification: {pred_label} (confidence: {confidence:.2%})")
+                    print(f"  Peak Power: {result['peak_power']:.1f} dB, SNR: {result['snr']:.1f} dB, Bandwidth: {result['bandwidth']:.1f} Hz")
+                    
+                    # Save detection
+                    writer.submit('detections_ml', {
+                        'timestamp': datetime.datetime.now().isoformat(), 'freq': freq, 'label': label,
+                        'peak_power': result['peak_power'], 'noise_floor': result['noise_floor'],
+                        'snr': result['snr'], 'bandwidth': result['bandwidth'],
+                        'kurtosis': result['kurtosis'], 'skewness': result['skewness'], 'num_peaks': result['num_peaks'],
+                        'power_spectrum': power.astype(np.float32).tobytes(),
+                        'device_label': DEVICE_LABEL, 'device_lat': DEVICE_LAT, 'device_long': DEVICE_LONG,
+                        'raw_samples': samples[:2048].astype(np.complex64).tobytes(),
+                        'iso_forest_anomaly': forest_anomaly, 'cnn_predicted_label': pred_label, 'cnn_confidence': float(confidence)
+                    })
+            
+            online_detector.save(ONLINE_STATE_FILE)
+            print(f"Scan complete. Waiting {SCAN_INTERVAL}s...")
+            time.sleep(SCAN_INTERVAL)
+    finally:
+        pool.close()
+        writer.close()
+        if shipper is not None:
+            shipper.close()
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="ML-based RTL-SDR listener")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="Manifest written by ml_training.py")
+    parser.add_argument("--check", action="store_true", help="Load manifest and models, report readiness and exit")
+    args = parser.parse_args()
+    
+    report_status("starting")
+    load_manifest(args.manifest)
+    if args.check:
+        raise SystemExit(0 if load_models() else 1)
+    
+    start_model_loading()
     listen_and_flag()
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress TF warnings
 
 import json
+import datetime
 import numpy as np
 import pickle
 from sklearn.preprocessing import StandardScaler
@@ -136,6 +137,19 @@ with open("label_to_idx.pkl", "wb") as f:
     pickle.dump(label_to_idx, f)
 print("✓ Label mappings saved as label_to_idx.pkl")
 
+# Manifest lets ml_listen.py start without re-reading training_data.json
+manifest = {
+    "created": datetime.datetime.now().isoformat(),
+    "training_samples": len(training_data),
+    "frequencies": sorted({(d["freq"], d["label"]) for d in training_data}),
+    "max_spectrum_len": int(max_len),
+    "features": features_list,
+    "label_to_idx": label_to_idx
+}
+with open("ml_manifest.json", "w") as f:
+    json.dump(manifest, f, indent=2)
+print("✓ Frequency plan and input shape saved as ml_manifest.json")
+
 # Now clear session after saving
 clear_session()
 
@@ -161,4 +175,4 @@ plt.savefig('training_history.png')
 print("Training history saved to training_history.png")
 
 print("\n--- Training Complete ---")
-print(f"Models saved: iso_forest_model.pkl, iso_forest_scaler.pkl, cnn_classifier.h5, label_to_idx.pkl")
+print(f"Models saved: iso_forest_model.pkl, iso_forest_scaler.pkl, cnn_classifier.h5, label_to_idx.pkl, ml_manifest.json")
@@ -0,0 +1,94 @@
+"""
+Online per-channel anomaly detection from streaming robust statistics.
+Each channel keeps a bounded window of recent normal feature vectors; a new
+vector is scored by its largest robust z-score (median/MAD) over that window.
+The window follows slow drift such as diurnal noise-floor changes without
+retraining, and memory per channel is fixed by the window size.
+"""
+
+import json
+import os
+from collections import deque
+import numpy as np
+
+WINDOW = 256         # feature vectors kept per channel
+WARMUP = 20          # vectors needed before a channel is scored
+THRESHOLD = 6.0      # robust z-score that marks an anomaly
+ADAPT_EVERY = 10     # accept every Nth consecutive anomaly so lasting changes are learned
+MAD_SCALE = 1.4826   # MAD -> standard deviation for Gaussian data
+
+class ChannelStats:
+    """Sliding-window median/MAD of one channel's feature vectors."""
+
+    def __init__(self, window=WINDOW):
+        self.window = deque(maxlen=window)
+        self.consecutive_anomalies = 0
+
+    def score(self, vec):
+        """Largest robust z-score of vec, or None while warming up."""
+        if len(self.window) < WARMUP:
+            return None
+        history = np.asarray(self.window)
+        median = np.median(history, axis=0)
+        mad = np.median(np.abs(history - median), axis=0) * MAD_SCALE
+        # Floor the scale so constant features don't turn tiny changes into huge scores
+        scale = np.maximum(mad, 1e-3 * np.abs(median) + 1e-6)
+        return float(np.max(np.abs(vec - median) / scale))
+
+    def update(self, vec, anomalous):
+        if anomalous:
+            self.consecutive_anomalies += 1
+            if self.consecutive_anomalies % ADAPT_EVERY != 0:
+                return
+        else:
+            self.consecutive_anomalies = 0
+        self.window.append(np.asarray(vec, dtype=float))
+
+class OnlineAnomalyDetector:
+    """Robust streaming statistics per (freq, label) channel."""
+
+    def __init__(self, window=WINDOW, threshold=THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self.channels = {}
+
+    def _stats(self, key):
+        if key not in self.channels:
+            self.channels[key] = ChannelStats(self.window)
+        return self.channels[key]
+
+    def observe(self, key, vec):
+        """
+        Score vec against the channel's history, then learn from it.
+        Returns (anomalous, score); anomalous is None while the channel warms up.
+        """
+        stats = self._stats(key)
+        score = stats.score(vec)
+        anomalous = None if score is None else score > self.threshold
+        stats.update(vec, bool(anomalous))
+        return anomalous, score
+
+    def save(self, path):
+        state = {
+            f"{freq}|{label}": [v.tolist() for v in stats.window]
+            for (freq, label), stats in self.channels.items()
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (ValueError, OSError) as e:
+            print(f"Warning: Could not load online anomaly state ({e}), starting fresh")
+            return
+        for key, vectors in state.items():
+            freq, label = key.split("|", 1)
+            stats = self._stats((float(freq), label))
+            for vec in vectors:
+                stats.window.append(np.asarray(vec, dtype=float))
@@ -0,0 +1,160 @@
+"""
+Fast first tier for the listener sweep.
+Every capture task is first visited with a short capture whose averaged
+1024-point spectrum gives each channel's band energy and strongest bin. Those
+are compared with the channel's running baseline (exponentially weighted mean
+and deviation); only channels that move, are still warming up, or are due for
+their periodic drift check get the full 256k capture, feature pipeline and
+database write. A short capture with time-domain bursts (burst_detector) also
+trips a channel that is rarely bursty, so a brief TDMA or push-to-talk
+transmission caught in one dwell reaches the full pipeline.
+
+    PRESCREEN=0 python listen.py                 # full pipeline on every visit
+    PRESCREEN_DB=2 PRESCREEN_FULL_EVERY=5 python listen.py
+"""
+
+import os
+import time
+import numpy as np
+from channel_plan import channel_view
+from burst_detector import CaptureBursts, BURST_RATE_TRIP
+
+PRESCREEN_ENABLED = os.getenv('PRESCREEN', '1') == '1'
+PRESCREEN_SAMPLES = int(os.getenv('PRESCREEN_SAMPLES', str(16 * 1024)))
+PRESCREEN_FFT = 1024
+# Minimum change (dB) in band energy or strongest bin that sends a channel to the full pipeline
+PRESCREEN_DB = float(os.getenv('PRESCREEN_DB', '3.0'))
+# Full pipeline every Nth visit regardless, so slow drift is still recorded
+FULL_EVERY = int(os.getenv('PRESCREEN_FULL_EVERY', '10'))
+WARMUP_VISITS = 3
+ALPHA = 0.1           # weight of a new quiet visit in the running baseline
+SIGMA_THRESHOLD = 4.0  # noisy channels need this many deviations as well
+
+def short_spectrum(samples, nfft=PRESCREEN_FFT):
+    """fftshifted power (dB) averaged over consecutive nfft-sample segments."""
+    segments = len(samples) // nfft
+    if segments == 0:
+        nfft, segments = len(samples), 1
+    frames = np.asarray(samples[:segments * nfft]).reshape(segments, nfft)
+    spectrum = np.abs(np.fft.fft(frames, axis=1)) ** 2
+    power = np.fft.fftshift(spectrum.mean(axis=0))
+    return 10 * np.log10(np.maximum(power, 1e-20))
+
+def band_levels(power):
+    """(band energy, strongest bin) of one channel's spectrum, in dB."""
+    linear = 10 ** (power / 10)
+    return float(10 * np.log10(max(float(linear.mean()), 1e-20))), float(power.max())
+
+class ChannelBaseline:
+    """Running mean and mean absolute deviation of one channel's pre-screen levels."""
+
+    def __init__(self):
+        self.mean = None
+        self.deviation = np.zeros(2)
+        self.visits = 0
+        self.quiet_visits = 0
+        self.burst_rate = 0.0  # running share of visits with bursts
+
+    def change(self, levels):
+        """Largest level change in dB, relative to the allowed change (>1 trips)."""
+        if self.mean is None:
+            return float('inf')
+        delta = np.abs(levels - self.mean)
+        allowed = np.maximum(PRESCREEN_DB, SIGMA_THRESHOLD * self.deviation)
+        return float(np.max(delta / allowed))
+
+    def update(self, levels):
+        if self.mean is None:
+            self.mean = levels.copy()
+            return
+        delta = np.abs(levels - self.mean)
+        self.mean += ALPHA * (levels - self.mean)
+        self.deviation += ALPHA * (delta - self.deviation)
+
+class ChannelPrescreen:
+    """
+    Per-channel pre-screen state for one listener. sweep() runs the short
+    captures and returns the capture tasks that need the full pipeline and
+    which of their channels tripped.
+    """
+
+    def __init__(self, sample_rate, num_samples=PRESCREEN_SAMPLES, full_every=FULL_EVERY):
+        self.sample_rate = sample_rate
+        self.num_samples = num_samples
+        self.full_every = full_every
+        self.channels = {}
+        self.tripped = 0
+        self.drift_checks = 0
+        self.skipped = 0
+        self.burst_trips = 0
+        # Short-capture burst features of this sweep's selected channels that had bursts
+        self.bursts = {}
+
+    def screen(self, key, levels, bursty=False):
+        """
+        Decide one channel visit: 'warmup', 'tripped', 'burst', 'drift' or None
+        (skip the full pipeline). Quiet visits are folded into the channel's
+        baseline.
+        """
+        state = self.channels.setdefault(key, ChannelBaseline())
+        state.visits += 1
+        levels = np.asarray(levels, dtype=float)
+        rate = state.burst_rate
+        state.burst_rate += ALPHA * (float(bursty) - state.burst_rate)
+        if state.visits <= WARMUP_VISITS:
+            state.update(levels)
+            return 'warmup'
+        if state.change(levels) > 1:
+            # Keep the baseline on the quiet state, so a lasting change keeps tripping
+            self.tripped += 1
+            return 'tripped'
+        if bursty and rate < BURST_RATE_TRIP:
+            self.burst_trips += 1
+            return 'burst'
+        state.update(levels)
+        state.quiet_visits += 1
+        if self.full_every and state.quiet_visits % self.full_every == 0:
+            self.drift_checks += 1
+            return 'drift'
+        self.skipped += 1
+        return None
+
+    def sweep(self, pool, tasks, metrics=None, revisit_target=None, recorder=None):
+        """
+        Short-capture every task. Returns (full_tasks, selected), where selected
+        maps each (freq, label) needing the full pipeline to its reason. Short
+        captures also go into the recorder's IQ rings, if one is given.
+        """
+        # Tasks hold channel lists (unhashable), so map short tasks back by identity
+        short_tasks = [task._replace(num_samples=self.num_samples) for task in tasks]
+        originals = {id(short): task for short, task in zip(short_tasks, tasks)}
+        selected = {}
+        full_tasks = []
+        for capture in pool.sweep(short_tasks):
+            start = time.perf_counter()
+            if recorder is not None:
+                recorder.record(capture)
+            power = short_spectrum(capture.samples)
+            bursts = CaptureBursts(capture.samples, self.sample_rate, capture.task.center_freq)
+            chosen = False
+            for freq, label in capture.task.channels:
+                if metrics is not None:
+                    revisit = metrics.visit(f"{freq/1e6:.4f}MHz", start)
+                    if revisit is not None and revisit_target is not None and revisit > revisit_target:
+                        metrics.inc("late_visits")
+                view, _ = channel_view(power, capture.samples, capture.task, freq, label, self.sample_rate, raw_len=0)
+                features = bursts.features(freq, label)
+                reason = self.screen((freq, label), band_levels(view), features['burst_count'] > 0) if len(view) else 'tripped'
+                if reason is not None and features['burst_count']:
+                    self.bursts[(freq, label)] = features
+                else:
+                    self.bursts.pop((freq, label), None)
+                if reason is not None:
+                    selected[(freq, label)] = reason
+                    chosen = True
+            if chosen:
+                full_tasks.append(originals[id(capture.task)])
+            if metrics is not None:
+                metrics.observe("prescreen_capture", capture.duration)
+                metrics.observe("prescreen", time.perf_counter() - start)
+        return full_tasks, selected
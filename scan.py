@@ -1,8 +1,10 @@
+import os
 import numpy as np
-from rtlsdr import RtlSdr
 import time
 import datetime
-import os
+from sdr_capture import CaptureSession
+from signal_features import frequency_axis
+from cfar import detect, runs
 
 # Frequency bands in Hz
 BANDS = {
@@ -13,47 +15,42 @@ BANDS = {
 
 SAMPLE_RATE = 2.048e6  # Hz
 SAMPLES = 256*1024
-THRESHOLD = 10  # dB above noise floor
+# Per-bin false alarm probability over the local CFAR noise level (~0.3 noise bins per capture)
+SCAN_PFA = float(os.getenv('SCAN_PFA', '1e-6'))
 SCAN_INTERVAL = 10  # seconds between scans
 
 # Store seen signals
 seen_signals = set()
 
-def scan_band(sdr, band_name, freq_start, freq_end, step=2e6):
+def scan_band(session, band_name, freq_start, freq_end, step=2e6):
     detected = []
     freq = freq_start
     while freq < freq_end:
-        sdr.center_freq = freq
-        samples = sdr.read_samples(SAMPLES)
+        # complex64 straight from the raw uint8 stream, stale post-retune data dropped
+        samples = session.capture(freq, SAMPLES)
         power = 10 * np.log10(np.abs(np.fft.fftshift(np.fft.fft(samples)))**2)
-        freqs = np.fft.fftshift(np.fft.fftfreq(len(samples), 1/SAMPLE_RATE)) + freq
-        noise_floor = np.median(power)
-        peaks = np.where(power > noise_floor + THRESHOLD)[0]
-        for p in peaks:
-            detected_freq = freqs[p]
+        # Shared baseband axis; only the detected bins are offset to the tuned frequency
+        freqs = frequency_axis(len(samples), SAMPLE_RATE)
+        _, mask = detect(power, SCAN_PFA)
+        # One detection per run of adjacent bins, at its strongest bin
+        for start, end in zip(*runs(mask)):
+            p = start + int(np.argmax(power[start:end]))
+            detected_freq = freqs[p] + freq
             detected.append(round(detected_freq/1e3)*1e3)  # Round to kHz
         freq += step
     return set(detected)
 
 def main():
     global seen_signals
-    # Get device index from environment variable with fallback
-    device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
-    try:
-        sdr = RtlSdr(device_index=device_index)
-        print(f"Using RTL-SDR device at index {device_index}")
-    except:
-        device_index = 1 if device_index == 0 else 0
-        print(f"Trying alternate device index {device_index}...")
-        sdr = RtlSdr(device_index=device_index)
-    sdr.sample_rate = SAMPLE_RATE
-    sdr.gain = 'auto'
+    # RTL_SDR_DEVICE from the environment, falling back to the alternate index
+    session = CaptureSession(sample_rate=SAMPLE_RATE).open()
+    print(f"Using RTL-SDR device at index {session.device_index}")
     print('Starting scan...')
     while True:
         new_signals = set()
         for band, (f_start, f_end) in BANDS.items():
             print(f'Scanning {band}...')
-            detected = scan_band(sdr, band, f_start, f_end)
+            detected = scan_band(session, band, f_start, f_end)
             for freq in detected:
                 if freq not in seen_signals:
                     print(f'[{datetime.datetime.now()}] New signal detected: {band} {freq/1e6:.3f} MHz')
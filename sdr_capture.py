@@ -0,0 +1,487 @@
+"""
+Shared RTL-SDR capture helpers.
+Keeps one device open across retunes instead of reopening it for every sample,
+and lets long collection runs save incrementally and resume after interruption.
+Captures read the dongle's raw interleaved uint8 I/Q into a reusable buffer and
+convert it to complex64 in preallocated buffers, instead of pyrtlsdr's
+read_samples() which allocates a new complex128 array per capture.
+"""
+
+import os
+import json
+import time
+import queue
+import ctypes
+import datetime
+import threading
+from collections import Counter, namedtuple
+import numpy as np
+
+SAMPLE_RATE = 2.048e6
+SETTLE_TIME = float(os.getenv('SDR_SETTLE_TIME', '0.05'))  # seconds to wait after retune
+DISCARD_SAMPLES = 16*1024  # first transfer after retune/open still holds old-frequency data
+# Subtract each capture's mean (the RTL2832 DC/LO-leakage spike at the centre bin). Off by
+# default: the shipped baseline.json and iso_forest_model.pkl were built with the spike in
+# the centre bin's peak_power/snr, so turning it on needs a new baseline and a retrained model
+REMOVE_DC = os.getenv('SDR_REMOVE_DC', '0') == '1'
+# 0 falls back to pyrtlsdr's read_samples() (complex128), e.g. to compare
+RAW_CAPTURE = os.getenv('SDR_RAW_CAPTURE', '1') == '1'
+IQ_SCALE = np.float32(1 / 127.5)
+
+class IQConverter:
+    """
+    Interleaved uint8 I/Q -> complex64, written into a ring of preallocated
+    buffers. The uint8 -> float32 cast runs vectorised (measured ~10x faster
+    than a 256-entry lookup-table gather with np.take), then the 127.5 offset
+    and the DC estimate are removed in one complex subtract and the result is
+    scaled to [-1, 1]. Each returned array stays valid until the ring wraps,
+    so ring_size must cover every capture still queued or being processed.
+    """
+
+    def __init__(self, num_samples, ring_size=2, remove_dc=REMOVE_DC):
+        self.num_samples = num_samples
+        self.remove_dc = remove_dc
+        self._buffers = [np.empty(2 * num_samples, dtype=np.float32) for _ in range(max(1, ring_size))]
+        self._next = 0
+
+    def convert(self, raw):
+        """raw: uint8 array of 2 * num_samples bytes. Returns a complex64 view of the next ring buffer."""
+        buf = self._buffers[self._next]
+        self._next = (self._next + 1) % len(self._buffers)
+        np.copyto(buf, raw, casting='unsafe')
+        iq = buf.view(np.complex64)
+        offset = iq.mean() if self.remove_dc else np.complex64(127.5 + 127.5j)
+        np.subtract(iq, offset, out=iq)
+        np.multiply(buf, IQ_SCALE, out=buf)
+        return iq
+
+def _read_sync_function():
+    """librtlsdr's rtlsdr_read_sync through pyrtlsdr's bindings, or None if unavailable."""
+    try:
+        from rtlsdr.librtlsdr import librtlsdr
+        return librtlsdr.rtlsdr_read_sync
+    except (ImportError, AttributeError):
+        return None
+
+def open_sdr(device_index=None, sample_rate=SAMPLE_RATE, gain='auto', fallback=True):
+    """Open an RTL-SDR, falling back to the alternate index (0 <-> 1) if needed."""
+    from rtlsdr import RtlSdr
+    if device_index is None:
+        device_index = int(os.getenv('RTL_SDR_DEVICE', '0'))
+    try:
+        sdr = RtlSdr(device_index=device_index)
+    except Exception:
+        if not fallback:
+            raise
+        device_index = 1 if device_index == 0 else 0
+        print(f"Trying alternate device index {device_index}...")
+        sdr = RtlSdr(device_index=device_index)
+    sdr.sample_rate = sample_rate
+    sdr.gain = gain
+    return sdr, device_index
+
+class CaptureSession:
+    """One open RTL-SDR that is retuned between captures."""
+
+    def __init__(self, device_index=None, sample_rate=SAMPLE_RATE, gain='auto',
+                 settle_time=SETTLE_TIME, discard_samples=DISCARD_SAMPLES, fallback=True,
+                 ring_size=2, remove_dc=REMOVE_DC, raw_capture=RAW_CAPTURE):
+        self.device_index = device_index
+        self.fallback = fallback
+        self.sample_rate = sample_rate
+        self.gain = gain
+        self.settle_time = settle_time
+        self.discard_samples = discard_samples
+        self.ring_size = ring_size
+        self.remove_dc = remove_dc
+        self.raw_capture = raw_capture
+        self.sdr = None
+        self.center_freq = None
+        self.last_tune_time = 0.0
+        self.last_read_time = 0.0
+        self._raw = None
+        self._converters = {}
+        self._read_sync = None
+
+    def open(self):
+        self.sdr, self.device_index = open_sdr(self.device_index, self.sample_rate, self.gain, self.fallback)
+        self.center_freq = None
+        # Read straight into our own buffer when the C binding is reachable
+        self._read_sync = _read_sync_function() if self.raw_capture and hasattr(self.sdr, 'dev_p') else None
+        return self
+
+    def close(self):
+        if self.sdr is not None:
+            self.sdr.close()
+            self.sdr = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def tune(self, freq):
+        """Retune if needed, wait for the PLL/AGC to settle and drop the stale transfer."""
+        if freq == self.center_freq:
+            return
+        self.sdr.center_freq = freq
+        self.center_freq = freq
+        if self.settle_time > 0:
+            time.sleep(self.settle_time)
+        if self.discard_samples > 0:
+            if self._raw_mode():
+                self.read_raw(2 * self.discard_samples)
+            else:
+                self.sdr.read_samples(self.discard_samples)
+
+    def _raw_mode(self):
+        return self.raw_capture and (self._read_sync is not None or hasattr(self.sdr, 'read_bytes'))
+
+    def read_raw(self, num_bytes):
+        """num_bytes of interleaved uint8 I/Q, in the session's reusable raw buffer."""
+        if self._raw is None or len(self._raw) < num_bytes:
+            self._raw = np.empty(num_bytes, dtype=np.uint8)
+        raw = self._raw[:num_bytes]
+        if self._read_sync is not None:
+            n_read = ctypes.c_int(0)
+            result = self._read_sync(self.sdr.dev_p, raw.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+                                     num_bytes, ctypes.byref(n_read))
+            if result < 0:
+                raise IOError(f"rtlsdr_read_sync failed ({result})")
+            if n_read.value < num_bytes:
+                raise IOError(f"Short read from RTL-SDR ({n_read.value} of {num_bytes} bytes)")
+        else:
+            raw[:] = np.frombuffer(self.sdr.read_bytes(num_bytes), dtype=np.uint8, count=num_bytes)
+        return raw
+
+    def read(self, num_samples):
+        """num_samples complex64 samples (valid until ring_size further reads)."""
+        if not self._raw_mode():
+            samples = np.asarray(self.sdr.read_samples(num_samples), dtype=np.complex64)
+            return samples - samples.mean() if self.remove_dc else samples
+        # One ring per capture length, so alternating short and full captures reuse buffers
+        converter = self._converters.get(num_samples)
+        if converter is None:
+            converter = self._converters[num_samples] = IQConverter(num_samples, self.ring_size, self.remove_dc)
+        return converter.convert(self.read_raw(2 * num_samples))
+
+    def capture(self, freq, num_samples):
+        """Tune to freq and read num_samples complex64 samples."""
+        start = time.perf_counter()
+        self.tune(freq)
+        tuned = time.perf_counter()
+        samples = self.read(num_samples)
+        self.last_tune_time = tuned - start
+        self.last_read_time = time.perf_counter() - tuned
+        return samples
+
+class CollectionLog:
+    """
+    Incremental store for collection runs.
+    Records are appended to a JSON Lines progress file as they are measured, so an
+    interrupted run loses nothing; finalize() writes the usual JSON list.
+    """
+
+    def __init__(self, output_file, fresh=False):
+        self.output_file = output_file
+        self.progress_file = output_file + ".partial"
+        self.records = []
+        if fresh:
+            if os.path.exists(self.progress_file):
+                os.remove(self.progress_file)
+            return
+        if os.path.exists(output_file):
+            try:
+                with open(output_file) as f:
+                    self.records = json.load(f)
+            except (ValueError, OSError):
+                print(f"Could not read {output_file}, starting fresh")
+        if os.path.exists(self.progress_file):
+            progress = []
+            with open(self.progress_file) as f:
+                text = f.read()
+            for line in text.splitlines():
+                if line.strip():
+                    try:
+                        progress.append(json.loads(line))
+                    except ValueError:
+                        break  # torn last line from a hard stop
+            self.records.extend(progress)
+            clean = "".join(json.dumps(r) + "\n" for r in progress)
+            if text != clean:
+                # Drop the torn fragment so the next append() starts on its own line
+                tmp_path = self.progress_file + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(clean)
+                os.replace(tmp_path, self.progress_file)
+
+    def completed(self):
+        """Number of records already collected per (freq, label)."""
+        return Counter((r["freq"], r["label"]) for r in self.records)
+
+    def append(self, record):
+        self.records.append(record)
+        with open(self.progress_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def finalize(self, indent=2):
+        """Write all records to the output file and drop the progress file."""
+        tmp_path = self.output_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.records, f, indent=indent)
+        os.replace(tmp_path, self.output_file)
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        return len(self.records)
+
+def pending_plan(plan, repetitions, completed):
+    """Yield (freq, label, repetition) still missing from a collection run."""
+    for freq, label in plan:
+        for rep in range(completed.get((freq, label), 0), repetitions):
+            yield freq, label, rep
+
+# num_samples=None captures the pool's default length (short pre-screen captures set it)
+CaptureTask = namedtuple('CaptureTask', ['center_freq', 'channels', 'num_samples'], defaults=[None])
+Capture = namedtuple('Capture', ['task', 'samples', 'device_index', 'timestamp', 'duration', 'tune_time', 'read_time'])
+CaptureFailure = namedtuple('CaptureFailure', ['device_index', 'tasks', 'error'])
+
+REOPEN_INTERVAL = 30.0  # seconds before a dropped dongle is retried
+_REOPEN = object()
+_STOP = object()
+
+def available_devices():
+    """
+    Device indices to capture with.
+    RTL_SDR_DEVICES selects several dongles ("0,1,2" or "all"); otherwise only
+    RTL_SDR_DEVICE is used, so separate listeners can still own one dongle each.
+    """
+    selection = os.getenv('RTL_SDR_DEVICES', '').strip().lower()
+    if not selection:
+        return [int(os.getenv('RTL_SDR_DEVICE', '0'))]
+    if selection != 'all':
+        return [int(idx) for idx in selection.split(',') if idx.strip()]
+    try:
+        from rtlsdr import RtlSdr
+        count = len(RtlSdr.get_device_serial_addresses())
+    except Exception:
+        count = 0
+    return list(range(count)) if count else [int(os.getenv('RTL_SDR_DEVICE', '0'))]
+
+def single_channel_tasks(frequencies):
+    """One capture task per (freq, label), tuned to the channel itself."""
+    return [CaptureTask(freq, [(freq, label)]) for freq, label in frequencies]
+
+def shard_plan(tasks, devices, cost):
+    """
+    Split tasks across devices so each device's total dwell cost is about equal
+    (longest task first onto the least loaded device). Shards are returned in
+    frequency order to keep retune steps short.
+    """
+    shards = {dev: [] for dev in devices}
+    loads = {dev: 0.0 for dev in devices}
+    for task in sorted(tasks, key=cost, reverse=True):
+        dev = min(devices, key=lambda d: loads[d])
+        shards[dev].append(task)
+        loads[dev] += cost(task)
+    for dev in shards:
+        shards[dev].sort(key=lambda t: t.center_freq)
+    return shards
+
+class _CaptureWorker(threading.Thread):
+    """Owns one dongle; captures tasks from its inbox into the shared result queue."""
+
+    def __init__(self, pool, device_index):
+        super().__init__(name=f"capture-{device_index}", daemon=True)
+        self.pool = pool
+        self.device_index = device_index
+        self.inbox = queue.Queue()
+        self.session = None
+        self.alive = False
+        self.failed_at = None
+
+    def _open(self):
+        try:
+            # Ring covers a full result queue, the capture being processed and the one being filled
+            self.session = CaptureSession(self.device_index, self.pool.sample_rate,
+                                          settle_time=self.pool.settle_time,
+                                          discard_samples=self.pool.discard_samples,
+                                          fallback=len(self.pool.device_indices) == 1,
+                                          ring_size=self.pool.results.maxsize + 2)
+            self.session.open()
+            self.alive = True
+            print(f"✓ Capture worker using RTL-SDR device at index {self.session.device_index}")
+        except Exception as e:
+            self.session = None
+            self.alive = False
+            self.failed_at = time.time()
+            print(f"⚠ Could not open RTL-SDR device {self.device_index}: {e}")
+
+    def _fail(self, tasks, error):
+        self.alive = False
+        self.failed_at = time.time()
+        if self.session is not None:
+            try:
+                self.session.close()
+            except Exception:
+                pass
+            self.session = None
+        # Return everything still queued here in one go
+        stop = False
+        while True:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+            elif item is not _REOPEN:
+                tasks.append(item)
+        if stop:
+            self.inbox.put(_STOP)
+        self.pool.results.put(CaptureFailure(self.device_index, tasks, error))
+
+    def run(self):
+        self._open()
+        self.pool._opened.release()
+        while True:
+            task = self.inbox.get()
+            if task is _STOP:
+                break
+            if task is _REOPEN:
+                if not self.alive:
+                    self._open()
+                continue
+            if not self.alive:
+                # Hand back anything routed here before the pool noticed the drop
+                self._fail([task], None)
+                continue
+            start = time.perf_counter()
+            try:
+                samples = self.session.capture(task.center_freq, task.num_samples or self.pool.num_samples)
+            except Exception as e:
+                print(f"⚠ RTL-SDR device {self.device_index} dropped out: {e}")
+                self._fail([task], e)
+                continue
+            duration = time.perf_counter() - start
+            self.pool.record_cost(task, duration)
+            self.pool.results.put(Capture(task, samples, self.device_index, datetime.datetime.now(), duration,
+                                          self.session.last_tune_time, self.session.last_read_time))
+        if self.session is not None:
+            self.session.close()
+
+class CapturePool:
+    """
+    One capture worker per dongle, sharing a single result queue.
+    Each sweep's tasks are sharded across live devices by dwell cost; the caller
+    consumes captures in one thread, so DSP and database writes stay single-pipeline.
+    Tasks from a dongle that drops out mid-sweep are redistributed to the others.
+    If every dongle has dropped out, the sweep waits for one to reopen.
+    """
+
+    def __init__(self, device_indices=None, sample_rate=SAMPLE_RATE, num_samples=256*1024,
+                 settle_time=SETTLE_TIME, discard_samples=DISCARD_SAMPLES, queue_size=4):
+        self.device_indices = list(device_indices) if device_indices is not None else available_devices()
+        self.sample_rate = sample_rate
+        self.num_samples = num_samples
+        self.settle_time = settle_time
+        self.discard_samples = discard_samples
+        self.results = queue.Queue(maxsize=queue_size)
+        self.dwell_costs = {}
+        self.dropped_captures = 0
+        self._cost_lock = threading.Lock()
+        self._opened = threading.Semaphore(0)
+        self.workers = {}
+
+    def start(self):
+        for idx in self.device_indices:
+            worker = _CaptureWorker(self, idx)
+            self.workers[idx] = worker
+            worker.start()
+        for _ in self.workers:
+            self._opened.acquire()
+        if not self.live_devices():
+            self.close()
+            raise RuntimeError("Could not open any RTL-SDR device")
+        return self
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.inbox.put(_STOP)
+        for worker in self.workers.values():
+            worker.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def live_devices(self):
+        return [idx for idx, w in self.workers.items() if w.alive]
+
+    def estimated_cost(self, task):
+        """Measured dwell time for this tuning and length, or the nominal capture time."""
+        with self._cost_lock:
+            measured = self.dwell_costs.get((task.center_freq, task.num_samples))
+        if measured is not None:
+            return measured
+        return self.settle_time + (self.discard_samples + (task.num_samples or self.num_samples)) / self.sample_rate
+
+    def record_cost(self, task, duration):
+        key = (task.center_freq, task.num_samples)
+        with self._cost_lock:
+            previous = self.dwell_costs.get(key)
+            self.dwell_costs[key] = duration if previous is None else 0.8 * previous + 0.2 * duration
+
+    def _reopen_due(self):
+        """Ask dropped workers whose REOPEN_INTERVAL has passed to reopen their dongle."""
+        now = time.time()
+        for worker in self.workers.values():
+            if not worker.alive and worker.failed_at is not None and now - worker.failed_at >= REOPEN_INTERVAL:
+                worker.failed_at = now
+                worker.inbox.put(_REOPEN)
+
+    def _wait_for_device(self):
+        """Live devices, blocking until a dropped dongle reopens (retried every REOPEN_INTERVAL) if there are none."""
+        announced = False
+        while True:
+            live = self.live_devices()
+            if live:
+                return live
+            if not any(w.is_alive() for w in self.workers.values()):
+                raise RuntimeError("All capture workers have stopped")
+            retry_at = min(w.failed_at for w in self.workers.values() if w.failed_at is not None) + REOPEN_INTERVAL
+            if not announced:
+                print(f"⏳ All RTL-SDR devices have dropped out; retrying in {max(0.0, retry_at - time.time()):.0f}s")
+                announced = True
+            time.sleep(min(0.25, max(0.0, retry_at - time.time())))
+            self._reopen_due()
+
+    def _dispatch(self, tasks):
+        live = self._wait_for_device()
+        for idx, shard in shard_plan(tasks, live, self.estimated_cost).items():
+            for task in shard:
+                self.workers[idx].inbox.put(task)
+
+    def sweep(self, tasks):
+        """Capture every task once across all live devices, yielding Capture results as they arrive."""
+        self._reopen_due()
+        self._dispatch(tasks)
+        outstanding = len(tasks)
+        while outstanding:
+            try:
+                item = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(w.is_alive() for w in self.workers.values()):
+                    raise RuntimeError("All capture workers have stopped")
+                continue
+            if isinstance(item, CaptureFailure):
+                if item.error is not None:
+                    self.dropped_captures += 1
+                print(f"↻ Rebalancing {len(item.tasks)} task(s) from device {item.device_index} "
+                      f"across {len(self.live_devices())} remaining device(s)")
+                self._dispatch(item.tasks)
+                continue
+            outstanding -= 1
+            yield item
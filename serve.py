@@ -0,0 +1,32 @@
+"""
+Production server for the dashboard API.
+Runs api.py under waitress (pure Python, works on Windows and in Docker) with a
+fixed pool of worker threads; each thread keeps its own pooled read-only
+SQLite connection. Falls back to the Flask development server if waitress
+is not installed.
+
+    python serve.py                      # API_HOST / API_PORT / API_THREADS from the environment
+"""
+
+import os
+from api import app
+
+HOST = os.getenv('API_HOST', '0.0.0.0')
+PORT = int(os.getenv('API_PORT', '5000'))
+THREADS = int(os.getenv('API_THREADS', '8'))
+# Pending connections accepted before clients are refused
+BACKLOG = int(os.getenv('API_BACKLOG', '1024'))
+
+def main():
+    try:
+        from waitress import serve
+    except ImportError:
+        print("⚠️  waitress not installed (pip install waitress), using the Flask development server")
+        app.run(host=HOST, port=PORT, threaded=True)
+        return
+    print(f"🌐 RTL-SDR API on http://{HOST}:{PORT} | waitress | {THREADS} threads")
+    serve(app, host=HOST, port=PORT, threads=THREADS, backlog=BACKLOG,
+          channel_timeout=120, ident="rtl-sdr-api")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Fused per-capture spectrum statistics.
+power_statistics() gets peak, min, median, mean, std, skewness, kurtosis and
+the occupied-bin count of a 262k-bin spectrum from one deviation array
+(moments as dot products), an O(n) np.partition median and a single mask,
+instead of a separate pass per statistic and a full sort for the median. The
+noise floor it returns is passed on so the advanced features and quality
+metrics do not recompute the median.
+"""
+
+import math
+import functools
+import numpy as np
+
+# Bins this far above the noise floor count towards bandwidth / num_peaks
+OCCUPIED_DB = 6.0
+# 10**(x/10) == exp(x * ln(10)/10)
+DB_TO_NATURAL = math.log(10) / 10
+
+def median(values):
+    """np.median via np.partition (no full sort); `values` is left untouched."""
+    values = np.asarray(values)
+    n = values.size
+    if n == 0:
+        return float('nan')
+    k = n // 2
+    if n % 2:
+        return float(np.partition(values, k)[k])
+    # One partition: everything left of k is <= part[k], so its max is the lower middle
+    part = np.partition(values, k)
+    return float((part[:k].max() + part[k]) / 2)
+
+@functools.lru_cache(maxsize=32)
+def frequency_axis(size, sample_rate, center_freq=0.0):
+    """
+    Frequency (Hz) of every bin of an fftshifted spectrum of `size` bins
+    spanning `sample_rate`, plus center_freq. Cached per (size, rate, centre)
+    and read-only, since the same array is shared by every capture.
+    """
+    axis = np.fft.fftshift(np.fft.fftfreq(size, 1 / sample_rate)) + center_freq
+    axis.flags.writeable = False
+    return axis
+
+def power_statistics(power, occupied_db=OCCUPIED_DB, reference=None):
+    """
+    Moment and order statistics of a dB spectrum in one sweep of reductions:
+    peak/min, median (noise floor), mean, std, biased skewness and Fisher
+    kurtosis (as scipy.stats defaults), and the number of bins more than
+    `occupied_db` above `reference` (the median by default, or a per-bin
+    noise level such as cfar.spectrum_noise()).
+    """
+    power = np.asarray(power)
+    n = power.size
+    mean = float(np.add.reduce(power, dtype=np.float64)) / n
+    # Deviations stay in the spectrum's dtype: for float32 spectra the half-size
+    # temporaries are worth more than the last digits of kurtosis
+    dtype = power.dtype if power.dtype.kind == 'f' else np.float64
+    d = np.subtract(power, mean, dtype=dtype)
+    d2 = d * d
+    m2 = float(np.add.reduce(d2, dtype=np.float64)) / n
+    m3 = float(np.dot(d2, d)) / n
+    m4 = float(np.dot(d2, d2)) / n
+    noise_floor = median(power)
+    if m2 > 0:
+        skewness = m3 / m2 ** 1.5
+        kurt = m4 / (m2 * m2) - 3.0
+    else:
+        skewness = kurt = 0.0
+    if reference is None:
+        reference = noise_floor
+    return {
+        'peak_power': float(power.max()),
+        'min_power': float(power.min()),
+        'noise_floor': noise_floor,
+        'mean_power': mean,
+        'std_power': m2 ** 0.5,
+        'skewness': skewness,
+        'kurtosis': kurt,
+        'occupied_bins': int(np.count_nonzero(power > reference + occupied_db))
+    }
+
+def basic_features(power, bin_width, noise=None, occupied_db=OCCUPIED_DB):
+    """
+    Power statistics of one channel spectrum, shared by listen.py and
+    collect_baseline.py so live and baseline measurements agree. Bandwidth and
+    num_peaks count the bins `occupied_db` above `noise` (a per-bin noise
+    level), or above the median when it is None; bin_width is in Hz.
+    """
+    stats = power_statistics(power, occupied_db, noise)
+    return {
+        'peak_power': stats['peak_power'],
+        'noise_floor': stats['noise_floor'],
+        'mean_power': stats['mean_power'],
+        'std_power': stats['std_power'],
+        'min_power': stats['min_power'],
+        'max_power': stats['peak_power'],
+        'snr': stats['peak_power'] - stats['noise_floor'],
+        'kurtosis': stats['kurtosis'],
+        'skewness': stats['skewness'],
+        'bandwidth': float(stats['occupied_bins'] * bin_width),
+        'num_peaks': stats['occupied_bins']
+    }
+
+def stored_spectrum_peaks(spectrum, center_freq, span):
+    """
+    Indices and frequencies (MHz) of bins 6 dB above the median of a stored
+    (downsampled, fftshifted) spectrum that covers `span` Hz around center_freq:
+    the capture rate for single-channel rows, the channel's sub-band for
+    grouped ones.
+    """
+    spectrum = np.asarray(spectrum, dtype=np.float32)
+    if not len(spectrum):
+        return [], []
+    peaks = np.where(spectrum > np.median(spectrum) + 6)[0]
+    freqs = frequency_axis(len(spectrum), float(span), float(center_freq or 0.0))
+    return peaks.tolist(), (freqs[peaks] / 1e6).tolist()
+
+def spectral_shape(power, freqs):
+    """Centroid, 85% rolloff and flux of a dB spectrum over the matching `freqs` axis."""
+    # exp() is several times cheaper than 10**x and keeps float32 spectra in float32
+    power_linear = np.exp(power * DB_TO_NATURAL)
+    total = float(np.add.reduce(power_linear))
+    features = {
+        'spectral_centroid': float(np.dot(freqs, power_linear) / total) if total > 0 else 0.0,
+        'spectral_rolloff': 0.0,
+        'spectral_flux': 0.0
+    }
+    if len(power_linear):
+        # cumsum is non-decreasing, so the first bin past 85% is a binary search
+        cumsum_power = np.cumsum(power_linear)
+        idx = int(np.searchsorted(cumsum_power, 0.85 * cumsum_power[-1]))
+        if idx < len(freqs):
+            features['spectral_rolloff'] = float(freqs[idx])
+    if len(power) > 1:
+        diff = np.diff(power)
+        features['spectral_flux'] = float(np.dot(diff, diff))
+    return features
+
+def local_maxima(power, height):
+    """
+    Indices of bins strictly greater than both neighbours and than `height`
+    (a scalar or one value per bin), from three vectorised comparisons (the
+    numpy equivalent of scipy.signal.find_peaks(power, height=height) without
+    plateau handling).
+    """
+    power = np.asarray(power)
+    if power.size < 3:
+        return np.array([], dtype=np.intp)
+    height = np.asarray(height)
+    mid = power[1:-1]
+    mask = mid > power[:-2]
+    mask &= mid > power[2:]
+    mask &= mid > (height[1:-1] if height.ndim else height)
+    return np.flatnonzero(mask) + 1
+
+class SpectrumPeaks:
+    """
+    Local maxima of one spectrum more than `offset` dB above `reference` (the
+    noise floor, or a per-bin noise level such as cfar.spectrum_noise()),
+    found once at the lowest offset any consumer needs. count(), above() and
+    strongest() give the peak set for a higher offset from the (much smaller)
+    peak arrays instead of another pass over the spectrum.
+    """
+
+    def __init__(self, power, reference, offset):
+        power = np.asarray(power)
+        reference = np.asarray(reference)
+        self.offset = offset
+        self.indices = local_maxima(power, reference + offset)
+        self.heights = power[self.indices]
+        # Height of each peak over its own reference
+        self.excess = self.heights - (reference[self.indices] if reference.ndim else reference)
+
+    def _mask(self, offset):
+        if offset < self.offset:
+            raise ValueError(f"Peaks were only collected {self.offset:.1f} dB above the reference")
+        return self.excess > offset
+
+    def count(self, offset):
+        """Number of peaks more than `offset` dB above the reference (not below the construction offset)."""
+        return int(np.count_nonzero(self._mask(offset)))
+
+    def above(self, offset):
+        """Indices of peaks more than `offset` dB above the reference, in frequency order."""
+        return self.indices[self._mask(offset)]
+
+    def strongest(self, offset, limit=10):
+        """Indices of at most `limit` peaks more than `offset` dB above the reference, strongest first."""
+        mask = self._mask(offset)
+        indices, heights = self.indices[mask], self.heights[mask]
+        if len(indices) > limit:
+            # Only the top `limit` need ordering
+            top = np.argpartition(heights, -limit)[-limit:]
+            indices, heights = indices[top], heights[top]
+        return indices[np.argsort(-heights, kind='stable')]
@@ -0,0 +1,105 @@
+"""
+Cross-channel analysis of one listener sweep.
+Each channel visited in a sweep contributes one row (noise floor, SNR, peak
+power) to a matrix that is compared with every channel's running reference
+in one vectorised step. When a large share of the channel plan deviates the
+same way at once (a common noise-floor shift, a simultaneous SNR or power
+rise) the sweep is a broadband event: the listener records it once instead
+of one detection row per channel, and the channels it explains skip the
+per-channel feature pipeline.
+
+    BROADBAND_FRACTION=0.3 BROADBAND_NOISE_DB=2 python listen.py
+    BROADBAND=0 python listen.py                 # per-channel detections only
+"""
+
+import os
+import numpy as np
+
+BROADBAND_ENABLED = os.getenv('BROADBAND', '1') == '1'
+# Share of the channel plan (and minimum channel count) that must deviate together
+BROADBAND_FRACTION = float(os.getenv('BROADBAND_FRACTION', '0.5'))
+BROADBAND_MIN_CHANNELS = int(os.getenv('BROADBAND_MIN_CHANNELS', '3'))
+BROADBAND_NOISE_DB = float(os.getenv('BROADBAND_NOISE_DB', '3.0'))
+BROADBAND_SNR_DB = float(os.getenv('BROADBAND_SNR_DB', '6.0'))
+BROADBAND_POWER_DB = float(os.getenv('BROADBAND_POWER_DB', '6.0'))
+
+# Matrix columns; the noise floor counts shifts either way, the others only rises
+SWEEP_FEATURES = ('noise_floor', 'snr', 'peak_power')
+ALPHA = 0.1  # weight of a new undisturbed visit in a channel's reference
+
+class BroadbandEvent:
+    """Outcome of one sweep whose channels deviated together."""
+
+    def __init__(self, features, channels, explained, fraction, shifts, span):
+        self.features = features      # SWEEP_FEATURES that crossed the threshold together
+        self.channels = channels      # (freq, label) of every deviating channel
+        self.explained = explained    # set of (freq, label) whose own detection is redundant
+        self.fraction = fraction      # deviating share of the channel plan
+        self.shifts = shifts          # median deviation (dB) per feature over the deviating channels
+        self.span = span              # (lowest, highest) deviating channel frequency
+
+    @property
+    def label(self):
+        return 'broadband_' + '_'.join(self.features)
+
+class SweepAnalyzer:
+    """
+    Running per-channel references for the whole channel plan, indexed once,
+    so each sweep's comparison is a handful of array operations.
+    """
+
+    def __init__(self, channels, fraction=BROADBAND_FRACTION, min_channels=BROADBAND_MIN_CHANNELS,
+                 thresholds=(BROADBAND_NOISE_DB, BROADBAND_SNR_DB, BROADBAND_POWER_DB)):
+        self.index = {channel: i for i, channel in enumerate(channels)}
+        self.reference = np.full((len(channels), len(SWEEP_FEATURES)), np.nan)
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.fraction = fraction
+        self.min_channels = min_channels
+        self.events = 0
+        self.suppressed = 0
+
+    def analyze(self, rows):
+        """
+        rows maps (freq, label) -> {feature: value} for the channels visited
+        this sweep. Returns a BroadbandEvent or None, and folds undisturbed
+        channels into their references.
+        """
+        keys = [key for key in rows if key in self.index]
+        if not keys:
+            return None
+        idx = np.fromiter((self.index[key] for key in keys), dtype=np.intp, count=len(keys))
+        matrix = np.array([[rows[key][f] for f in SWEEP_FEATURES] for key in keys], dtype=float)
+        deviation = matrix - self.reference[idx]
+        deviation[:, 0] = np.abs(deviation[:, 0])
+        # NaN (no reference yet) compares False, so new channels never deviate
+        deviating = deviation >= self.thresholds
+        # Channels the plan did not visit (e.g. skipped by the pre-screen) count as undisturbed
+        needed = max(self.min_channels, self.fraction * len(self.index))
+        triggered = np.flatnonzero(deviating.sum(axis=0) >= needed)
+
+        # References follow only the channels this sweep left undisturbed
+        quiet = ~deviating.any(axis=1)
+        reference = self.reference[idx]
+        updated = np.where(np.isnan(reference), matrix, reference + ALPHA * (matrix - reference))
+        self.reference[idx[quiet]] = updated[quiet]
+        if not len(triggered):
+            return None
+
+        hit = deviating[:, triggered].any(axis=1)
+        explained = hit.copy()
+        snr = SWEEP_FEATURES.index('snr')
+        if snr not in triggered:
+            # A noise-floor or power event does not explain a channel whose SNR rose on its own
+            explained &= ~deviating[:, snr]
+        freqs = np.array([key[0] for key in keys], dtype=float)[hit]
+        shifts = {SWEEP_FEATURES[f]: float(np.median(matrix[hit, f] - self.reference[idx[hit], f]))
+                  for f in range(len(SWEEP_FEATURES))}
+        self.events += 1
+        return BroadbandEvent(
+            features=[SWEEP_FEATURES[f] for f in triggered],
+            channels=[key for key, h in zip(keys, hit) if h],
+            explained={key for key, e in zip(keys, explained) if e},
+            fraction=float(hit.sum()) / len(self.index),
+            shifts=shifts,
+            span=(float(freqs.min()), float(freqs.max()))
+        )
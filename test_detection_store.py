@@ -0,0 +1,26 @@
+"""
+Paged and counted reads across the classic and ML detection stores when the
+ML listener's database does not exist yet.
+"""
+
+import sqlite3
+from detection_store import attach_ml, union_count, union_page
+
+def _classic_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE detections (id INTEGER PRIMARY KEY, timestamp TEXT, freq REAL, label TEXT)')
+    conn.executemany('INSERT INTO detections (timestamp, freq, label) VALUES (?, ?, ?)',
+                     [('2025-01-01T00:00:0%d' % i, 95e6 + i, 'wfm') for i in range(3)])
+    attach_ml(conn, '/nonexistent/detections_ml.db')
+    return conn
+
+def test_ml_page_without_ml_database():
+    conn = _classic_db()
+    assert union_page(conn, 'ml', '', [], 'timestamp', 'DESC', 10, 0) == []
+    assert union_count(conn, 'ml', '', []) == 0
+
+def test_all_page_without_ml_database_is_classic_rows():
+    conn = _classic_db()
+    rows = union_page(conn, 'all', ' AND freq > ?', [95e6], 'timestamp', 'DESC', 10, 0)
+    assert [row[-1] for row in rows] == ['classic', 'classic']
+    assert union_count(conn, 'all', ' AND freq > ?', [95e6]) == 2
@@ -0,0 +1,43 @@
+"""
+Peak frequencies of stored power spectra: single-channel rows span the
+capture rate, grouped-channel rows only their channel's sub-band.
+"""
+
+import numpy as np
+from channel_plan import plan_capture_groups, spectrum_span, channel_width
+from signal_features import stored_spectrum_peaks
+
+SAMPLE_RATE = 2.048e6
+PMR446 = [(446000000, "walkie_pmr446"), (446050000, "walkie_pmr446"),
+          (446100000, "walkie_pmr446"), (446150000, "walkie_pmr446")]
+
+def _spectrum_with_peak(index, size=512):
+    spectrum = np.zeros(size, dtype=np.float32)
+    spectrum[index] = 20.0
+    return spectrum
+
+def test_grouped_channel_span_is_channel_width():
+    tasks = plan_capture_groups(PMR446, SAMPLE_RATE, enabled=True)
+    assert len(tasks) == 1
+    assert spectrum_span(446050000, "walkie_pmr446", tasks, SAMPLE_RATE) == channel_width("walkie_pmr446")
+
+def test_single_channel_span_is_sample_rate():
+    tasks = plan_capture_groups([(95000000, "wfm")] + PMR446, SAMPLE_RATE, enabled=True)
+    assert spectrum_span(95000000, "wfm", tasks, SAMPLE_RATE) == SAMPLE_RATE
+    # Channels missing from the plan fall back to the capture rate
+    assert spectrum_span(123000000, "wfm", tasks, SAMPLE_RATE) == SAMPLE_RATE
+
+def test_sub_band_row_peak_frequency():
+    # 64 bins above the centre of a 512-point spectrum covering 12.5 kHz
+    span = channel_width("walkie_pmr446")
+    peaks, freqs_mhz = stored_spectrum_peaks(_spectrum_with_peak(256 + 64), 446050000, span)
+    assert peaks == [320]
+    assert abs(freqs_mhz[0] * 1e6 - (446050000 + 64 * span / 512)) < 1.0
+
+def test_full_capture_row_peak_frequency():
+    peaks, freqs_mhz = stored_spectrum_peaks(_spectrum_with_peak(256 + 64), 95000000, SAMPLE_RATE)
+    assert peaks == [320]
+    assert abs(freqs_mhz[0] * 1e6 - (95000000 + 64 * SAMPLE_RATE / 512)) < 1.0
+
+def test_empty_spectrum():
+    assert stored_spectrum_peaks([], 95000000, SAMPLE_RATE) == ([], [])